@@ -0,0 +1,68 @@
+"""The current time, for everything that reads it.
+
+Code calls `clock.time()`, `clock.now(tz)` and `clock.today()` instead of
+time.time()/datetime.now()/date.today(). By default these are the wall
+clock; `clock.use(VirtualClock(...))` swaps in a clock that only moves
+when advanced, so the scheduler can be simulated faster than real time.
+"""
+import datetime
+import time as _time
+from typing import Optional
+
+
+class Clock:
+    """Wall clock"""
+
+    def time(self) -> float:
+        return _time.time()
+
+    def now(self, tz: Optional[datetime.tzinfo] = None) -> datetime.datetime:
+        return datetime.datetime.now(tz)
+
+    def today(self) -> datetime.date:
+        return datetime.date.today()
+
+
+class VirtualClock(Clock):
+    """Clock that stands still until advanced (simulation)"""
+
+    def __init__(self, start: float):
+        self.current = start
+
+    def time(self) -> float:
+        return self.current
+
+    def now(self, tz: Optional[datetime.tzinfo] = None) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.current, tz)
+
+    def today(self) -> datetime.date:
+        return datetime.datetime.fromtimestamp(self.current).date()
+
+    def advance_to(self, when: float) -> None:
+        self.current = max(self.current, when)
+
+
+_clock: Clock = Clock()
+
+
+def use(new_clock: Clock) -> Clock:
+    """Make new_clock the current clock; returns the previous one"""
+    global _clock
+    previous, _clock = _clock, new_clock
+    return previous
+
+
+def current() -> Clock:
+    return _clock
+
+
+def time() -> float:
+    return _clock.time()
+
+
+def now(tz: Optional[datetime.tzinfo] = None) -> datetime.datetime:
+    return _clock.now(tz)
+
+
+def today() -> datetime.date:
+    return _clock.today()
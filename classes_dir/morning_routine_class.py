@@ -1,6 +1,10 @@
 import datetime
 import pytz
-from typing import List, Dict, Optional
+from typing import List, Optional
+from classes_dir import clock
+from classes_dir.notified_marks import NotifiedMarks
+from classes_dir.routine_history import RoutineHistory, last_completed_day, last_history_day
+from classes_dir.window_bounds import WindowMixin
 
 class RoutineTask:
     def __init__(self, name: str, duration: int, optional: bool = False, notes: str = ""):
@@ -15,7 +19,7 @@ class RoutineTask:
     
     def mark_complete(self):
         self.completed = True
-        self.completed_at = datetime.datetime.now(pytz.UTC)
+        self.completed_at = clock.now(pytz.UTC)
     
     def reset(self):
         self.completed = False
@@ -42,14 +46,14 @@ class RoutineTask:
             task.completed_at = datetime.datetime.fromisoformat(data['completed_at'])
         return task
 
-class MorningRoutine:
+class MorningRoutine(WindowMixin):
     def __init__(self, chat_id: int):
         self.chat_id = chat_id
         self.tasks: List[RoutineTask] = []
         self.current_streak = 0
         self.best_streak = 0
         self.total_completions = 0
-        self.history: Dict[str, Dict] = {}
+        self.history = RoutineHistory()  # date -> {completion, duration, tasks, ...}
         self.routine_started = False
         self.start_time = None
         self.is_setup_complete = False
@@ -71,6 +75,12 @@ class MorningRoutine:
         self.followup_hour = 21
         self.followup_minute = 0
         self.followup_message = "Plan tomorrow"
+        # Scheduler rules already sent today (dedup across restarts)
+        self.notified = NotifiedMarks()
+        # UTC date of the user's last inbound update (activity tiering)
+        self.last_seen = clock.now(pytz.UTC).date().isoformat()
+        # Bot blocked by the user: nothing is sent until they write again
+        self.blocked = False
     
     def add_task(self, name: str, duration: int, optional: bool = False, notes: str = "") -> tuple[bool, str]:
         """Add task with validation. Returns (success, error_message)"""
@@ -132,7 +142,7 @@ class MorningRoutine:
         if not self.can_start_routine():
             return False
         self.routine_started = True
-        self.start_time = datetime.datetime.now(pytz.UTC)
+        self.start_time = clock.now(pytz.UTC)
         self.paused = False
         self.total_pause_duration = 0
         self.current_task_sent_at = None
@@ -144,34 +154,28 @@ class MorningRoutine:
     
     def can_start_routine(self) -> bool:
         """Check if within time window and not already done today"""
-        user_tz = pytz.timezone(self.timezone)
-        now = datetime.datetime.now(user_tz)
-        today = now.date().isoformat()
-        
         # Check if already completed today
-        if today in self.history:
+        if self.local_today() in self.history:
             return False
         
-        # Check time window with minutes
-        current_minutes = now.hour * 60 + now.minute
-        start_minutes = self.window_start * 60 + self.window_start_minute
-        end_minutes = self.window_end * 60 + self.window_end_minute
-        
-        return start_minutes <= current_minutes < end_minutes
+        return self.in_window()
     
     def pause_routine(self):
         """Pause routine"""
         if self.routine_started and not self.paused:
             self.paused = True
-            self.pause_time = datetime.datetime.now(pytz.UTC)
+            self.pause_time = clock.now(pytz.UTC)
             return True
         return False
     
     def resume_routine(self):
         """Resume routine"""
         if self.routine_started and self.paused:
-            pause_duration = (datetime.datetime.now(pytz.UTC) - self.pause_time).total_seconds()
+            pause_duration = (clock.now(pytz.UTC) - self.pause_time).total_seconds()
             self.total_pause_duration += pause_duration
+            if self.current_task_sent_at:
+                # The pause doesn't count against the current task's time
+                self.current_task_sent_at += datetime.timedelta(seconds=pause_duration)
             self.paused = False
             self.pause_time = None
             return True
@@ -207,10 +211,10 @@ class MorningRoutine:
         completion = self.get_completion_percentage()
         
         # Calculate actual duration (excluding pauses)
-        total_seconds = (datetime.datetime.now(pytz.UTC) - self.start_time).total_seconds()
+        total_seconds = (clock.now(pytz.UTC) - self.start_time).total_seconds()
         active_duration = (total_seconds - self.total_pause_duration) / 60
         
-        today = datetime.date.today().isoformat()
+        today = clock.today().isoformat()
         
         # Save history with CURRENT task states (before reset)
         self.history[today] = {
@@ -245,44 +249,62 @@ class MorningRoutine:
     def mark_day_failed(self):
         """Called when user admits they didn't complete everything"""
         user_tz = pytz.timezone(self.timezone)
-        today = datetime.datetime.now(user_tz).date().isoformat()
+        today = clock.now(user_tz).date().isoformat()
         if today in self.history:
-            self.history[today]['completion'] = 0
-            self.history[today]['honest_fail'] = True
+            self.history.set_fields(today, completion=0, honest_fail=True)
         self.current_streak = 0
         self.awaiting_honesty_check = False
     
-    def check_missed_routine(self):
-        user_tz = pytz.timezone(self.timezone)
-        now = datetime.datetime.now(user_tz)
-        today = now.date().isoformat()
+    def check_missed_routine(self, day: Optional[str] = None):
+        """Record a day without a routine as missed: today once its window closed, or a given past day"""
+        today = self.local_today()
+        if day is None:
+            if not self.window_closed():
+                return
+            day = today
         
-        # Check if past window end
-        current_minutes = now.hour * 60 + now.minute
-        end_minutes = self.window_end * 60 + self.window_end_minute
-        
-        if current_minutes >= end_minutes and today not in self.history:
-            self.history[today] = {
+        if day not in self.history:
+            self.history[day] = {
                 'completion': 0,
                 'duration': 0,
                 'tasks': [],
                 'missed': True
             }
             self.current_streak = 0
+            if day != today:
+                return  # Checked after midnight: the new day's routine is left alone
             # Reset tasks for next day
             for task in self.tasks:
                 task.reset()
             self.routine_started = False
             self.start_time = None
     
+    def drop_stale_routine(self, day: str):
+        """A routine still running from an earlier local day (bot was down at its window end): that day is missed"""
+        if day not in self.history:
+            self.history[day] = {
+                'completion': 0,
+                'duration': 0,
+                'tasks': [],
+                'missed': True
+            }
+        self.current_streak = 0
+        for task in self.tasks:
+            task.reset()
+        self.routine_started = False
+        self.start_time = None
+        self.paused = False
+        self.pause_time = None
+        self.total_pause_duration = 0
+        self.current_task_sent_at = None
+        self.in_buffer = False
+    
     def get_weekly_stats(self):
-        last_7_days = []
-        for i in range(6, -1, -1):
-            date = (datetime.date.today() - datetime.timedelta(days=i)).isoformat()
-            last_7_days.append(self.history.get(date, {'completion': 0}))
+        today = clock.today()
+        last_7_days = self.history.completions(today - datetime.timedelta(days=6), today)
         
-        completed_days = sum(1 for d in last_7_days if d.get('completion', 0) >= 100)
-        avg_completion = sum(d.get('completion', 0) for d in last_7_days) / 7
+        completed_days = sum(1 for c in last_7_days if c >= 100)
+        avg_completion = sum(last_7_days) / 7
         
         return {
             'completed_days': completed_days,
@@ -300,7 +322,7 @@ class MorningRoutine:
                 elapsed = (self.pause_time - self.start_time).total_seconds() / 60
                 header = f"PAUSED · {int(elapsed)}m"
             else:
-                elapsed = (datetime.datetime.now(pytz.UTC) - self.start_time).total_seconds() / 60
+                elapsed = (clock.now(pytz.UTC) - self.start_time).total_seconds() / 60
                 elapsed -= (self.total_pause_duration / 60)
                 header = f"ROUTINE · {int(elapsed)}m"
         else:
@@ -393,7 +415,7 @@ class MorningRoutine:
             'current_streak': self.current_streak,
             'best_streak': self.best_streak,
             'total_completions': self.total_completions,
-            'history': self.history,
+            'history': self.history.to_dict(),  # Copy: may be written from another thread
             'routine_started': self.routine_started,
             'start_time': self.start_time.isoformat() if self.start_time else None,
             'is_setup_complete': self.is_setup_complete,
@@ -412,7 +434,10 @@ class MorningRoutine:
             'followup_enabled': self.followup_enabled,
             'followup_hour': self.followup_hour,
             'followup_minute': self.followup_minute,
-            'followup_message': self.followup_message
+            'followup_message': self.followup_message,
+            'notified': self.notified.to_dict(),
+            'last_seen': self.last_seen,
+            'blocked': self.blocked
         }
 
     @classmethod
@@ -422,7 +447,7 @@ class MorningRoutine:
         routine.current_streak = data.get('current_streak', 0)
         routine.best_streak = data.get('best_streak', 0)
         routine.total_completions = data.get('total_completions', 0)
-        routine.history = data.get('history', {})
+        routine.history = RoutineHistory.from_dict(data.get('history'))
         routine.routine_started = data.get('routine_started', False)
         if data.get('start_time'):
             routine.start_time = datetime.datetime.fromisoformat(data['start_time'])
@@ -445,4 +470,55 @@ class MorningRoutine:
         routine.followup_hour = data.get('followup_hour', 21)
         routine.followup_minute = data.get('followup_minute', 0)
         routine.followup_message = data.get('followup_message', 'Plan tomorrow')
-        return routine
\ No newline at end of file
+        routine.notified = NotifiedMarks.from_dict(data.get('notified'))
+        # Saved before last_seen existed: the last completed day is the best guess
+        routine.last_seen = data.get('last_seen') or last_completed_day(data.get('history'))
+        routine.blocked = data.get('blocked', False)
+        return routine
+
+
+class RoutineHeader(WindowMixin):
+    """Compact per-user summary the scheduler can read without hydrating a routine"""
+
+    FIELDS = ['chat_id', 'timezone', 'window_start', 'window_start_minute', 'window_end',
+              'window_end_minute', 'is_setup_complete', 'routine_started', 'awaiting_honesty_check',
+              'followup_enabled', 'followup_hour', 'followup_minute', 'last_day', 'notified', 'last_seen',
+              'blocked']
+    DEFAULTS = {'timezone': 'Europe/Helsinki', 'window_start': 5, 'window_start_minute': 0,
+                'window_end': 11, 'window_end_minute': 0, 'is_setup_complete': False,
+                'routine_started': False, 'awaiting_honesty_check': False, 'followup_enabled': False,
+                'followup_hour': 21, 'followup_minute': 0, 'last_day': None, 'notified': None,
+                'last_seen': None, 'blocked': False}
+
+    __slots__ = FIELDS + ['_window']
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field, self.DEFAULTS.get(field)))
+        if not isinstance(self.notified, NotifiedMarks):
+            self.notified = NotifiedMarks.from_dict(self.notified)
+        self._window = None
+
+    @classmethod
+    def from_routine(cls, routine: MorningRoutine) -> 'RoutineHeader':
+        values = {field: getattr(routine, field) for field in cls.FIELDS if field != 'last_day'}
+        values['last_day'] = routine.history.last_day()
+        values['notified'] = routine.notified.copy()
+        return cls(**values)
+
+    @classmethod
+    def from_routine_dict(cls, data: dict) -> 'RoutineHeader':
+        """Same header straight from MorningRoutine.to_dict() output"""
+        values = {field: data[field] for field in cls.FIELDS if field in data}
+        values['last_day'] = last_history_day(data.get('history'))
+        values['last_seen'] = data.get('last_seen') or last_completed_day(data.get('history'))
+        return cls(**values)
+
+    def to_dict(self) -> dict:
+        values = {field: getattr(self, field) for field in self.FIELDS}
+        values['notified'] = self.notified.to_dict()
+        return values
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RoutineHeader':
+        return cls(**data)
@@ -0,0 +1,50 @@
+from typing import Iterable, Optional
+
+
+class NotifiedMarks:
+    """Notification rules already sent to one user on one local day.
+
+    Only the latest day is kept in full. Rules of the day before may still
+    fire after midnight (window end + 30 minutes), so when a new day starts
+    the old day's names stay as `rule@day` until the next change of day.
+    Older marks are dropped and never count as sent, so each user holds at
+    most two days' worth of rule names, in memory and on disk.
+    """
+
+    __slots__ = ('day', 'rules')
+
+    def __init__(self, day: Optional[str] = None, rules: Iterable[str] = ()):
+        self.day = day
+        self.rules = set(rules)
+
+    def sent(self, rule: str, day: str) -> bool:
+        if self.day is not None and day < self.day:
+            return f"{rule}@{day}" in self.rules
+        return day == self.day and rule in self.rules
+
+    def mark(self, rule: str, day: str) -> None:
+        if self.day is not None and day < self.day:
+            self.rules.add(f"{rule}@{day}")  # Late rule of an earlier day: keep today's marks
+            return
+        if day != self.day:
+            # Today's names of a day that just ended become late marks of that day
+            self.rules = {f"{name}@{self.day}" for name in self.rules if '@' not in name} if self.day else set()
+            self.day = day
+        self.rules.add(rule)
+
+    def copy(self) -> 'NotifiedMarks':
+        return NotifiedMarks(self.day, self.rules)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, NotifiedMarks) and (self.day, self.rules) == (other.day, other.rules)
+
+    def to_dict(self) -> Optional[dict]:
+        if self.day is None:
+            return None
+        return {'day': self.day, 'rules': sorted(self.rules)}
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'NotifiedMarks':
+        if not data:
+            return cls()
+        return cls(data.get('day'), data.get('rules', ()))
@@ -0,0 +1,280 @@
+import datetime
+import pytz
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, List, Optional
+
+# Keys of an encoded day that replace the legacy 'tasks' list
+ENCODED_KEYS = ('v', 'ok', 'sk', 'b', 'o')
+HISTORY_FORMAT = 2
+
+# Bits of the per-day flags column
+DAY_PRESENT = 1
+DAY_MISSED = 2
+DAY_HONEST_FAIL = 4
+
+
+def _zeros(typecode: str, count: int) -> array:
+    return array(typecode, [0]) * count
+
+
+class RoutineHistory(MutableMapping):
+    """Day -> history entry mapping with deduplicated storage.
+
+    Legacy history kept a full copy of every task (name, duration, notes...)
+    for every day. Here each distinct task list is interned once per
+    routine as a definition version, and a day only keeps:
+
+        v   definition version id
+        ok  bitmap of completed tasks
+        sk  bitmap of skipped tasks
+        b   base UTC timestamp (seconds) of the day's completions
+        o   per-task completion offset from `b` in seconds, -1 = none
+
+    Reads decode back to the legacy dict shape, so `history[day]['tasks']`
+    and `history.get(day, {})` keep working as a compatibility view.
+
+    Alongside, completion, duration and flags are kept as columns indexed
+    by day ordinal (`first_ordinal` is index 0), so range stats are array
+    slices instead of one date string and dict lookup per day.
+    """
+
+    def __init__(self):
+        self.defs: List[list] = []  # Definition versions: [[name, duration, optional, notes], ...]
+        self._def_ids: Dict[tuple, int] = {}
+        self.days: Dict[str, dict] = {}  # Encoded entries
+        self.task_rows = 0  # Task rows across all days, kept up to date as days change
+        # Columns
+        self.first_ordinal = 0
+        self.completion = array('d')
+        self.duration = array('l')
+        self.flags = array('B')
+
+    # ── encoding ────────────────────────────────────────────────
+
+    def _intern(self, tasks: List[dict]) -> int:
+        key = tuple((t['name'], t['duration'], t.get('optional', False), t.get('notes', '')) for t in tasks)
+        def_id = self._def_ids.get(key)
+        if def_id is None:
+            def_id = len(self.defs)
+            self.defs.append([list(task) for task in key])
+            self._def_ids[key] = def_id
+        return def_id
+
+    def encode(self, entry: dict) -> dict:
+        """Legacy entry (with a 'tasks' list of task dicts) -> compact entry"""
+        encoded = {k: v for k, v in entry.items() if k != 'tasks'}
+        tasks = entry.get('tasks') or []
+        if not tasks:
+            return encoded
+
+        encoded['v'] = self._intern(tasks)
+        completed = skipped = 0
+        stamps = []
+        for i, task in enumerate(tasks):
+            if task.get('completed'):
+                completed |= 1 << i
+            if task.get('skipped'):
+                skipped |= 1 << i
+            stamp = task.get('completed_at')
+            stamps.append(int(datetime.datetime.fromisoformat(stamp).timestamp()) if stamp else None)
+        if completed:
+            encoded['ok'] = completed
+        if skipped:
+            encoded['sk'] = skipped
+        known = [s for s in stamps if s is not None]
+        if known:
+            base = min(known)
+            encoded['b'] = base
+            encoded['o'] = [s - base if s is not None else -1 for s in stamps]
+        return encoded
+
+    def decode(self, encoded: dict) -> dict:
+        """Compact entry -> legacy entry shape"""
+        entry = {k: v for k, v in encoded.items() if k not in ENCODED_KEYS}
+        tasks = []
+        if 'v' in encoded:
+            completed = encoded.get('ok', 0)
+            skipped = encoded.get('sk', 0)
+            base = encoded.get('b')
+            offsets = encoded.get('o')
+            for i, (name, duration, optional, notes) in enumerate(self.defs[encoded['v']]):
+                completed_at = None
+                if offsets and offsets[i] >= 0:
+                    completed_at = datetime.datetime.fromtimestamp(base + offsets[i], pytz.UTC).isoformat()
+                tasks.append({
+                    'name': name,
+                    'duration': duration,
+                    'optional': optional,
+                    'notes': notes,
+                    'completed': bool(completed >> i & 1),
+                    'completed_at': completed_at,
+                    'skipped': bool(skipped >> i & 1)
+                })
+        entry['tasks'] = tasks
+        return entry
+
+    # ── columns ─────────────────────────────────────────────────
+
+    def _index(self, ordinal: int) -> int:
+        """Column index of a day ordinal, growing the columns to cover it"""
+        if not self.flags:
+            self.first_ordinal = ordinal
+        if ordinal < self.first_ordinal:
+            pad = self.first_ordinal - ordinal
+            self.completion[0:0] = _zeros('d', pad)
+            self.duration[0:0] = _zeros('l', pad)
+            self.flags[0:0] = _zeros('B', pad)
+            self.first_ordinal = ordinal
+        index = ordinal - self.first_ordinal
+        if index >= len(self.flags):
+            pad = index + 1 - len(self.flags)
+            self.completion.extend(_zeros('d', pad))
+            self.duration.extend(_zeros('l', pad))
+            self.flags.extend(_zeros('B', pad))
+        return index
+
+    def _rows(self, entry: Optional[dict]) -> int:
+        return len(self.defs[entry['v']]) if entry and 'v' in entry else 0
+
+    def _update_columns(self, day: str) -> None:
+        index = self._index(datetime.date.fromisoformat(day).toordinal())
+        entry = self.days.get(day)
+        if entry is None:
+            self.completion[index] = 0
+            self.duration[index] = 0
+            self.flags[index] = 0
+            return
+        self.completion[index] = entry.get('completion', 0)
+        self.duration[index] = int(entry.get('duration', 0))
+        self.flags[index] = (DAY_PRESENT |
+                             (DAY_MISSED if entry.get('missed') else 0) |
+                             (DAY_HONEST_FAIL if entry.get('honest_fail') else 0))
+
+    def _slice(self, column: array, start: datetime.date, end: datetime.date) -> array:
+        """Column values for start..end inclusive, zero outside recorded days"""
+        lo = start.toordinal() - self.first_ordinal
+        hi = end.toordinal() - self.first_ordinal + 1
+        if hi <= lo:
+            return array(column.typecode)
+        values = _zeros(column.typecode, hi - lo)
+        src_lo, src_hi = max(lo, 0), min(hi, len(column))
+        if src_lo < src_hi:
+            values[src_lo - lo:src_hi - lo] = column[src_lo:src_hi]
+        return values
+
+    def completions(self, start: datetime.date, end: datetime.date) -> array:
+        return self._slice(self.completion, start, end)
+
+    def durations(self, start: datetime.date, end: datetime.date) -> array:
+        return self._slice(self.duration, start, end)
+
+    def day_flags(self, start: datetime.date, end: datetime.date) -> array:
+        return self._slice(self.flags, start, end)
+
+    def count_at_least(self, start: datetime.date, end: datetime.date, threshold: float) -> int:
+        return sum(1 for c in self.completions(start, end) if c >= threshold)
+
+    # ── mapping API (decoded view) ──────────────────────────────
+
+    def __getitem__(self, day: str) -> dict:
+        return self.decode(self.days[day])
+
+    def __setitem__(self, day: str, entry: dict) -> None:
+        encoded = self.encode(entry)
+        self.task_rows += self._rows(encoded) - self._rows(self.days.get(day))
+        self.days[day] = encoded
+        self._update_columns(day)
+
+    def __delitem__(self, day: str) -> None:
+        self.task_rows -= self._rows(self.days.pop(day))
+        self._update_columns(day)
+
+    def __contains__(self, day) -> bool:
+        return day in self.days
+
+    def __iter__(self):
+        return iter(self.days)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def set_fields(self, day: str, **fields) -> None:
+        """Update scalar fields of a stored day (decoded dicts are copies)"""
+        entry = self.days[day]
+        self.task_rows -= self._rows(entry)
+        entry.update(fields)
+        self.task_rows += self._rows(entry)
+        self._update_columns(day)
+
+    def estimated_tasks(self) -> int:
+        """Task rows across all days, without decoding any"""
+        return self.task_rows
+
+    def last_day(self) -> Optional[str]:
+        """Latest recorded day, from the end of the flags column (past any days deleted there)"""
+        index = len(self.flags) - 1
+        while index >= 0 and not self.flags[index] & DAY_PRESENT:
+            index -= 1
+        if index < 0:
+            return None
+        return datetime.date.fromordinal(self.first_ordinal + index).isoformat()
+
+    # ── persistence ─────────────────────────────────────────────
+
+    def to_dict(self) -> dict:
+        return {
+            'format': HISTORY_FORMAT,
+            'defs': [list(d) for d in self.defs],
+            'days': {day: dict(entry) for day, entry in self.days.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'RoutineHistory':
+        """Load either format; legacy days (with a 'tasks' list) are migrated on the fly"""
+        history = cls()
+        if not data:
+            return history
+        if data.get('format') == HISTORY_FORMAT:
+            for definition in data.get('defs', []):
+                key = tuple(tuple(task) for task in definition)
+                history._def_ids.setdefault(key, len(history.defs))
+                history.defs.append([list(task) for task in definition])
+            days = data.get('days', {})
+        else:
+            days = data
+        for day, entry in days.items():
+            history.days[day] = history.encode(entry) if 'tasks' in entry else dict(entry)
+        if history.days:
+            history._index(datetime.date.fromisoformat(min(history.days)).toordinal())
+            for day in history.days:
+                history._update_columns(day)
+        history.task_rows = sum(history._rows(entry) for entry in history.days.values())
+        return history
+
+
+def last_history_day(history: Optional[dict]) -> Optional[str]:
+    """Latest day in serialized history of either format"""
+    if not history:
+        return None
+    days = history.get('days', {}) if history.get('format') == HISTORY_FORMAT else history
+    return max(days) if days else None
+
+
+def last_completed_day(history: Optional[dict]) -> Optional[str]:
+    """Latest day with any completion (missed days don't count) in serialized history"""
+    if not history:
+        return None
+    days = history.get('days', {}) if history.get('format') == HISTORY_FORMAT else history
+    for day in sorted(days, reverse=True):
+        if days[day].get('completion', 0) > 0:
+            return day
+    return None
+
+
+def normalize_history(history: Optional[dict]) -> dict:
+    """Serialized history of either format -> format 2 dict"""
+    if history and history.get('format') == HISTORY_FORMAT and \
+            not any('tasks' in entry for entry in history.get('days', {}).values()):
+        return history
+    return RoutineHistory.from_dict(history).to_dict()
@@ -0,0 +1,88 @@
+import bisect
+import datetime
+from typing import Optional
+
+import pytz
+
+from classes_dir import clock
+
+FOREVER = float('inf')
+
+
+def local_instant(tz, day: datetime.date, minutes: int) -> float:
+    """UTC epoch seconds of `minutes` past local midnight of `day` in tz"""
+    naive = datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(minutes=minutes)
+    return tz.localize(naive).timestamp()
+
+
+def _transitions(tz) -> list:
+    """UTC epoch seconds of the zone's offset changes (empty for fixed zones)"""
+    cached = getattr(tz, '_transition_stamps', None)
+    if cached is None:
+        utc_times = getattr(tz, '_utc_transition_times', None) or []
+        cached = [t.replace(tzinfo=pytz.UTC).timestamp() for t in utc_times[1:]]
+        try:
+            tz._transition_stamps = cached  # pytz zones are shared singletons
+        except AttributeError:
+            pass
+    return cached
+
+
+class WindowBounds:
+    """Today's routine window as UTC instants, valid until local midnight or a DST change.
+
+    `key` is the (timezone, window fields) tuple it was computed from, so a
+    settings change invalidates it without explicit hooks. Inside
+    [valid_from, valid_until) window checks are plain float comparisons.
+    """
+
+    __slots__ = ('key', 'day', 'start', 'end', 'valid_from', 'valid_until')
+
+    def __init__(self, key: tuple, now: float):
+        timezone, window_start, window_start_minute, window_end, window_end_minute = key
+        tz = pytz.timezone(timezone)
+        day = datetime.datetime.fromtimestamp(now, tz).date()
+        self.key = key
+        self.day = day.isoformat()
+        self.start = local_instant(tz, day, window_start * 60 + window_start_minute)
+        self.end = local_instant(tz, day, window_end * 60 + window_end_minute)
+
+        transitions = _transitions(tz)
+        i = bisect.bisect_right(transitions, now)
+        previous_change = transitions[i - 1] if i > 0 else -FOREVER
+        next_change = transitions[i] if i < len(transitions) else FOREVER
+        self.valid_from = max(local_instant(tz, day, 0), previous_change)
+        self.valid_until = min(local_instant(tz, day + datetime.timedelta(days=1), 0), next_change)
+
+    def is_valid(self, key: tuple, now: float) -> bool:
+        return self.key == key and self.valid_from <= now < self.valid_until
+
+
+class WindowMixin:
+    """Cached window checks for anything with timezone and window_* fields"""
+
+    __slots__ = ()
+    _window: Optional[WindowBounds] = None
+
+    def window_bounds(self, now: Optional[float] = None) -> WindowBounds:
+        now = clock.time() if now is None else now
+        key = (self.timezone, self.window_start, self.window_start_minute,
+               self.window_end, self.window_end_minute)
+        bounds = self._window
+        if bounds is None or not bounds.is_valid(key, now):
+            bounds = self._window = WindowBounds(key, now)
+        return bounds
+
+    def in_window(self, now: Optional[float] = None) -> bool:
+        now = clock.time() if now is None else now
+        bounds = self.window_bounds(now)
+        return bounds.start <= now < bounds.end
+
+    def window_closed(self, now: Optional[float] = None) -> bool:
+        """Past today's window end"""
+        now = clock.time() if now is None else now
+        return now >= self.window_bounds(now).end
+
+    def local_today(self, now: Optional[float] = None) -> str:
+        """Today's ISO date in the user's timezone"""
+        return self.window_bounds(now).day
@@ -5,8 +5,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import logging
 import asyncio
+import functools
+import time
 from aiogram import Bot, Dispatcher, types, F
-import json
 from dotenv import load_dotenv
 import datetime
 from aiogram.filters.command import Command
@@ -15,7 +16,26 @@ from states_dir.statesform import StepsForm
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from classes_dir import clock
 from classes_dir.morning_routine_class import MorningRoutine
+from classes_dir.routine_history import DAY_MISSED
+from storage_dir.backends import create_storage
+from storage_dir.fsm_storage import RecordFSMStorage
+from storage_dir.json_file_storage import import_legacy_file
+from storage_dir.routine_registry import RoutineRegistry
+from storage_dir.write_behind import WriteBehindQueue
+from scheduler_dir.activity_tiers import ActivityTiers
+from scheduler_dir.catch_up import CatchUp
+from scheduler_dir.event_heap import EventHeap
+from scheduler_dir.fan_out import FanOut
+from scheduler_dir.live_messages import LiveMessages
+from scheduler_dir.outbound_queue import OutboundQueue, PRIORITY_ALERT, PRIORITY_DIGEST, PRIORITY_INTERACTIVE
+from scheduler_dir.reply_keyboards import ReplyKeyboards
+from scheduler_dir.send_workers import SendWorkers
+from scheduler_dir.rule_engine import (Rule, RuleContext, RuleEngine, at_followup, at_local_time,
+                                         at_midnight, at_window_end, at_window_start)
+from scheduler_dir.zone_buckets import ZoneBuckets
+from scheduler_dir.task_timers import TaskTimers
 import pytz
 
 # Load environment
@@ -27,7 +47,6 @@ logging.basicConfig(level=logging.INFO)
 # Bot initialization
 bot_token = str(os.getenv("BOT_TOKEN"))
 bot = Bot(token=bot_token, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-dp = Dispatcher()
 
 # ═══════════════════════════════════════════════════════════════
 # UI DESIGN VARIABLES - Change all visual elements here
@@ -90,18 +109,133 @@ def make_streak_bar(streak, max_icons=10):
 # ═══════════════════════════════════════════════════════════════
 
 # Global storage
-routines_dict: dict[int, MorningRoutine] = {}
-FILE_NAME = './routines_data.json'
+FILE_NAME = './routines_data.json'  # Single-file storage ('json' backend), imported on first load otherwise
+DATA_DIR = './routines_data'  # One shard per chat_id ('sharded' backend)
+DB_FILE = './routines_data.db'  # SQLite in WAL mode ('sqlite' backend)
+JOURNAL_DIR = './routines_journal'  # Event journal + snapshot ('journal' backend)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sharded")
+STORAGE_PATHS = {'sharded': DATA_DIR, 'json': FILE_NAME, 'sqlite': DB_FILE, 'journal': JOURNAL_DIR}
+STORAGE_OPTIONS = {
+    'journal': {
+        'compact_events': int(os.getenv("JOURNAL_COMPACT_EVENTS", "1000")),
+        'compact_seconds': float(os.getenv("JOURNAL_COMPACT_SECONDS", "600"))
+    }
+}
+store = create_storage(STORAGE_BACKEND, STORAGE_PATHS.get(STORAGE_BACKEND, ''), **STORAGE_OPTIONS.get(STORAGE_BACKEND, {}))
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "2"))  # Seconds between write-behind flushes
+persistence = WriteBehindQueue(store, lambda chat_id: build_record(chat_id), FLUSH_INTERVAL)
 
 # Customizable quick replies for watches
 DEFAULT_REPLIES = ["Done", "Next", "Complete", "Ok", "Great"]
 user_replies: dict[int, list[str]] = {}  # chat_id -> list of replies
 
+
+def hydrate_replies(chat_id: int, record: dict) -> None:
+    """Quick replies and FSM state arrive with the routine when a user is hydrated"""
+    if record.get('user_replies'):
+        user_replies.setdefault(chat_id, record['user_replies'])
+    if isinstance(fsm_storage, RecordFSMStorage):
+        fsm_storage.restore(chat_id, record.get('fsm'))
+
+
+def save_fsm_state(chat_id: int) -> None:
+    """FSM transitions are written with the user's record on the next flush"""
+    if routines_dict.hydrate(chat_id) is not None:  # Resident now, then pinned by the dirty mark until flushed
+        persistence.mark_dirty(chat_id)
+
+
+def create_fsm_storage():
+    """FSM_STORAGE: records (default, persisted with each user), redis or memory"""
+    if FSM_STORAGE == 'redis':
+        # Any Redis-compatible server works; needs the `redis` package
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(REDIS_URL)
+    if FSM_STORAGE == 'memory':
+        from aiogram.fsm.storage.memory import MemoryStorage
+        return MemoryStorage()
+    return RecordFSMStorage(load_user=lambda chat_id: routines_dict.hydrate(chat_id), mark_dirty=save_fsm_state)
+
+
+def release_user(chat_id: int) -> None:
+    """An evicted routine is gone from memory: its FSM state is in the record, drop it too"""
+    if isinstance(fsm_storage, RecordFSMStorage):
+        fsm_storage.forget(chat_id)
+
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "records")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+fsm_storage = create_fsm_storage()
+
+# chat_id -> MorningRoutine, hydrated from storage on first access and LRU-evicted
+ROUTINE_CACHE_MB = float(os.getenv("ROUTINE_CACHE_MB", "64"))
+routines_dict = RoutineRegistry(
+    store,
+    on_hydrate=hydrate_replies,
+    memory_budget=int(ROUTINE_CACHE_MB * 1024 * 1024),
+    is_pinned=persistence.is_pending,
+    on_evict=release_user
+)
+
+dp = Dispatcher(storage=fsm_storage)
+
+# Scheduler: each user's next fire time in a min-heap (dedup marks live on the routines)
+event_heap = EventHeap()
+zone_buckets = ZoneBuckets()  # Users grouped by (timezone, window, follow-up)
+task_timers = TaskTimers(on_due=lambda chat_id: auto_advance(chat_id))
+# Users with events missed while the bot was down are released at this rate on startup
+CATCHUP_RATE = float(os.getenv("CATCHUP_RATE", "20"))
+catch_up = CatchUp(CATCHUP_RATE)
+# Scheduled sends, followed from their due instant to delivery
+fan_out = FanOut()
+# Users silent this many days go to the cold tier: weekly report and cleanup only
+DORMANT_DAYS = int(os.getenv("DORMANT_DAYS", "14"))
+activity_tiers = ActivityTiers(DORMANT_DAYS)
+# Every outgoing message is queued: global and per-chat rate limits (0 = unlimited), then priority order
+SEND_RATE = float(os.getenv("SEND_RATE", "25"))  # Messages per second, all chats
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))  # Messages per second to one chat (bursts of 3)
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))  # API calls in flight at once, per sending process
+# Scheduled alerts and digests go through this many worker processes (0 = sent inline)
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "0"))
+send_workers = SendWorkers(SCHEDULER_WORKERS, bot_token, parse_mode=ParseMode.MARKDOWN,
+                           concurrency=SEND_CONCURRENCY) if SCHEDULER_WORKERS > 0 else None
+outbound = OutboundQueue(lambda chat_id, method, kwargs, priority: transmit(chat_id, method, kwargs, priority),
+                         rate=SEND_RATE, burst=SEND_RATE, chat_rate=SEND_CHAT_RATE,
+                         concurrency=SEND_CONCURRENCY * (SCHEDULER_WORKERS + 1),  # Bot process and each worker
+                         on_blocked=lambda chat_id: note_blocked(chat_id))
+# Opt-in: each next task edits the routine's task message instead of sending a new one
+EDIT_TASK_MESSAGES = os.getenv("EDIT_TASK_MESSAGES", "0") == "1"
+live_messages = LiveMessages()
+# Reply keyboards are only sent when they differ from the one the chat already shows
+SKIP_UNCHANGED_KEYBOARDS = os.getenv("SKIP_UNCHANGED_KEYBOARDS", "1") == "1"
+reply_keyboards = ReplyKeyboards()
+# Users who blocked the bot are flagged and moved to the cold tier in batches
+BLOCKED_BATCH_SECONDS = 5
+blocked_chats: set = set()
+
+
+@dp.update.outer_middleware()
+async def track_activity(handler, event, data):
+    """Any inbound update refreshes the user's last_seen (at most one save per day) and unblocks them"""
+    user = data.get('event_from_user')
+    if user is not None:
+        blocked_chats.discard(user.id)  # Wrote to the bot: not blocked any more
+        header = routines_dict.headers.get(user.id)
+        today = clock.now(pytz.UTC).date().isoformat()
+        if header is not None and (header.last_seen != today or header.blocked):
+            routine = routines_dict.get(user.id)
+            if routine is not None:
+                routine.last_seen = today
+                routine.blocked = False
+                save_routines(user.id)  # Reschedules: promotes a cold user back
+    return await handler(event, data)
+
+
 @dp.message(Command("start", "restart"))
 async def cmd_start(message: types.Message, state: FSMContext) -> None:
     chat_id = message.from_user.id
     
     print(f"\n=== START command from {chat_id} ===\n")
+    reply_keyboards.forget(chat_id)  # Chat may have been cleared: send the keyboard again
     
     # Initialize routine if new user
     if chat_id not in routines_dict:
@@ -122,7 +256,7 @@ Ready to begin?
             one_time_keyboard=True
         )
         
-        await bot.send_message(chat_id, intro_text, reply_markup=markup)
+        await deliver(chat_id, intro_text, reply_markup=markup)
     else:
         # Existing user - go to menu
         await show_main_menu(chat_id, state)
@@ -153,7 +287,7 @@ async def setup_start(message: types.Message, state: FSMContext):
         one_time_keyboard=False
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 @dp.message(StepsForm.SETUP_ADD_TASK)
 async def setup_add_task_or_finish(message: types.Message, state: FSMContext):
@@ -164,15 +298,15 @@ async def setup_add_task_or_finish(message: types.Message, state: FSMContext):
     # Handle finish setup
     if text == "Finish":
         if len(routine.tasks) == 0:
-            await bot.send_message(chat_id, "`Add at least one task`")
+            await deliver(chat_id, "`Add at least one task`")
             return
         
         routine.is_setup_complete = True
-        save_routines()
+        save_routines(chat_id)
         
         await show_main_menu(chat_id, state)
         
-        await bot.send_message(
+        await deliver(
             chat_id,
             "*Setup complete*\n\nStart your routine between `05:00 \\- 11:00`"
         )
@@ -180,7 +314,7 @@ async def setup_add_task_or_finish(message: types.Message, state: FSMContext):
     
     # Handle add another task
     if text == "+ Add":
-        await bot.send_message(
+        await deliver(
             chat_id,
             "Send next task:\n`task name` `minutes`"
         )
@@ -215,12 +349,12 @@ async def setup_add_task_or_finish(message: types.Message, state: FSMContext):
                 one_time_keyboard=False
             )
             
-            await bot.send_message(chat_id, response_text, reply_markup=markup)
+            await deliver(chat_id, response_text, reply_markup=markup)
         else:
-            await bot.send_message(chat_id, "`Max 15 tasks\\. Finish setup\\.`")
+            await deliver(chat_id, "`Max 15 tasks\\. Finish setup\\.`")
     
     except (ValueError, IndexError):
-        await bot.send_message(
+        await deliver(
             chat_id, 
             "`Invalid format`\nUse: `task name` `minutes`"
         )
@@ -237,9 +371,9 @@ async def start_routine(message: types.Message, state: FSMContext):
     
     if not routine.can_start_routine():
         user_tz = pytz.timezone(routine.timezone)
-        now = datetime.datetime.now(user_tz)
+        now = clock.now(user_tz)
         print(f"[START ROUTINE] Cannot start - outside window")
-        await bot.send_message(
+        await deliver(
             chat_id,
             f"`Window: {routine.window_start:02d}:{routine.window_start_minute:02d} - {routine.window_end:02d}:{routine.window_end_minute:02d}`\n`Now: {now.strftime('%H:%M')}`"
         )
@@ -248,11 +382,11 @@ async def start_routine(message: types.Message, state: FSMContext):
     if routine.start_routine():
         print(f"[START ROUTINE] Success - starting tasks")
         await state.set_state(StepsForm.ROUTINE_ACTIVE)
-        save_routines()
+        save_routines(chat_id)
         await send_next_task(chat_id, state)
     else:
         print(f"[START ROUTINE] Failed")
-        await bot.send_message(chat_id, "`Could not start routine`")
+        await deliver(chat_id, "`Could not start routine`")
 
 
 @dp.message(StepsForm.MENU, F.text == "Restart Routine")
@@ -261,7 +395,7 @@ async def restart_routine(message: types.Message, state: FSMContext):
     routine = routines_dict[chat_id]
     
     user_tz = pytz.timezone(routine.timezone)
-    today = datetime.datetime.now(user_tz).date().isoformat()
+    today = clock.now(user_tz).date().isoformat()
     
     # Remove today's history so can_start_routine works
     if today in routine.history:
@@ -280,11 +414,11 @@ async def restart_routine(message: types.Message, state: FSMContext):
     if routine.start_routine():
         print(f"[RESTART] Restarting routine for {chat_id}")
         await state.set_state(StepsForm.ROUTINE_ACTIVE)
-        save_routines()
+        save_routines(chat_id)
         await send_next_task(chat_id, state)
     else:
-        save_routines()
-        await bot.send_message(chat_id, "`Cannot restart - outside window`")
+        save_routines(chat_id)
+        await deliver(chat_id, "`Cannot restart - outside window`")
         await show_main_menu(chat_id, state)
 
 
@@ -293,18 +427,13 @@ async def send_next_task(chat_id: int, state: FSMContext):
     routine = routines_dict[chat_id]
     
     # CHECK IF STILL IN WINDOW - CRITICAL CHECK
-    user_tz = pytz.timezone(routine.timezone)
-    now = datetime.datetime.now(user_tz)
-    current_minutes = now.hour * 60 + now.minute
-    start_minutes = routine.window_start * 60 + routine.window_start_minute
-    end_minutes = routine.window_end * 60 + routine.window_end_minute
-    
     # If outside window, force finish and block
-    if current_minutes < start_minutes or current_minutes >= end_minutes:
+    if not routine.in_window():
         if routine.routine_started:
             routine.finish_routine()
-            save_routines()
-            await bot.send_message(chat_id, "*Window closed*\n\nRoutine finished\\.")
+            end_live_message(chat_id)
+            save_routines(chat_id)
+            await deliver(chat_id, "*Window closed*\n\nRoutine finished\\.")
         await show_main_menu(chat_id, state)
         return
     
@@ -341,13 +470,7 @@ async def send_next_task(chat_id: int, state: FSMContext):
 `{completion:.0f}%` · `{remaining} left`
 """
         
-        replies = user_replies.get(chat_id, DEFAULT_REPLIES)
-        buttons = [[KeyboardButton(text=reply)] for reply in replies[:3]]
-        buttons.append([KeyboardButton(text="Menu")])
-        
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=buttons)
-        
-        await bot.send_message(chat_id, text, reply_markup=markup, disable_notification=True)
+        await send_task_message(chat_id, routine, text)
     else:
         await finish_routine_confirmed(chat_id, state)
 
@@ -358,14 +481,8 @@ async def handle_task_response(message: types.Message, state: FSMContext):
     text = message.text.strip()
     
     # CHECK WINDOW FIRST
-    user_tz = pytz.timezone(routine.timezone)
-    now = datetime.datetime.now(user_tz)
-    current_minutes = now.hour * 60 + now.minute
-    start_minutes = routine.window_start * 60 + routine.window_start_minute
-    end_minutes = routine.window_end * 60 + routine.window_end_minute
-    
-    if current_minutes < start_minutes or current_minutes >= end_minutes:
-        await bot.send_message(chat_id, "*Window closed*")
+    if not routine.in_window():
+        await deliver(chat_id, "*Window closed*")
         await show_main_menu(chat_id, state)
         return
     
@@ -377,7 +494,7 @@ async def handle_task_response(message: types.Message, state: FSMContext):
     for i, task in enumerate(routine.tasks):
         if not task.completed and not task.skipped:
             routine.complete_task(i)
-            save_routines()
+            save_routines(chat_id)
             break
     
     await send_next_task(chat_id, state)
@@ -402,13 +519,14 @@ async def finish_routine_confirmed(chat_id: int, state: FSMContext):
     completion = routine.get_completion_percentage()
     
     routine.finish_routine()
-    save_routines()
+    end_live_message(chat_id)
+    save_routines(chat_id)
     
     if completion >= 100:
         progress_bar = make_progress_bar(completion, 20)
         streak_bar = make_streak_bar(routine.current_streak, 10)
         
-        duration = routine.history[datetime.date.today().isoformat()]['duration']
+        duration = routine.history[clock.today().isoformat()]['duration']
         
         message = make_header("✓ COMPLETE") + f"""
 {progress_bar}
@@ -430,7 +548,7 @@ Tomorrow is a fresh start
 """
     
     await show_main_menu(chat_id, state)
-    await bot.send_message(chat_id, message)
+    await deliver(chat_id, message)
 
 def get_encouragement_message(streak: int) -> str:
     """Return encouraging message based on streak"""
@@ -487,19 +605,21 @@ _{get_weekly_insights(stats)}_
         ]
     )
     
-    await bot.send_message(chat_id, stats_text, reply_markup=markup)
+    await deliver(chat_id, stats_text, reply_markup=markup)
 
 def create_week_visual(routine: MorningRoutine) -> str:
     """Create visual representation of last 7 days"""
     emojis = []
     labels = []
     
-    for i in range(6, -1, -1):
-        date = (datetime.date.today() - datetime.timedelta(days=i)).isoformat()
-        day_data = routine.history.get(date, {'completion': 0})
-        
-        completion = day_data.get('completion', 0)
-        if day_data.get('missed', False):
+    today = clock.today()
+    first_day = today - datetime.timedelta(days=6)
+    completions = routine.history.completions(first_day, today)
+    flags = routine.history.day_flags(first_day, today)
+    
+    for i in range(7):
+        completion = completions[i]
+        if flags[i] & DAY_MISSED:
             emoji = CAL_MISSED + ' '
         elif completion >= 100:
             emoji = CAL_COMPLETE + ' '
@@ -508,7 +628,7 @@ def create_week_visual(routine: MorningRoutine) -> str:
         else:
             emoji = CAL_INCOMPLETE + ' '
         
-        day_name = (datetime.date.today() - datetime.timedelta(days=i)).strftime('%a')[:2].upper()
+        day_name = (first_day + datetime.timedelta(days=i)).strftime('%a')[:2].upper()
         labels.append(day_name)
         emojis.append(emoji)
     
@@ -542,7 +662,7 @@ async def monthly_view(message: types.Message, state: FSMContext):
     month_visual = create_month_visual(routine)
     month_stats = get_month_stats(routine)
     
-    month_name = datetime.date.today().strftime('%B %Y').upper()
+    month_name = clock.today().strftime('%B %Y').upper()
     
     text = make_header(month_name) + f"""
 {month_visual}
@@ -555,11 +675,11 @@ async def monthly_view(message: types.Message, state: FSMContext):
         keyboard=[[KeyboardButton(text="Back")]]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 def create_month_visual(routine: MorningRoutine) -> str:
     """Create calendar-style month view with proper alignment"""
-    today = datetime.date.today()
+    today = clock.today()
     first_day = today.replace(day=1)
     
     # Calculate last day of month
@@ -573,6 +693,10 @@ def create_month_visual(routine: MorningRoutine) -> str:
     # Header with day labels in monospace (each label is 2 chars)
     lines.append("`Mo Tu We Th Fr Sa Su`\n")
     
+    # One slice per column for the whole month so far
+    completions = routine.history.completions(first_day, today)
+    flags = routine.history.day_flags(first_day, today)
+    
     # Start from Monday of the week containing first day
     current = first_day - datetime.timedelta(days=first_day.weekday())
     week_emojis = []
@@ -580,10 +704,9 @@ def create_month_visual(routine: MorningRoutine) -> str:
     while current <= last_day:
         if current.month == today.month:
             if current <= today:
-                day_data = routine.history.get(current.isoformat(), {})
-                completion = day_data.get('completion', 0)
+                completion = completions[current.day - 1]
                 
-                if day_data.get('missed', False):
+                if flags[current.day - 1] & DAY_MISSED:
                     emoji = f"`{CAL_MISSED} `"
                 elif completion >= 100:
                     emoji = f"`{CAL_COMPLETE} `"
@@ -615,19 +738,11 @@ def create_month_visual(routine: MorningRoutine) -> str:
 
 def get_month_stats(routine: MorningRoutine) -> str:
     """Calculate current month statistics"""
-    today = datetime.date.today()
+    today = clock.today()
     first_day = today.replace(day=1)
     
-    completed = 0
-    total_days = 0
-    
-    current = first_day
-    while current <= today:
-        total_days += 1
-        day_data = routine.history.get(current.isoformat(), {})
-        if day_data.get('completion', 0) >= 80:
-            completed += 1
-        current += datetime.timedelta(days=1)
+    completed = routine.history.count_at_least(first_day, today, 80)
+    total_days = today.day
     
     rate = (completed / total_days * 100) if total_days > 0 else 0
     month_bar = make_progress_bar(rate, 20)
@@ -674,7 +789,7 @@ async def show_settings(message: types.Message, state: FSMContext):
         ]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 @dp.message(StepsForm.SETTINGS, F.text == "Quick Replies")
 async def customize_replies(message: types.Message, state: FSMContext):
@@ -704,7 +819,7 @@ Customize watch responses
         ]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 @dp.message(StepsForm.SETTINGS, F.text == "Edit Routine")
 async def edit_routine(message: types.Message, state: FSMContext):
@@ -755,7 +870,7 @@ async def edit_routine(message: types.Message, state: FSMContext):
         ]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 
 @dp.message(StepsForm.SETTINGS_EDIT_ROUTINE)
@@ -798,10 +913,10 @@ async def handle_edit_routine(message: types.Message, state: FSMContext):
                 errors.append(f"{line}: unknown command")
         
         if added:
-            save_routines()
-            await bot.send_message(chat_id, f"`Added {len(added)} tasks`")
+            save_routines(chat_id)
+            await deliver(chat_id, f"`Added {len(added)} tasks`")
         if errors:
-            await bot.send_message(chat_id, "`Errors:`\n" + "\n".join(f"`{e}`" for e in errors))
+            await deliver(chat_id, "`Errors:`\n" + "\n".join(f"`{e}`" for e in errors))
         await edit_routine(message, state)
         return
     
@@ -820,13 +935,13 @@ async def handle_edit_routine(message: types.Message, state: FSMContext):
                 if routine.remove_task(idx):
                     removed += 1
             if removed > 0:
-                save_routines()
-                await bot.send_message(chat_id, f"`Removed {removed} task{'s' if removed > 1 else ''}`")
+                save_routines(chat_id)
+                await deliver(chat_id, f"`Removed {removed} task{'s' if removed > 1 else ''}`")
                 await edit_routine(message, state)
             else:
-                await bot.send_message(chat_id, "`Invalid number(s)`")
+                await deliver(chat_id, "`Invalid number(s)`")
         except ValueError:
-            await bot.send_message(chat_id, "`Invalid format`")
+            await deliver(chat_id, "`Invalid format`")
     
     # Edit task: "edit 1"
     elif parts[0] == "edit" and len(parts) == 2:
@@ -862,11 +977,11 @@ Notes: `{task.notes or 'none'}`
                     ]
                 )
                 
-                await bot.send_message(chat_id, text, reply_markup=markup)
+                await deliver(chat_id, text, reply_markup=markup)
             else:
-                await bot.send_message(chat_id, "`Invalid task number`")
+                await deliver(chat_id, "`Invalid task number`")
         except ValueError:
-            await bot.send_message(chat_id, "`Invalid format`")
+            await deliver(chat_id, "`Invalid format`")
     
     # Move task: "move 1 3"
     elif parts[0] == "move" and len(parts) == 3:
@@ -874,13 +989,13 @@ Notes: `{task.notes or 'none'}`
             from_idx = int(parts[1]) - 1
             to_idx = int(parts[2]) - 1
             if routine.move_task(from_idx, to_idx):
-                save_routines()
-                await bot.send_message(chat_id, "`Moved`")
+                save_routines(chat_id)
+                await deliver(chat_id, "`Moved`")
                 await edit_routine(message, state)
             else:
-                await bot.send_message(chat_id, "`Invalid positions`")
+                await deliver(chat_id, "`Invalid positions`")
         except ValueError:
-            await bot.send_message(chat_id, "`Invalid format`")
+            await deliver(chat_id, "`Invalid format`")
     
     # Add task: "add taskname 30" or "add taskname 30 optional"
     elif parts[0] == "add" and len(raw_parts) >= 3:
@@ -894,15 +1009,15 @@ Notes: `{task.notes or 'none'}`
             
             success, error = routine.add_task(task_name, duration, optional)
             if success:
-                save_routines()
-                await bot.send_message(chat_id, f"`Added: {task_name}`")
+                save_routines(chat_id)
+                await deliver(chat_id, f"`Added: {task_name}`")
                 await edit_routine(message, state)
             else:
-                await bot.send_message(chat_id, f"`{error}`")
+                await deliver(chat_id, f"`{error}`")
         except (ValueError, IndexError):
-            await bot.send_message(chat_id, "`Invalid format`")
+            await deliver(chat_id, "`Invalid format`")
     else:
-        await bot.send_message(chat_id, "`Invalid command`")
+        await deliver(chat_id, "`Invalid command`")
 
 
 @dp.message(StepsForm.SETTINGS_EDIT_TASK)
@@ -917,9 +1032,9 @@ async def handle_edit_task_property(message: types.Message, state: FSMContext):
         return
     
     if text.lower() == "done":
-        save_routines()
+        save_routines(chat_id)
         await state.set_state(StepsForm.SETTINGS_EDIT_ROUTINE)
-        await bot.send_message(chat_id, "`Changes saved`")
+        await deliver(chat_id, "`Changes saved`")
         await edit_routine(message, state)
         return
     
@@ -927,12 +1042,12 @@ async def handle_edit_task_property(message: types.Message, state: FSMContext):
     task_idx = data.get('editing_task_index')
     
     if task_idx is None:
-        await bot.send_message(chat_id, "`Error: no task selected`")
+        await deliver(chat_id, "`Error: no task selected`")
         return
     
     parts = text.split(maxsplit=1)
     if len(parts) < 2:
-        await bot.send_message(chat_id, "`Format: property value`")
+        await deliver(chat_id, "`Format: property value`")
         return
     
     prop, value = parts[0].lower(), parts[1]
@@ -943,7 +1058,7 @@ async def handle_edit_task_property(message: types.Message, state: FSMContext):
         try:
             success, error = routine.edit_task(task_idx, duration=int(value))
         except ValueError:
-            await bot.send_message(chat_id, "`Duration must be a number`")
+            await deliver(chat_id, "`Duration must be a number`")
             return
     elif prop == "optional":
         optional_val = value.lower() in ['true', 'yes', '1']
@@ -951,13 +1066,13 @@ async def handle_edit_task_property(message: types.Message, state: FSMContext):
     elif prop == "notes":
         success, error = routine.edit_task(task_idx, notes=value)
     else:
-        await bot.send_message(chat_id, "`Unknown property`")
+        await deliver(chat_id, "`Unknown property`")
         return
     
     if success:
-        await bot.send_message(chat_id, f"`Updated {prop}`")
+        await deliver(chat_id, f"`Updated {prop}`")
     else:
-        await bot.send_message(chat_id, f"`{error}`")
+        await deliver(chat_id, f"`{error}`")
 
 
 # Add pause/resume functionality to routine handlers:
@@ -976,7 +1091,7 @@ async def handle_task_response(message: types.Message, state: FSMContext):
     for i, task in enumerate(routine.tasks):
         if not task.completed and not task.skipped:
             routine.complete_task(i)
-            save_routines()
+            save_routines(chat_id)
             break
     
     await send_next_task(chat_id, state)
@@ -1020,18 +1135,12 @@ async def send_next_task(chat_id: int, state: FSMContext):
 `{completion:.0f}%` · `{remaining} left`
 """
         
-        replies = user_replies.get(chat_id, DEFAULT_REPLIES)
-        buttons = [[KeyboardButton(text=reply)] for reply in replies[:3]]
-        buttons.append([KeyboardButton(text="Menu")])
-        
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=buttons)
-        
-        await bot.send_message(chat_id, text, reply_markup=markup, disable_notification=True)
+        await send_task_message(chat_id, routine, text)
         
         # Task timer starts now
-        routine.current_task_sent_at = datetime.datetime.now(pytz.UTC)
+        routine.current_task_sent_at = clock.now(pytz.UTC)
         routine.in_buffer = False
-        save_routines()
+        save_routines(chat_id)
     else:
         await finish_routine_confirmed(chat_id, state)
 
@@ -1066,7 +1175,7 @@ Hours: 0-23, Minutes: 0-59
         ]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 
 @dp.message(StepsForm.SETTINGS_EDIT_WINDOW)
@@ -1102,11 +1211,11 @@ async def handle_window_change(message: types.Message, state: FSMContext):
             
             # Validate
             if not (0 <= start_hour < 24 and 0 <= start_minute < 60):
-                await bot.send_message(chat_id, "`Invalid start time`")
+                await deliver(chat_id, "`Invalid start time`")
                 return
             
             if not (0 <= end_hour <= 24 and 0 <= end_minute < 60):
-                await bot.send_message(chat_id, "`Invalid end time`")
+                await deliver(chat_id, "`Invalid end time`")
                 return
             
             # Compare as total minutes
@@ -1114,25 +1223,25 @@ async def handle_window_change(message: types.Message, state: FSMContext):
             end_total = end_hour * 60 + end_minute
             
             if start_total >= end_total:
-                await bot.send_message(chat_id, "`Start must be before end`")
+                await deliver(chat_id, "`Start must be before end`")
                 return
             
             routine.window_start = start_hour
             routine.window_start_minute = start_minute
             routine.window_end = end_hour
             routine.window_end_minute = end_minute
-            save_routines()
+            save_routines(chat_id)
             
-            await bot.send_message(
+            await deliver(
                 chat_id, 
                 f"`Window: {start_hour:02d}:{start_minute:02d} - {end_hour:02d}:{end_minute:02d}`"
             )
             await show_settings(message, state)
             
         except (ValueError, IndexError):
-            await bot.send_message(chat_id, "`Invalid format`")
+            await deliver(chat_id, "`Invalid format`")
     else:
-        await bot.send_message(chat_id, "`Format: window START END`\n`Example: window 6:30 12:45`")
+        await deliver(chat_id, "`Format: window START END`\n`Example: window 6:30 12:45`")
 
 
 # Update settings menu to include new options:
@@ -1163,7 +1272,7 @@ async def show_settings(message: types.Message, state: FSMContext):
         one_time_keyboard=False
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 
 # Update menu to show "Resume" button if paused:
@@ -1172,26 +1281,22 @@ async def show_main_menu(chat_id: int, state: FSMContext):
     await state.set_state(StepsForm.MENU)
     routine = routines_dict[chat_id]
     
-    user_tz = pytz.timezone(routine.timezone)
-    now = datetime.datetime.now(user_tz)
-    current_minutes = now.hour * 60 + now.minute
-    start_minutes = routine.window_start * 60 + routine.window_start_minute
-    end_minutes = routine.window_end * 60 + routine.window_end_minute
-    today = now.date().isoformat()
+    today = routine.local_today()
     
     # Force finish if outside window and routine started
-    if current_minutes >= end_minutes and routine.routine_started:
+    if routine.window_closed() and routine.routine_started:
         for task in routine.tasks:
             if not task.completed and not task.skipped:
                 task.mark_complete()
         routine.finish_routine()
+        end_live_message(chat_id)
         routine.awaiting_honesty_check = True
-        save_routines()
+        save_routines(chat_id)
     
     status = routine.get_status_display()
     buttons = []
     
-    if current_minutes >= start_minutes and current_minutes < end_minutes:
+    if routine.in_window():
         if not routine.routine_started and today not in routine.history:
             buttons.append([KeyboardButton(text="Start Routine")])
         elif today in routine.history and not routine.routine_started:
@@ -1202,7 +1307,7 @@ async def show_main_menu(chat_id: int, state: FSMContext):
     ])
     
     markup = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=buttons)
-    await bot.send_message(chat_id, status, reply_markup=markup)
+    await deliver(chat_id, status, reply_markup=markup)
 
 @dp.message(StepsForm.SETTINGS_CUSTOMIZE_REPLIES)
 async def handle_customize_replies(message: types.Message, state: FSMContext):
@@ -1218,11 +1323,11 @@ async def handle_customize_replies(message: types.Message, state: FSMContext):
     
     if 3 <= len(replies) <= 5:
         user_replies[chat_id] = replies
-        save_routines()
-        await bot.send_message(chat_id, f"`Updated: {', '.join(replies)}`")
+        save_routines(chat_id)
+        await deliver(chat_id, f"`Updated: {', '.join(replies)}`")
         await show_settings(message, state)
     else:
-        await bot.send_message(chat_id, "`Send 3\\-5 words separated by commas`")
+        await deliver(chat_id, "`Send 3\\-5 words separated by commas`")
     
 @dp.message(StepsForm.SETTINGS, F.text == "Timezone")
 async def customize_timezone(message: types.Message, state: FSMContext):
@@ -1257,7 +1362,7 @@ async def customize_timezone(message: types.Message, state: FSMContext):
         ]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 
 @dp.message(StepsForm.SETTINGS_EDIT_TIMEZONE)
@@ -1277,13 +1382,13 @@ async def handle_timezone_change(message: types.Message, state: FSMContext):
             # Validate timezone
             pytz.timezone(tz_name)
             routine.timezone = tz_name
-            save_routines()
-            await bot.send_message(chat_id, f"`Timezone set to {tz_name}`")
+            save_routines(chat_id)
+            await deliver(chat_id, f"`Timezone set to {tz_name}`")
             await show_settings(message, state)
         except pytz.exceptions.UnknownTimeZoneError:
-            await bot.send_message(chat_id, "`Invalid timezone\\. Check spelling\\.`")
+            await deliver(chat_id, "`Invalid timezone\\. Check spelling\\.`")
     else:
-        await bot.send_message(chat_id, "`Format: timezone Europe/Helsinki`")
+        await deliver(chat_id, "`Format: timezone Europe/Helsinki`")
 
 @dp.message(StepsForm.SETTINGS, F.text == "Buffer")
 async def customize_buffer(message: types.Message, state: FSMContext):
@@ -1317,7 +1422,7 @@ Reply anytime to mark task done.
         ]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 
 @dp.message(StepsForm.SETTINGS_EDIT_BUFFER)
@@ -1336,15 +1441,15 @@ async def handle_buffer_change(message: types.Message, state: FSMContext):
             minutes = int(parts[1])
             if 0 <= minutes <= 60:
                 routine.buffer_minutes = minutes
-                save_routines()
-                await bot.send_message(chat_id, f"`Buffer set to {minutes} min`")
+                save_routines(chat_id)
+                await deliver(chat_id, f"`Buffer set to {minutes} min`")
                 await show_settings(message, state)
             else:
-                await bot.send_message(chat_id, "`Must be 0-60 minutes`")
+                await deliver(chat_id, "`Must be 0-60 minutes`")
         except ValueError:
-            await bot.send_message(chat_id, "`Invalid number`")
+            await deliver(chat_id, "`Invalid number`")
     else:
-        await bot.send_message(chat_id, "`Format: buffer 5`")
+        await deliver(chat_id, "`Format: buffer 5`")
 
 @dp.message(StepsForm.SETTINGS, F.text == "Reminder")
 async def customize_followup(message: types.Message, state: FSMContext):
@@ -1377,7 +1482,7 @@ async def customize_followup(message: types.Message, state: FSMContext):
         ]
     )
     
-    await bot.send_message(chat_id, text, reply_markup=markup)
+    await deliver(chat_id, text, reply_markup=markup)
 
 
 @dp.message(StepsForm.SETTINGS_EDIT_FOLLOWUP)
@@ -1392,8 +1497,8 @@ async def handle_followup_change(message: types.Message, state: FSMContext):
     
     if text.lower() == "off":
         routine.followup_enabled = False
-        save_routines()
-        await bot.send_message(chat_id, "`Reminder disabled`")
+        save_routines(chat_id)
+        await deliver(chat_id, "`Reminder disabled`")
         await show_settings(message, state)
         return
     
@@ -1410,17 +1515,17 @@ async def handle_followup_change(message: types.Message, state: FSMContext):
                 minute = 0
             
             if not (0 <= hour < 24 and 0 <= minute < 60):
-                await bot.send_message(chat_id, "`Invalid time`")
+                await deliver(chat_id, "`Invalid time`")
                 return
             
             routine.followup_enabled = True
             routine.followup_hour = hour
             routine.followup_minute = minute
-            save_routines()
-            await bot.send_message(chat_id, f"`Reminder set to {hour:02d}:{minute:02d}`")
+            save_routines(chat_id)
+            await deliver(chat_id, f"`Reminder set to {hour:02d}:{minute:02d}`")
             await show_settings(message, state)
         except ValueError:
-            await bot.send_message(chat_id, "`Format: on 21:00`")
+            await deliver(chat_id, "`Format: on 21:00`")
         return
     
     # "msg Plan the next day"
@@ -1428,12 +1533,12 @@ async def handle_followup_change(message: types.Message, state: FSMContext):
         routine.followup_message = parts[1].strip()
         # Preserve original case from raw text
         routine.followup_message = text.split(maxsplit=1)[1].strip()
-        save_routines()
-        await bot.send_message(chat_id, f"`Message set`")
+        save_routines(chat_id)
+        await deliver(chat_id, f"`Message set`")
         await show_settings(message, state)
         return
     
-    await bot.send_message(chat_id, "`Commands: on 21:00, off, msg Your message`")
+    await deliver(chat_id, "`Commands: on 21:00, off, msg Your message`")
 
 @dp.message(StepsForm.SETTINGS_EDIT_ROUTINE)
 async def handle_edit_routine(message: types.Message, state: FSMContext):
@@ -1449,11 +1554,11 @@ async def handle_edit_routine(message: types.Message, state: FSMContext):
     if text.isdigit():
         task_num = int(text) - 1
         if routine.remove_task(task_num):
-            save_routines()
-            await bot.send_message(chat_id, "`Removed`")
+            save_routines(chat_id)
+            await deliver(chat_id, "`Removed`")
             await edit_routine(message, state)
         else:
-            await bot.send_message(chat_id, "`Invalid number`")
+            await deliver(chat_id, "`Invalid number`")
     
     # Add task
     elif text.lower().startswith("add "):
@@ -1467,15 +1572,15 @@ async def handle_edit_routine(message: types.Message, state: FSMContext):
             task_name = " ".join(parts[:-1])
             
             if routine.add_task(task_name, duration, optional):
-                save_routines()
-                await bot.send_message(chat_id, f"`Added: {task_name}`")
+                save_routines(chat_id)
+                await deliver(chat_id, f"`Added: {task_name}`")
                 await edit_routine(message, state)
             else:
-                await bot.send_message(chat_id, "`Max 15 tasks`")
+                await deliver(chat_id, "`Max 15 tasks`")
         except (ValueError, IndexError):
-            await bot.send_message(chat_id, "`Invalid format`")
+            await deliver(chat_id, "`Invalid format`")
     else:
-        await bot.send_message(chat_id, "`Invalid command`")
+        await deliver(chat_id, "`Invalid command`")
 
 @dp.message(StepsForm.SETTINGS, F.text == "Reset")
 async def reset_routine_confirm(message: types.Message, state: FSMContext):
@@ -1487,7 +1592,7 @@ async def reset_routine_confirm(message: types.Message, state: FSMContext):
         ]
     )
     
-    await bot.send_message(
+    await deliver(
         message.from_user.id,
         "*Reset routine?*\n\nClears tasks, keeps statistics",
         reply_markup=markup
@@ -1500,9 +1605,9 @@ async def reset_routine_confirmed(message: types.Message, state: FSMContext):
     routine = routines_dict[chat_id]
     routine.tasks = []
     routine.is_setup_complete = False
-    save_routines()
+    save_routines(chat_id)
     
-    await bot.send_message(chat_id, "`Routine reset`")
+    await deliver(chat_id, "`Routine reset`")
     await state.set_state(StepsForm.SETUP_ADD_TASK)
     await setup_start(message, state)
 
@@ -1517,7 +1622,7 @@ async def delete_data_confirm(message: types.Message, state: FSMContext):
         ]
     )
     
-    await bot.send_message(
+    await deliver(
         message.from_user.id,
         "*Delete all data?*\n\n`Cannot be undone`",
         reply_markup=markup
@@ -1531,10 +1636,11 @@ async def delete_data_confirmed(message: types.Message, state: FSMContext):
         del routines_dict[chat_id]
         if chat_id in user_replies:
             del user_replies[chat_id]
-        save_routines()
+        save_routines(chat_id)
     
-    await bot.send_message(chat_id, "`All data deleted`\nUse /start to begin")
+    await deliver(chat_id, "`All data deleted`\nUse /start to begin")
     await state.clear()
+    release_user(chat_id)
 
 
 @dp.message(StepsForm.SETTINGS, F.text == "Cancel")
@@ -1547,11 +1653,132 @@ async def settings_to_menu(message: types.Message, state: FSMContext):
     await show_main_menu(message.from_user.id, state)
 
 async def on_startup(chat_id:int, task_dictionary:dict) -> None:   
-    await bot.send_message(chat_id, "Bot has been started!", disable_notification=True)
+    await deliver(chat_id, "Bot has been started!", disable_notification=True)
     asyncio.create_task(scheduled_messages(task_dictionary))
 
 
-async def auto_send_task_message(chat_id: int):
+async def deliver(chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE,
+                  scheduled_at: float = None, **kwargs) -> asyncio.Future:
+    """Queue a message and move on; the returned future resolves to the sent Message (None on failure).
+
+    Scheduler sends pass the instant they were due, so fan_out can report
+    per-user results and the delay to delivery. Nothing is sent to a user
+    who blocked the bot.
+    """
+    if is_blocked(chat_id):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
+    future = outbound.put(chat_id, priority=priority, text=text, **kwargs)
+    if scheduled_at is not None:
+        fan_out.track(chat_id, scheduled_at, future)
+    return future
+
+
+async def transmit(chat_id: int, method: str, kwargs: dict, priority: int = PRIORITY_INTERACTIVE):
+    """Make one queued Bot call and return its result.
+
+    Replies and task messages are sent inline; alerts and digests go to the
+    worker owning chat_id when workers run, and are awaited until it acks.
+    """
+    keyboard = SKIP_UNCHANGED_KEYBOARDS and 'reply_markup' in kwargs and method.startswith('send_')
+    if keyboard:
+        kwargs, key = reply_keyboards.strip(chat_id, kwargs)
+    if priority != PRIORITY_INTERACTIVE and send_workers is not None and send_workers.live_workers():
+        result = await send_workers.submit(chat_id, method, **kwargs)
+    else:
+        result = await getattr(bot, method)(chat_id=chat_id, **kwargs)
+    if keyboard:
+        reply_keyboards.shown(chat_id, key)
+    if EDIT_TASK_MESSAGES and method == 'send_message':
+        live_messages.sent(chat_id, result.message_id)
+    return result
+
+
+async def send_task_message(chat_id: int, routine: MorningRoutine, text: str, scheduled_at: float = None) -> None:
+    """Show a task: edit the live task message in place if possible, else send a new one with the task keyboard"""
+    replies = tuple(user_replies.get(chat_id, DEFAULT_REPLIES)[:3])
+    if EDIT_TASK_MESSAGES and not is_blocked(chat_id):
+        message_id = live_messages.editable(chat_id, replies)
+        if message_id is not None:
+            live_messages.count(chat_id, routine.start_time, edited=True)
+            future = outbound.put(chat_id, 'edit_message_text', message_id=message_id, text=text)
+            if scheduled_at is not None:
+                fan_out.track(chat_id, scheduled_at, future)
+            future.add_done_callback(functools.partial(edit_done, chat_id, routine, text))
+            return
+    
+    markup = reply_keyboards.task_keyboard(replies)
+    future = await deliver(chat_id, text, reply_markup=markup, disable_notification=True, scheduled_at=scheduled_at)
+    if EDIT_TASK_MESSAGES:
+        live_messages.count(chat_id, routine.start_time, edited=False)
+        future.add_done_callback(functools.partial(sent_done, chat_id, replies))
+
+
+def sent_done(chat_id: int, replies: tuple, future: asyncio.Future) -> None:
+    """A new task message went out (or didn't): it becomes the live one"""
+    message = None if future.cancelled() else future.result()
+    live_messages.adopt(chat_id, getattr(message, 'message_id', None), replies)
+
+
+def edit_done(chat_id: int, routine: MorningRoutine, text: str, future: asyncio.Future) -> None:
+    """The edit was refused: fall back to a new task message"""
+    if future.cancelled() or future.result() is not None:
+        return  # Cancelled on shutdown or chat dropped, or edited
+    live_messages.failed(chat_id)
+    asyncio.get_running_loop().create_task(send_task_message(chat_id, routine, text))
+
+
+def end_live_message(chat_id: int) -> None:
+    """Routine over: report how many task messages editing saved"""
+    run = live_messages.finish(chat_id)
+    if run is not None and run[1]:
+        print(f"[LIVE MESSAGE] {chat_id}: {run[0] + run[1]} tasks shown, {run[0]} new messages, {run[1]} edited in place")
+
+
+def is_blocked(chat_id: int) -> bool:
+    """chat_id refused a send, and hasn't written to the bot since"""
+    if chat_id in blocked_chats:
+        return True
+    header = routines_dict.headers.get(chat_id)
+    return header is not None and header.blocked
+
+
+def note_blocked(chat_id: int) -> None:
+    """A send was refused (bot blocked): retire chat_id with the next batch"""
+    if not blocked_chats:
+        asyncio.get_running_loop().call_later(BLOCKED_BATCH_SECONDS, retire_blocked)
+    blocked_chats.add(chat_id)
+    catch_up.discard(chat_id)
+
+
+def retire_blocked() -> None:
+    """Flag every user who blocked the bot and mark them dormant, then persist them in one write.
+
+    The flag stops all sends to them, and recording them as last seen
+    DORMANT_DAYS ago puts them in the cold tier; writing to the bot again
+    after unblocking clears both.
+    """
+    batch = list(blocked_chats)
+    blocked_chats.clear()
+    last_seen = (clock.now(pytz.UTC).date() - datetime.timedelta(days=DORMANT_DAYS)).isoformat()
+    retired = 0
+    for chat_id in batch:
+        routine = routines_dict.get(chat_id)
+        if routine is None:
+            continue
+        if not routine.blocked:
+            routine.blocked = True
+            if routine.last_seen is None or routine.last_seen > last_seen:
+                routine.last_seen = last_seen
+            save_routines(chat_id)
+            retired += 1
+    if retired:
+        asyncio.get_running_loop().create_task(persistence.flush())
+    print(f"[OUTBOUND] {len(batch)} users blocked the bot, {retired} flagged and moved to the cold tier")
+
+
+async def auto_send_task_message(chat_id: int, scheduled_at: float = None):
     """Send current task message without FSM - used by scheduler for auto-advance"""
     routine = routines_dict[chat_id]
     
@@ -1577,23 +1804,19 @@ async def auto_send_task_message(chat_id: int):
 `{completion:.0f}%` · `{remaining} left`
 """
         
-        replies = user_replies.get(chat_id, DEFAULT_REPLIES)
-        buttons = [[KeyboardButton(text=reply)] for reply in replies[:3]]
-        buttons.append([KeyboardButton(text="Menu")])
-        
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=buttons)
-        await bot.send_message(chat_id, text, reply_markup=markup, disable_notification=True)
+        await send_task_message(chat_id, routine, text, scheduled_at=scheduled_at)
         
         # Task timer starts now
-        routine.current_task_sent_at = datetime.datetime.now(pytz.UTC)
+        routine.current_task_sent_at = clock.now(pytz.UTC)
         routine.in_buffer = False
-        save_routines()
+        save_routines(chat_id)
         return True
     else:
         # All tasks done - finish routine
         completion = routine.get_completion_percentage()
         routine.finish_routine()
-        save_routines()
+        end_live_message(chat_id)
+        save_routines(chat_id)
         
         if completion >= 100:
             streak_bar = make_streak_bar(routine.current_streak, 10)
@@ -1613,7 +1836,7 @@ _{get_encouragement_message(routine.current_streak)}_
 Streak reset
 Tomorrow is a fresh start
 """
-        await bot.send_message(chat_id, message, disable_notification=True)
+        await deliver(chat_id, message, disable_notification=True, scheduled_at=scheduled_at)
         return False
 
 # Add this handler BEFORE handle_menu_fallback
@@ -1647,24 +1870,18 @@ async def catch_all_start_routine(message: types.Message, state: FSMContext):
     # HONESTY CHECK: If awaiting confirmation, any reply = admit failure
     if routine.awaiting_honesty_check:
         routine.mark_day_failed()
-        save_routines()
-        await bot.send_message(
+        save_routines(chat_id)
+        await deliver(
             chat_id,
             make_header("NOTED") + "\nStreak reset\nTomorrow is a fresh start",
             disable_notification=True
         )
         routine.awaiting_honesty_check = False
-        save_routines()
+        save_routines(chat_id)
         return
     
     # Check if we're in the time window
-    user_tz = pytz.timezone(routine.timezone)
-    now = datetime.datetime.now(user_tz)
-    current_minutes = now.hour * 60 + now.minute
-    start_minutes = routine.window_start * 60 + routine.window_start_minute
-    end_minutes = routine.window_end * 60 + routine.window_end_minute
-    
-    if current_minutes < start_minutes or current_minutes >= end_minutes:
+    if not routine.in_window():
         return
     
     # If routine already started, COMPLETE current task then advance
@@ -1673,7 +1890,7 @@ async def catch_all_start_routine(message: types.Message, state: FSMContext):
         idx, current_task = routine.get_current_task()
         if idx is not None:
             routine.complete_task(idx)
-            save_routines()
+            save_routines(chat_id)
         await state.set_state(StepsForm.ROUTINE_ACTIVE)
         await send_next_task(chat_id, state)
     # If routine can start, start it
@@ -1681,7 +1898,7 @@ async def catch_all_start_routine(message: types.Message, state: FSMContext):
         if routine.start_routine():
             print(f"[CATCH-ALL START] Starting routine from: '{text}'")
             await state.set_state(StepsForm.ROUTINE_ACTIVE)
-            save_routines()
+            save_routines(chat_id)
             await send_next_task(chat_id, state)
 
 
@@ -1702,130 +1919,146 @@ async def handle_menu_fallback(message: types.Message, state: FSMContext):
         idx, current_task = routine.get_current_task()
         if idx is not None:
             routine.complete_task(idx)
-            save_routines()
+            save_routines(chat_id)
             print(f"[MENU-FALLBACK] Task done from: '{text}'")
         await auto_send_task_message(chat_id)
         return
     
     await show_main_menu(chat_id, state)
 
-async def action_over_time(current_time, last_sent=None) -> None:
-    """Scheduled tasks that run at specific times"""
-    global routines_dict
-    
-    if last_sent is None:
-        last_sent = {}
+# ── Notification rules: what the scheduler sends, and when ──
+
+WARNING_MINUTES = 60
+MISSED_CHECK_MINUTES = 30
+HONESTY_TIMEOUT_MINUTES = 60
+MORNING_START_MIN_LEFT = 20  # No auto-start (e.g. after downtime) with less window than this left
+
+
+async def rule_stale_cleanup(ctx: RuleContext) -> bool:
+    """A routine still running from a previous day (its window end was missed): that day is missed"""
+    routine = ctx.routine
+    if routine.start_time:
+        started_date = routine.start_time.astimezone(pytz.timezone(routine.timezone)).date().isoformat()
+        if started_date < ctx.day:
+            print(f"    → {ctx.chat_id}: stale routine from {started_date}, resetting")
+            routine.drop_stale_routine(started_date)
+            end_live_message(ctx.chat_id)
+            save_routines(ctx.chat_id)
+            return True
+    return False
+
+
+async def rule_morning_start(ctx: RuleContext) -> bool:
+    """Window start: auto-start the routine and send the first task"""
+    routine = ctx.routine
+    print(f"    → {ctx.chat_id}: auto-starting routine and sending first task")
+    if routine.start_routine():
+        save_routines(ctx.chat_id)
+        await auto_send_task_message(ctx.chat_id, scheduled_at=ctx.due)
+        return True
+    print(f"    → Auto-start FAILED: can_start={routine.can_start_routine()}, started={routine.routine_started}, history={ctx.day in routine.history}")
+    return False
+
+
+async def rule_warning(ctx: RuleContext) -> bool:
+    """An hour before the window ends and today isn't done yet"""
+    routine = ctx.routine
+    hours_left = WARNING_MINUTES // 60
+    await deliver(
+        ctx.chat_id,
+        f"*⏰ ~{hours_left} hour{'s' if hours_left != 1 else ''} left*\n\n`{routine.current_streak}d` {ICON_STREAK}",
+        disable_notification=True,
+        priority=PRIORITY_ALERT,
+        scheduled_at=ctx.due
+    )
+    return True
+
+
+async def rule_window_end(ctx: RuleContext) -> bool:
+    """Window closed mid-routine: trust the user, complete all tasks, ask the honesty check"""
+    routine = ctx.routine
+    print(f"    → {ctx.chat_id}: window closed, completing all tasks (trust mode)")
+    for task in routine.tasks:
+        if not task.completed and not task.skipped:
+            task.mark_complete()
+    routine.finish_routine()
+    end_live_message(ctx.chat_id)
+    routine.awaiting_honesty_check = True
+    save_routines(ctx.chat_id)
+    
+    await deliver(
+        ctx.chat_id,
+        make_header("WINDOW CLOSED") + f"\nDid you do everything?\n\n`Ignore` = yes, all done\n`Reply` = no, mark incomplete",
+        disable_notification=True,
+        priority=PRIORITY_ALERT,
+        scheduled_at=ctx.due
+    )
+    return True
+
+
+async def rule_missed(ctx: RuleContext) -> bool:
+    """Half an hour after the window: never started means missed"""
+    routine = ctx.routine
+    routine.check_missed_routine(ctx.day)  # ctx.day: the check may run after midnight
+    save_routines(ctx.chat_id)
+    if not routine.history.get(ctx.day, {}).get('missed', False):
+        return False
+    print(f"    → {ctx.chat_id}: missed today")
+    await deliver(
+        ctx.chat_id,
+        "*Window closed*\n\nStreak reset\\. Tomorrow is fresh\\.",
+        disable_notification=True,
+        priority=PRIORITY_ALERT,
+        scheduled_at=ctx.due
+    )
+    return True
+
+
+async def rule_honesty_expiry(ctx: RuleContext) -> bool:
+    """No reply within an hour of the window end: silence = trust"""
+    ctx.routine.awaiting_honesty_check = False
+    save_routines(ctx.chat_id)
+    print(f"    → {ctx.chat_id}: honesty check expired, trusting user")
+    return True
+
+
+async def rule_followup(ctx: RuleContext) -> bool:
+    """The user's configured daily reminder"""
+    msg = ctx.routine.followup_message or "Plan tomorrow"
+    await deliver(
+        ctx.chat_id,
+        make_header("REMINDER") + f"\n{msg}",
+        disable_notification=True,
+        priority=PRIORITY_DIGEST,
+        scheduled_at=ctx.due
+    )
+    print(f"    → {ctx.chat_id}: sent follow-up reminder: {msg}")
+    return True
+
+
+async def rule_evening_summary(ctx: RuleContext) -> bool:
+    """21:00 after a fully completed day"""
+    routine = ctx.routine
+    if routine.history.get(ctx.day, {}).get('completion', 0) < 100:
+        return False
+    streak_bar = make_streak_bar(routine.current_streak, 10)
+    await deliver(
+        ctx.chat_id,
+        make_header("Great day!") + f"\n{streak_bar}\n`{routine.current_streak}d`",
+        disable_notification=True,
+        priority=PRIORITY_DIGEST,
+        scheduled_at=ctx.due
+    )
+    return True
+
+
+async def rule_weekly_report(ctx: RuleContext) -> bool:
+    """Sunday 20:00: the week in review"""
+    routine = ctx.routine
+    stats = routine.get_weekly_stats()
+    visual = create_week_visual(routine)
     
-    # Check notifications for each user in their timezone
-    for chat_id, routine in list(routines_dict.items()):
-        if not routine.is_setup_complete:
-            continue
-        
-        try:
-            # Initialize tracking for this user
-            if chat_id not in last_sent:
-                last_sent[chat_id] = {}
-            
-            # Get current time in user's timezone
-            user_tz = pytz.timezone(routine.timezone)
-            user_time = datetime.datetime.now(user_tz)
-            today = user_time.date().isoformat()
-            current_time_str = user_time.strftime('%Y-%m-%d %H:%M')
-            
-            current_minutes = user_time.hour * 60 + user_time.minute
-            start_minutes = routine.window_start * 60 + routine.window_start_minute
-            end_minutes = routine.window_end * 60 + routine.window_end_minute
-            
-            print(f"[DEBUG {chat_id}] Current: {user_time.strftime('%H:%M')}, Window: {routine.window_start:02d}:{routine.window_start_minute:02d} - {routine.window_end:02d}:{routine.window_end_minute:02d}")
-            
-            # AUTO-CLEANUP: Force finish any ongoing routine after window closes
-            if current_minutes >= end_minutes and routine.routine_started:
-                finish_key = f'finish_{today}'
-                if last_sent[chat_id].get(finish_key) != current_time_str:
-                    print(f"[DEBUG {chat_id}] Auto-finishing routine")
-                    
-                    # Get completion BEFORE finishing
-                    completion = routine.get_completion_percentage()
-                    
-                    routine.finish_routine()
-                    save_routines()
-                    
-                    if completion < 100:
-                        await bot.send_message(
-                            chat_id,
-                            f"*Window closed*\n\n`{completion:.0f}% complete`\n{'Streak maintained' if completion >= 100 else 'Streak reset'}",
-                            disable_notification=True
-                        )
-                    last_sent[chat_id][finish_key] = current_time_str
-            
-            # Morning reminder - at window start (SILENT)
-            if current_minutes == start_minutes:
-                start_key = f'start_{today}'
-                if today not in routine.history and last_sent[chat_id].get(start_key) != current_time_str:
-                    print(f"[DEBUG {chat_id}] Sending morning reminder")
-                    await bot.send_message(
-                        chat_id,
-                        make_header("Good morning") + "Ready to start?",
-                        disable_notification=True
-                    )
-                    last_sent[chat_id][start_key] = current_time_str
-            
-            # Warning - 1 hour before window ends (SILENT)
-            warning_minutes = end_minutes - 60
-            if warning_minutes > 0 and current_minutes == warning_minutes:
-                warning_key = f'warning_{today}'
-                if today not in routine.history and last_sent[chat_id].get(warning_key) != current_time_str:
-                    minutes_left = end_minutes - current_minutes
-                    hours_left = minutes_left // 60
-                    if hours_left > 0:
-                        print(f"[DEBUG {chat_id}] Sending warning")
-                        await bot.send_message(
-                            chat_id,
-                            f"*⏰ ~{hours_left} hour{'s' if hours_left != 1 else ''} left*\n\n`{routine.current_streak}d` {ICON_STREAK}",
-                            disable_notification=True
-                        )
-                        last_sent[chat_id][warning_key] = current_time_str
-            
-            # Check for missed routines - 30 minutes after window ends
-            missed_check_minutes = end_minutes + 30
-            if current_minutes == missed_check_minutes:
-                missed_key = f'missed_{today}'
-                if last_sent[chat_id].get(missed_key) != current_time_str:
-                    routine.check_missed_routine()
-                    
-                    if routine.history.get(today, {}).get('missed', False):
-                        print(f"[DEBUG {chat_id}] Sending missed notification")
-                        await bot.send_message(
-                            chat_id,
-                            "*Window closed*\n\nStreak reset\\. Tomorrow is fresh\\.",
-                            disable_notification=True
-                        )
-                    save_routines()
-                    last_sent[chat_id][missed_key] = current_time_str
-            
-            # Evening success message - 9:00 PM (SILENT)
-            elif user_time.hour == 21 and user_time.minute == 0:
-                evening_key = f'evening_{today}'
-                if last_sent[chat_id].get(evening_key) != current_time_str:
-                    day_data = routine.history.get(today, {})
-                    
-                    if day_data.get('completion', 0) >= 100:
-                        streak_bar = make_streak_bar(routine.current_streak, 10)
-                        await bot.send_message(
-                            chat_id,
-                            make_header("Great day!") + f"\n{streak_bar}\n`{routine.current_streak}d`",
-                            disable_notification=True
-                        )
-                        last_sent[chat_id][evening_key] = current_time_str
-            
-            # Weekly report - Sunday 8:00 PM (SILENT)
-            elif user_time.weekday() == 6 and user_time.hour == 20 and user_time.minute == 0:
-                weekly_key = f'weekly_{today}'
-                if last_sent[chat_id].get(weekly_key) != current_time_str:
-                    stats = routine.get_weekly_stats()
-                    visual = create_week_visual(routine)
-                    
-                    report = f"""*WEEK COMPLETE*
+    report = f"""*WEEK COMPLETE*
 
 {visual}
 
@@ -1835,203 +2068,263 @@ async def action_over_time(current_time, last_sent=None) -> None:
 `{stats['best_streak']}d` best
 
 {get_weekly_insights(stats)}"""
-                    
-                    await bot.send_message(chat_id, report, disable_notification=True)
-                    last_sent[chat_id][weekly_key] = current_time_str
+    
+    await deliver(ctx.chat_id, report, disable_notification=True, priority=PRIORITY_DIGEST, scheduled_at=ctx.due)
+    return True
+
+
+# Declaration order breaks ties between rules due at the same instant
+NOTIFICATION_RULES = [
+    # Valid all day and first in the day: after downtime across midnight it resets a
+    # stale routine before window_end could close it as today's
+    Rule('stale_cleanup', at_midnight(valid='day'), rule_stale_cleanup,
+         applies=lambda h, day: h.routine_started, dormant=True),
+    Rule('morning_start', at_window_start(valid='window'), rule_morning_start,
+         applies=lambda h, day: not h.routine_started and h.last_day != day,
+         stale_margin=MORNING_START_MIN_LEFT * 60),
+    Rule('warning', at_window_end(-WARNING_MINUTES), rule_warning,
+         applies=lambda h, day: h.last_day != day),
+    Rule('window_end', at_window_end(0, valid='day'), rule_window_end,
+         applies=lambda h, day: h.routine_started, dormant=True),
+    Rule('missed', at_window_end(MISSED_CHECK_MINUTES), rule_missed,
+         applies=lambda h, day: h.last_day != day),
+    Rule('honesty_expiry', at_window_end(HONESTY_TIMEOUT_MINUTES, valid='day'), rule_honesty_expiry,
+         applies=lambda h, day: h.awaiting_honesty_check, dormant=True),
+    Rule('followup', at_followup(), rule_followup),
+    Rule('evening_summary', at_local_time(21, 0), rule_evening_summary,
+         applies=lambda h, day: h.last_day == day),
+    Rule('weekly_report', at_local_time(20, 0, weekday=6), rule_weekly_report, dormant=True),
+]
+rule_engine = RuleEngine(NOTIFICATION_RULES)
+
+def task_deadline(routine: MorningRoutine):
+    """Epoch seconds when the current task auto-advances, or None"""
+    if not routine.routine_started or not routine.current_task_sent_at or routine.paused:
+        return None
+    _, current_task = routine.get_current_task()
+    if current_task is None:
+        return None
+    return routine.current_task_sent_at.timestamp() + (current_task.duration + routine.buffer_minutes) * 60
+
+
+def schedule_user(chat_id: int, not_before: float = 0.0) -> None:
+    """Recompute chat_id's next fire time; only this user's heap entry changes"""
+    header = routines_dict.headers.get(chat_id)
+    if header is None:
+        event_heap.cancel(chat_id)
+        zone_buckets.remove(chat_id)
+        task_timers.cancel(chat_id)
+        activity_tiers.remove(chat_id)
+        catch_up.discard(chat_id)
+        return
+    bucket = zone_buckets.assign(chat_id, header)
+    routine = routines_dict.routines.get(chat_id)
+    now = clock.time()
+    dormant = activity_tiers.classify(chat_id, header, now)
+    if header.routine_started and routine is None:
+        # Its task timer needs the full routine: hydrate on the next pass
+        fire_at = now
+    else:
+        fire_at = rule_engine.next_fire_time(bucket, header, now, dormant)
+    if fire_at is not None:
+        fire_at = max(fire_at, not_before)
+    event_heap.schedule(chat_id, fire_at)
+    task_timers.set(chat_id, task_deadline(routine) if routine is not None else None)
+
+
+async def auto_advance(chat_id: int) -> None:
+    """Task timer fired: wait duration + buffer is over, complete it and send the next"""
+    try:
+        routine = routines_dict.get(chat_id)
+        if routine is None or not routine.routine_started or not routine.current_task_sent_at:
+            return
+        if not routine.in_window():
+            return  # Window end handling takes over
         
-        except Exception as e:
-            print(f"[ERROR] {chat_id}: {e}")
-            if 'blocked' in str(e).lower():
-                del routines_dict[chat_id]
-                print(f"Removed blocked user: {chat_id}")
+        deadline = task_deadline(routine)
+        if deadline is None or clock.time() < deadline:
+            schedule_user(chat_id)  # Moved meanwhile: re-arm
+            return
+        idx, current_task = routine.get_current_task()
+        print(f"    → Auto-advancing {chat_id}: {current_task.name} ({clock.time() - deadline:.1f}s after deadline)")
+        routine.complete_task(idx)
+        save_routines(chat_id)
+        await auto_send_task_message(chat_id, scheduled_at=deadline)
+    except Exception as e:
+        print(f"    ✗ AUTO-ADVANCE ERROR {chat_id}: {e}")
+
+
+def scheduler_startup() -> None:
+    """Schedule every indexed user and ramp out whatever is already overdue"""
+    now = clock.time()
+    backlog = []
+    for chat_id in list(routines_dict.headers):
+        schedule_user(chat_id)
+        header = routines_dict.headers[chat_id]
+        entry = rule_engine.next_due(zone_buckets.get(chat_id), header, now, chat_id in activity_tiers.cold)
+        if ((entry is not None and entry[0] <= now) or
+                (header.routine_started and chat_id not in routines_dict.routines)):
+            backlog.append((chat_id, entry[1] if entry is not None else float('inf')))
+    # Catch-up: everything overdue is ramped out instead of sent in one burst
+    for chat_id, release_at, collapsed in catch_up.plan(backlog, now):
+        event_heap.schedule(chat_id, release_at)
+    catch_up_stats = catch_up.stats()
+    print(f"✓ Scheduled {len(event_heap)} users, next event in {max(0.0, (event_heap.next_time() or now) - now):.0f}s")
+    print(f"✓ Catch-up: {catch_up_stats['backlog']} users overdue, {catch_up_stats['collapsed']} collapsed, releasing " + (f"{CATCHUP_RATE:g}/s over ~{catch_up_stats['planned_s']:.0f}s" if CATCHUP_RATE > 0 else "all at once"))
+
+
+async def scheduler_pass(now: float) -> list:
+    """Dispatch every user due at `now`; returns their chat_ids.
+
+    Rules only update routines and queue messages, so this is the compute
+    phase; the queued sends go out concurrently afterwards and fan_out
+    settles them in the background.
+    """
+    due = event_heap.pop_due(now)
+    # Time checks once per bucket, then fanned out to its due members
+    by_bucket: dict = {}
+    for chat_id in due:
+        by_bucket.setdefault(zone_buckets.bucket_of.get(chat_id), []).append(chat_id)
+    for key, members in by_bucket.items():
+        bucket = zone_buckets.buckets.get(key)
+        if bucket is None:
+            continue
+        local_now = bucket.local_now(now)
+        zone_buckets.ticks += 1
+        zone_buckets.fanout += len(members)
+        for chat_id in members:
+            await rule_engine.dispatch(chat_id, bucket, now, local_now, routines_dict.headers.get,
+                                       routines_dict.get, save_routines, chat_id in activity_tiers.cold,
+                                       on_error=fan_out.fail)
+            header = routines_dict.headers.get(chat_id)
+            if header is not None and header.routine_started:
+                routines_dict.get(chat_id)  # Hydrated, so its task timer can be armed
+            if catch_up.done(chat_id, now):
+                print(f"✓ Catch-up backlog drained in {catch_up.stats()['drain_s']:.1f}s")
+            # Anything still overdue is retried next minute, not in a busy loop
+            schedule_user(chat_id, not_before=(now // 60 + 1) * 60)
+    fan_out.end_pass()
+    return due
+
+
+def report_scheduler_stats() -> None:
+    """One summary line per scheduler component"""
+    write_stats = persistence.stats()
+    cache_stats = routines_dict.stats()
+    timer_stats = task_timers.stats()
+    bucket_stats = zone_buckets.stats()
+    print(f"[SCHEDULER] Buckets: {bucket_stats['buckets']} for {bucket_stats['users']} users (largest {bucket_stats['largest']}, top 5 hold {bucket_stats['top5_share']:.0%}), {bucket_stats['fanout']} user checks from {bucket_stats['ticks']} bucket ticks")
+    print(f"[SCHEDULER] Task timers: {timer_stats['armed']} armed, {timer_stats['fired']} fired, max lateness {timer_stats['max_lateness_ms']:.0f}ms")
+    rule_costs = ", ".join(f"{name} {r['fired']}/{r['checks']} ({r['avg_ms']:.2f}ms)"
+                           for name, r in rule_engine.stats().items() if r['checks'])
+    tier_stats = activity_tiers.stats(len(zone_buckets.bucket_of))
+    print(f"[SCHEDULER] Tiers: {tier_stats['hot']} hot, {tier_stats['cold']} cold ({tier_stats['promotions']} promoted, {tier_stats['demotions']} demoted)")
+    print(f"[SCHEDULER] Rules fired/checked: {rule_costs or 'none yet'}")
+    outbound_stats = outbound.stats()
+    fan_out_stats = fan_out.stats()
+    print(f"[SCHEDULER] Delivery delay: p50 {fan_out_stats['p50_s']:.1f}s, p99 {fan_out_stats['p99_s']:.1f}s, max {fan_out_stats['max_s']:.1f}s ({fan_out_stats['delivered']} delivered, {fan_out_stats['failed']} failed for {fan_out_stats['failed_users']} users; {fan_out_stats['late']} late sends not counted, max {fan_out_stats['late_max_s']:.0f}s)")
+    print(f"[SCHEDULER] Outbound: {outbound_stats['sent']} sent, {outbound_stats['failed']} failed, {outbound_stats['retries']} retried, {outbound_stats['throttled']} flood waits, {outbound_stats['blocked']} blocked, {outbound_stats['queued']} queued (max {outbound_stats['max_depth']}), wait avg {outbound_stats['avg_wait_ms']:.0f}ms max {outbound_stats['max_wait_ms']:.0f}ms, {outbound_stats['by_priority']}")
+    if EDIT_TASK_MESSAGES:
+        live_stats = live_messages.stats()
+        print(f"[SCHEDULER] Task messages: {live_stats['messages']} sent, {live_stats['edits']} edited in place ({live_stats['saved_share']:.0%} saved), {live_stats['fallbacks']} fallbacks, {live_stats['routines']} routines")
+    if SKIP_UNCHANGED_KEYBOARDS:
+        keyboard_stats = reply_keyboards.stats()
+        print(f"[SCHEDULER] Reply keyboards: {keyboard_stats['sent']} sent, {keyboard_stats['skipped']} unchanged and left out ({keyboard_stats['skipped_share']:.0%}), {keyboard_stats['interned']} shared task keyboards")
+    if send_workers is not None:
+        worker_stats = send_workers.stats()
+        print(f"[SCHEDULER] Send workers: {worker_stats['workers']} alive, {worker_stats['sent']} sent, {worker_stats['failed']} failed, {worker_stats['in_flight']} in flight, {worker_stats['rebalances']} rebalances")
+    if catch_up.pending:
+        print(f"[SCHEDULER] Catch-up: {len(catch_up.pending)}/{catch_up.backlog} users still queued, {catch_up.discarded} deleted or blocked")
+    print(f"[SCHEDULER] {len(event_heap)} users scheduled, write queue: {write_stats['queue_depth']} pending, last flush {write_stats['last_flush_ms']:.1f}ms")
+    print(f"[SCHEDULER] Cache: {cache_stats['resident']}/{cache_stats['users']} users, {cache_stats['resident_kb']}/{cache_stats['budget_kb']}KB, {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['evictions']} evictions")
+
 
 async def scheduled_messages(task_dictionary=None):
-    """Background task for scheduled notifications"""
+    """Background task for scheduled notifications: sleeps until the earliest user is due"""
     print("\n SCHEDULED MESSAGES TASK IS RUNNING \n")
     
-    loop_count = 0
-    last_notified = {}
+    task_timers.start()
+    scheduler_startup()
+    
+    wake_count = 0
+    last_report = 0.0
     
     while True:
         try:
-            loop_count += 1
-            now = datetime.datetime.now()
-            
-            print(f"\n[LOOP {loop_count}] Checking at {now.strftime('%H:%M:%S')}")
-            
-            for chat_id, routine in list(routines_dict.items()):
-                if not routine.is_setup_complete:
-                    continue
-                
-                try:
-                    user_tz = pytz.timezone(routine.timezone)
-                    user_time = datetime.datetime.now(user_tz)
-                    today = user_time.date().isoformat()
-                    
-                    current_minutes = user_time.hour * 60 + user_time.minute
-                    start_minutes = routine.window_start * 60 + routine.window_start_minute
-                    end_minutes = routine.window_end * 60 + routine.window_end_minute
-                    
-                    print(f"  - Chat {chat_id}: {user_time.strftime('%H:%M')} | Window: {routine.window_start:02d}:{routine.window_start_minute:02d}-{routine.window_end:02d}:{routine.window_end_minute:02d} | Started: {routine.routine_started}")
-                    
-                    if chat_id not in last_notified:
-                        last_notified[chat_id] = {}
-                    
-                    # CLEANUP: If routine_started from a previous day, reset it
-                    if routine.routine_started and routine.start_time:
-                        started_date = routine.start_time.astimezone(user_tz).date().isoformat()
-                        if started_date != today:
-                            print(f"    → Stale routine from {started_date}, resetting")
-                            routine.check_missed_routine()
-                            save_routines()
-                    
-                    # AUTO-START: At window start, auto-start routine and send first task
-                    if (start_minutes <= current_minutes < end_minutes and 
-                        not routine.routine_started and 
-                        today not in routine.history and
-                        last_notified[chat_id].get('start') != today):
-                        
-                        print(f"    → Auto-starting routine and sending first task")
-                        if routine.start_routine():
-                            save_routines()
-                            await auto_send_task_message(chat_id)
-                        else:
-                            print(f"    → Auto-start FAILED: can_start={routine.can_start_routine()}, started={routine.routine_started}, history={today in routine.history}")
-                        last_notified[chat_id]['start'] = today
-                    
-                    # AUTO-ADVANCE: wait duration + buffer, then complete and send next
-                    if (routine.routine_started and 
-                        routine.current_task_sent_at and
-                        start_minutes <= current_minutes < end_minutes):
-                        
-                        idx, current_task = routine.get_current_task()
-                        if current_task:
-                            elapsed = (datetime.datetime.now(pytz.UTC) - routine.current_task_sent_at).total_seconds() / 60
-                            total_wait = current_task.duration + routine.buffer_minutes
-                            
-                            if elapsed >= total_wait:
-                                print(f"    → Auto-advancing: {current_task.name} ({elapsed:.0f}m >= {total_wait}m)")
-                                routine.complete_task(idx)
-                                save_routines()
-                                await auto_send_task_message(chat_id)
-                    
-                    # END OF WINDOW: Trust user, complete all tasks, ask honesty check
-                    if current_minutes >= end_minutes and routine.routine_started:
-                        end_key = f'end_{today}'
-                        if last_notified[chat_id].get('end') != today:
-                            print(f"    → Window closed, completing all tasks (trust mode)")
-                            for task in routine.tasks:
-                                if not task.completed and not task.skipped:
-                                    task.mark_complete()
-                            routine.finish_routine()
-                            routine.awaiting_honesty_check = True
-                            save_routines()
-                            
-                            await bot.send_message(
-                                chat_id,
-                                make_header("WINDOW CLOSED") + f"\nDid you do everything?\n\n`Ignore` = yes, all done\n`Reply` = no, mark incomplete",
-                                disable_notification=True
-                            )
-                            last_notified[chat_id]['end'] = today
-                    
-                    # HONESTY CHECK TIMEOUT: Clear after 1 hour (silence = trust)
-                    if (routine.awaiting_honesty_check and 
-                        current_minutes >= end_minutes + 60):
-                        routine.awaiting_honesty_check = False
-                        save_routines()
-                        print(f"    → Honesty check expired, trusting user")
-                    
-                    # FOLLOW-UP REMINDER: Configurable daily reminder
-                    if routine.followup_enabled:
-                        followup_minutes = routine.followup_hour * 60 + routine.followup_minute
-                        if current_minutes == followup_minutes:
-                            followup_key = f'followup_{today}'
-                            if last_notified[chat_id].get('followup') != today:
-                                msg = routine.followup_message or "Plan tomorrow"
-                                await bot.send_message(
-                                    chat_id,
-                                    make_header("REMINDER") + f"\n{msg}",
-                                    disable_notification=True
-                                )
-                                last_notified[chat_id]['followup'] = today
-                                print(f"    → Sent follow-up reminder: {msg}")
-                    
-                except Exception as e:
-                    print(f"    ✗ ERROR: {e}")
-                    import traceback
-                    traceback.print_exc()
+            now = clock.time()
+            due = await scheduler_pass(now)
+            if due:
+                wake_count += 1
+                print(f"\n[WAKE {wake_count}] {len(due)} due at {clock.now().strftime('%H:%M:%S')}")
             
-            print(f"[LOOP {loop_count}] Sleeping 60s\n")
+            if now - last_report >= 60:
+                last_report = now
+                report_scheduler_stats()
             
         except Exception as e:
             print(f"\n!!! LOOP ERROR: {e}")
             import traceback
             traceback.print_exc()
         
-        await asyncio.sleep(60)
-
-def save_routines() -> None:
-    """Save all routines to JSON"""
-    data = {
-        'routines': {
-            str(chat_id): routine.to_dict() 
-            for chat_id, routine in routines_dict.items()
-        },
-        'user_replies': {
-            str(chat_id): replies
-            for chat_id, replies in user_replies.items()
-        }
+        await event_heap.wait()
+
+def build_record(chat_id: int) -> dict:
+    """Everything persisted for one user: routine + quick replies + FSM state (None = deleted)"""
+    routine = routines_dict.routines.get(chat_id)
+    if routine is None:
+        return None
+    return {
+        'routine': routine.to_dict(),
+        'user_replies': user_replies.get(chat_id),
+        'fsm': fsm_storage.snapshot(chat_id) if isinstance(fsm_storage, RecordFSMStorage) else None
     }
-    with open(FILE_NAME, 'w') as f:
-        json.dump(data, f, indent=2)
 
 
-def load_routines() -> dict:
-    """Load routines from JSON"""
-    try:
-        with open(FILE_NAME, 'r') as f:
-            data = json.load(f)
-        
-        # Load routines
-        routines = {}
-        routine_data = data.get('routines', data) if isinstance(data.get('routines'), dict) else data
-        for chat_id, routine_info in routine_data.items():
-            routines[int(chat_id)] = MorningRoutine.from_dict(routine_info)
-        
-        # Load custom replies
-        global user_replies
-        if 'user_replies' in data:
-            user_replies = {int(k): v for k, v in data['user_replies'].items()}
-        else:
-            user_replies = {}
-        
-        print(f"Loaded {len(routines)} routines from file")
-        return routines
-    
-    except FileNotFoundError:
-        print("No existing routines file found")
-        return {}
-    except json.JSONDecodeError:
-        print("ERROR: Invalid JSON in routines file")
-        return {}
-    except Exception as e:
-        print(f"ERROR loading routines: {e}")
-        return {}
+def save_routines(chat_id: int) -> None:
+    """Mark chat_id changed; the write-behind queue persists it shortly after"""
+    # Dirty first: pins the routine in the cache until it is flushed
+    persistence.mark_dirty(chat_id)
+    routines_dict.refresh_header(chat_id)
+    schedule_user(chat_id)
 
-async def main() -> None:
-    global FILE_NAME, routines_dict
+
+def prepare_storage() -> None:
+    """Import the legacy single-file data into an empty backend (one time)"""
+    if store.is_empty() and os.path.exists(FILE_NAME) and STORAGE_BACKEND != 'json':
+        imported = import_legacy_file(FILE_NAME, store)
+        print(f"Imported {imported} users from {FILE_NAME} into {STORAGE_BACKEND} storage")
+
+
+async def load_index_and_schedule() -> None:
+    """Load compact user headers off the loop, then start persistence and the scheduler"""
+    started = time.perf_counter()
+    headers = await asyncio.to_thread(store.load_headers)
+    routines_dict.install_headers(headers)
+    print(f"✓ Indexed {len(headers)} users in {(time.perf_counter() - started) * 1000:.0f}ms")
     
-    FILE_NAME = './routines_data.json'
-    routines_dict = load_routines()
+    persistence.start()
+    print(f"✓ Write-behind persistence started ({FLUSH_INTERVAL}s interval)")
+    
+    if send_workers is not None:
+        send_workers.start()
+        print(f"✓ {SCHEDULER_WORKERS} scheduler send workers started ({send_workers.partitions} chat partitions)")
+    
+    await scheduled_messages()
+
+async def main() -> None:
+    prepare_storage()
     
     print(f"\n{'='*50}")
     print(f"BOT STARTING")
-    print(f"Loaded {len(routines_dict)} users")
+    print(f"Storage: {STORAGE_BACKEND}")
     print(f"{'='*50}\n")
     
-    # Create the scheduled task
-    scheduled_task = asyncio.create_task(scheduled_messages())
-    print("✓ Scheduled notifications task created")
+    # Users are hydrated on demand, so polling starts before the index is loaded
+    scheduled_task = asyncio.create_task(load_index_and_schedule())
+    print("✓ Index loading and scheduled notifications task created")
+    
+    outbound.start()
+    print(f"✓ Outbound queue started ({SEND_RATE:g}/s, {SEND_CHAT_RATE:g}/s per chat)")
     
     try:
         # Start polling
@@ -2039,7 +2332,11 @@ async def main() -> None:
         await dp.start_polling(bot)
     finally:
         scheduled_task.cancel()
-        save_routines()
+        await outbound.stop()
+        if send_workers is not None:
+            await send_workers.stop()
+        await persistence.stop()
+        store.close()
         await bot.session.close()
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,193 @@
+"""Run the scheduler over days of virtual time for thousands of synthetic users.
+
+The clock is virtual and jumps straight to the next due event (scheduler
+entry, task timer or user reply), so a week of traffic takes seconds.
+Nothing reaches Telegram: the bot is replaced by a stand-in that counts
+messages. Users get random windows, tasks and time zones; a `responsive`
+share of them answer each task after part of its duration, the rest are
+left to auto-advance. Storage is a fresh backend in a temporary directory.
+
+Usage:
+    python function_dir/simulate.py
+    python function_dir/simulate.py 5000 7 0.7
+    (users, days, share of responsive users)
+"""
+import asyncio
+import contextlib
+import heapq
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pytz
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from classes_dir import clock
+
+TIMEZONES = ['Europe/Helsinki', 'Europe/London', 'America/New_York', 'Asia/Tokyo', 'Australia/Sydney']
+TASK_NAMES = ['Water', 'Stretch', 'Shower', 'Journal', 'Read', 'Walk']
+TASK_HEADER = '*  TASK '  # How make_header() starts a task message
+
+
+class SimulatedBot:
+    """Stand-in for Bot: records sends instead of making them"""
+
+    def __init__(self, on_send):
+        self.on_send = on_send
+        self.sent = 0
+        self.message_id = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent += 1
+        self.message_id += 1
+        self.on_send(chat_id, text)
+        return type('Sent', (), {'message_id': self.message_id})()
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs):
+        self.sent += 1
+        self.on_send(chat_id, text)
+        return True
+
+
+def synthetic_routine(chat_id: int, rng: random.Random):
+    from classes_dir.morning_routine_class import MorningRoutine
+    routine = MorningRoutine(chat_id)
+    for name in rng.sample(TASK_NAMES, rng.randint(2, 5)):
+        routine.add_task(name, rng.choice([5, 10, 15, 20]))
+    routine.timezone = rng.choice(TIMEZONES)
+    routine.window_start, routine.window_start_minute = rng.randint(5, 8), rng.choice([0, 15, 30, 45])
+    routine.window_end, routine.window_end_minute = routine.window_start + rng.randint(2, 4), routine.window_start_minute
+    routine.followup_enabled = rng.random() < 0.3
+    routine.is_setup_complete = True
+    return routine
+
+
+async def simulate(main, users: int, days: float, responsive_share: float, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    virtual = clock.current()
+    replies: list = []  # (at, chat_id, task index)
+    responsive = set(rng.sample(range(1, users + 1), int(users * responsive_share)))
+
+    def on_send(chat_id: int, text: str) -> None:
+        # A task message, new or edited in place: responsive users answer it
+        routine = main.routines_dict.routines.get(chat_id)
+        if chat_id not in responsive or TASK_HEADER not in text or routine is None:
+            return
+        idx, task = routine.get_current_task()
+        if task is not None:
+            answer_at = clock.time() + rng.uniform(0.2, 1.0) * task.duration * 60
+            heapq.heappush(replies, (answer_at, chat_id, idx))
+
+    main.bot = SimulatedBot(on_send)
+
+    records = {chat_id: {'routine': synthetic_routine(chat_id, rng).to_dict(), 'user_replies': None, 'fsm': None}
+               for chat_id in range(1, users + 1)}
+    main.store.write(records)
+    main.routines_dict.install_headers(main.store.load_headers())
+
+    main.outbound.start()
+    started = time.perf_counter()
+    end = clock.time() + days * 86400
+    steps = events = answered = 0
+    last_flush = clock.time()
+    main.scheduler_startup()
+    while True:
+        candidates = [t for t in (main.event_heap.next_time(), main.task_timers.next_deadline(),
+                                  replies[0][0] if replies else None) if t is not None]
+        if not candidates or min(candidates) > end:
+            break
+        virtual.advance_to(min(candidates))
+        now = clock.time()
+        steps += 1
+        while replies and replies[0][0] <= now:
+            _, chat_id, idx = heapq.heappop(replies)
+            answered += await user_reply(main, chat_id, idx)
+        await main.task_timers.run_due(now)
+        events += len(await main.scheduler_pass(now))
+        await main.outbound.join()  # Sends happen at this virtual instant
+        if now - last_flush >= 3600:
+            last_flush = now
+            await main.persistence.flush()
+    await main.persistence.flush()
+    await main.outbound.stop()
+    await main.fan_out.join()
+    return {
+        'users': users,
+        'days': days,
+        'wall_s': time.perf_counter() - started,
+        'steps': steps,
+        'events': events,
+        'sends': main.bot.sent,
+        'replies': answered,
+        'auto_advances': main.task_timers.fired,
+        'rules': main.rule_engine.stats(),
+        'delivery': main.fan_out.stats(),
+        'tiers': main.activity_tiers.stats(len(main.zone_buckets.bucket_of)),
+        'live_messages': main.live_messages.stats() if main.EDIT_TASK_MESSAGES else None,
+        'completions': sum(main.routines_dict.get(chat_id).total_completions for chat_id in records)
+    }
+
+
+async def user_reply(main, chat_id: int, idx: int) -> int:
+    """The user answers a task message: same path as the menu fallback handler"""
+    routine = main.routines_dict.get(chat_id)
+    if routine is None or not routine.routine_started or not routine.in_window():
+        return 0
+    current, task = routine.get_current_task()
+    if current != idx:
+        return 0  # Already auto-advanced past it
+    today = clock.now(pytz.UTC).date().isoformat()
+    if routine.last_seen != today:
+        routine.last_seen = today
+    routine.complete_task(idx)
+    main.save_routines(chat_id)
+    await main.auto_send_task_message(chat_id)
+    return 1
+
+
+def report(result: dict) -> None:
+    virtual_s = result['days'] * 86400
+    print(f"{result['users']} users, {result['days']:g} virtual days in {result['wall_s']:.1f}s "
+          f"(x{virtual_s / result['wall_s']:,.0f} real time, {result['steps']} clock steps)")
+    print(f"  {result['events']} scheduler events, {result['sends']} messages, "
+          f"{result['replies']} replies, {result['auto_advances']} auto-advances, "
+          f"{result['completions']} completed routines")
+    print(f"  Tiers: {result['tiers']['hot']} hot, {result['tiers']['cold']} cold")
+    delivery = result['delivery']
+    print(f"  Scheduled sends: {delivery['delivered']} delivered, {delivery['failed']} failed, "
+          f"virtual delay p50 {delivery['p50_s']:.1f}s p99 {delivery['p99_s']:.1f}s max {delivery['max_s']:.1f}s, "
+          f"{delivery['late']} late (max {delivery['late_max_s']:.0f}s)")
+    live = result['live_messages']
+    if live is not None:
+        print(f"  Task messages: {live['messages']} sent, {live['edits']} edited in place "
+              f"({live['saved_share']:.0%} saved), {live['fallbacks']} fallbacks")
+    for name, rule in result['rules'].items():
+        if rule['checks']:
+            print(f"  {name:<16} {rule['fired']:>7} fired / {rule['checks']:>7} checks ({rule['avg_ms']:.3f}ms)")
+
+
+if __name__ == "__main__":
+    try:
+        users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+        days = float(sys.argv[2]) if len(sys.argv) > 2 else 7
+        responsive_share = float(sys.argv[3]) if len(sys.argv) > 3 else 0.7
+    except ValueError:
+        print(__doc__)
+        sys.exit(1)
+
+    # Throwaway storage and no real bot: main reads these at import
+    os.chdir(tempfile.mkdtemp(prefix='routine-sim-'))
+    os.environ.setdefault("BOT_TOKEN", "0:simulation")
+    os.environ["SCHEDULER_WORKERS"] = "0"
+    os.environ["SEND_RATE"] = os.environ["SEND_CHAT_RATE"] = "0"  # Rate limits are real time, not virtual
+    # Start at the next UTC midnight so every user sees whole days
+    clock.use(clock.VirtualClock((time.time() // 86400 + 1) * 86400))
+
+    import function_dir.main as main
+
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):  # Per-event scheduler logging
+        result = asyncio.run(simulate(main, users, days, responsive_share))
+    report(result)
@@ -0,0 +1,48 @@
+import datetime
+from typing import Optional
+
+
+class ActivityTiers:
+    """Hot/cold split of scheduled users by the UTC date of their last inbound update.
+
+    A user is cold once `last_seen` is `dormant_days` or more in the past;
+    unknown activity counts as hot. Tiers are re-evaluated whenever a user
+    is rescheduled, so an inbound update (which refreshes last_seen)
+    promotes them straight back.
+    """
+
+    def __init__(self, dormant_days: int):
+        self.dormant_days = dormant_days
+        self.cold: set = set()
+        self._cutoff: Optional[tuple] = None  # (UTC day, ISO date below which users are cold)
+        # Metrics
+        self.promotions = 0
+        self.demotions = 0
+
+    def cutoff(self, now: float) -> str:
+        today = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).date()
+        if self._cutoff is None or self._cutoff[0] != today:
+            self._cutoff = (today, (today - datetime.timedelta(days=self.dormant_days - 1)).isoformat())
+        return self._cutoff[1]
+
+    def classify(self, chat_id: int, header, now: float) -> bool:
+        """True if chat_id is dormant; records tier changes"""
+        dormant = header.last_seen is not None and header.last_seen < self.cutoff(now)
+        if dormant and chat_id not in self.cold:
+            self.cold.add(chat_id)
+            self.demotions += 1
+        elif not dormant and chat_id in self.cold:
+            self.cold.discard(chat_id)
+            self.promotions += 1
+        return dormant
+
+    def remove(self, chat_id: int) -> None:
+        self.cold.discard(chat_id)
+
+    def stats(self, scheduled: int) -> dict:
+        return {
+            'hot': scheduled - len(self.cold),
+            'cold': len(self.cold),
+            'promotions': self.promotions,
+            'demotions': self.demotions
+        }
@@ -0,0 +1,63 @@
+"""Measure scheduler send throughput (events/second) against the number of send workers.
+
+Each event is one send_message to a random chat; sends are simulated
+with a fixed latency, so no bot token or network is needed. With
+--kill-one the first worker is killed halfway through each run to show
+its partitions and unacknowledged jobs moving to the survivors.
+
+Usage:
+    python scheduler_dir/bench_workers.py
+    python scheduler_dir/bench_workers.py 5000 0.02 1 2 4 8 --kill-one
+    (events, latency in seconds, worker counts)
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scheduler_dir.send_workers import SendWorkers
+
+
+async def bench(workers: int, events: int, latency: float, kill_one: bool = False) -> dict:
+    pool = SendWorkers(workers, token='', fake_latency=latency, dead_after=2.0)
+    pool.start()
+    # Time the sends, not the process start-up
+    while any(beat is None for beat in pool.last_beat.values()):
+        await asyncio.sleep(0.1)
+    started = time.perf_counter()
+    for i in range(events):
+        pool.submit(random.randrange(10 ** 9), text=f"event {i}")
+        if kill_one and i == events // 2:
+            pool.processes[0].kill()
+    await pool.drained.wait()
+    elapsed = time.perf_counter() - started
+    stats = pool.stats()
+    await pool.stop()
+    return {'workers': workers, 'events': stats['sent'], 'seconds': elapsed,
+            'per_second': stats['sent'] / elapsed, 'rebalances': stats['rebalances']}
+
+
+async def main(events: int, latency: float, worker_counts: list, kill_one: bool) -> None:
+    print(f"{events} events, {latency * 1000:.0f}ms per send")
+    base = None
+    for workers in worker_counts:
+        result = await bench(workers, events, latency, kill_one and workers > 1)
+        base = base or result['per_second']
+        print(f"  {workers:>2} workers: {result['per_second']:8.0f} events/s "
+              f"({result['seconds']:.2f}s, x{result['per_second'] / base:.1f}"
+              f"{', ' + str(result['rebalances']) + ' rebalance' if result['rebalances'] else ''})")
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != '--kill-one']
+    try:
+        events = int(args[0]) if args else 2000
+        latency = float(args[1]) if len(args) > 1 else 0.02
+        worker_counts = [int(a) for a in args[2:]] or [1, 2, 4, 8]
+    except ValueError:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(main(events, latency, worker_counts, '--kill-one' in sys.argv))
@@ -0,0 +1,76 @@
+import random
+from typing import Dict, List, Optional, Tuple
+
+from classes_dir import clock
+
+
+class CatchUp:
+    """Spreads the startup backlog (events due while the bot was down) over time.
+
+    Backlog users are released at `rate` per second, most urgent event
+    first, each with random jitter inside its slot. A user whose event
+    would close before its slot is collapsed: the event is skipped rather
+    than sent late. `done()` reports when the backlog has drained; users
+    deleted or blocked meanwhile are `discard()`ed. A rate of 0 (or less)
+    means no ramp: the whole backlog is released at once.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.pending: Dict[int, float] = {}  # chat_id -> planned release time
+        # Metrics
+        self.backlog = 0
+        self.collapsed = 0
+        self.discarded = 0
+        self.started: Optional[float] = None
+        self.planned_end: Optional[float] = None
+        self.drained_at: Optional[float] = None
+
+    def plan(self, items: List[Tuple[int, float]], now: float) -> List[Tuple[int, float, bool]]:
+        """items: (chat_id, until) per backlog user -> (chat_id, release_at, collapsed)"""
+        self.started = now
+        self.backlog = len(items)
+        slot = 1.0 / self.rate if self.rate > 0 else 0.0
+        planned = []
+        released = 0
+        for chat_id, until in sorted(items, key=lambda item: item[1]):
+            release_at = now + released * slot + random.uniform(0, slot)
+            if release_at >= until:
+                self.collapsed += 1
+                planned.append((chat_id, until, True))
+                continue
+            released += 1
+            self.pending[chat_id] = release_at
+            planned.append((chat_id, release_at, False))
+        self.planned_end = now + released * slot
+        if not self.pending:
+            self.drained_at = now
+        return planned
+
+    def done(self, chat_id: int, now: Optional[float] = None) -> bool:
+        """Mark chat_id's catch-up handled; True once the whole backlog has drained"""
+        release_at = self.pending.pop(chat_id, None)
+        if release_at is None:
+            return False
+        if not self.pending:
+            self.drained_at = clock.time() if now is None else now
+            return True
+        return False
+
+    def discard(self, chat_id: int) -> None:
+        """chat_id was deleted or blocked before its release: nothing to catch up"""
+        if self.pending.pop(chat_id, None) is None:
+            return
+        self.discarded += 1
+        if not self.pending:
+            self.drained_at = clock.time()
+
+    def stats(self) -> dict:
+        return {
+            'backlog': self.backlog,
+            'collapsed': self.collapsed,
+            'discarded': self.discarded,
+            'pending': len(self.pending),
+            'planned_s': (self.planned_end - self.started) if self.started is not None else 0.0,
+            'drain_s': (self.drained_at - self.started) if self.drained_at is not None else None
+        }
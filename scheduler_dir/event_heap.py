@@ -0,0 +1,69 @@
+import asyncio
+import heapq
+from typing import Dict, List, Optional
+
+from classes_dir import clock
+
+
+class EventHeap:
+    """Min-heap of each user's next fire time with lazy invalidation.
+
+    `due_at` holds the live time per chat_id; heap entries that no longer
+    match it are stale and skipped when they reach the top. `wait()` sleeps
+    until the earliest entry is due or an earlier one is scheduled.
+    """
+
+    def __init__(self):
+        self.heap: List[tuple] = []  # (fire_at, chat_id)
+        self.due_at: Dict[int, float] = {}
+        self.changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.due_at)
+
+    def schedule(self, chat_id: int, fire_at: Optional[float]) -> None:
+        if fire_at is None:
+            self.cancel(chat_id)
+            return
+        if self.due_at.get(chat_id) == fire_at:
+            return
+        earliest = self.next_time()
+        self.due_at[chat_id] = fire_at
+        heapq.heappush(self.heap, (fire_at, chat_id))
+        if earliest is None or fire_at < earliest:
+            self.changed.set()
+        if len(self.heap) > 2 * len(self.due_at) + 1000:
+            self.heap = [(t, c) for c, t in self.due_at.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, chat_id: int) -> None:
+        self.due_at.pop(chat_id, None)
+
+    def next_time(self) -> Optional[float]:
+        while self.heap:
+            fire_at, chat_id = self.heap[0]
+            if self.due_at.get(chat_id) == fire_at:
+                return fire_at
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now: float) -> List[int]:
+        """Remove and return every chat_id due at or before `now`"""
+        due = []
+        while True:
+            fire_at = self.next_time()
+            if fire_at is None or fire_at > now:
+                return due
+            _, chat_id = heapq.heappop(self.heap)
+            del self.due_at[chat_id]
+            due.append(chat_id)
+
+    async def wait(self) -> None:
+        """Sleep until the earliest entry is due (or the heap changes)"""
+        self.changed.clear()
+        fire_at = self.next_time()
+        timeout = None if fire_at is None else max(0.0, fire_at - clock.time())
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,123 @@
+import asyncio
+import functools
+from collections import deque
+from typing import Dict, List
+
+from classes_dir import clock
+
+
+class _Batch:
+    """The sends and rule errors of one scheduler pass"""
+
+    __slots__ = ('results', 'errors', 'outstanding', 'closed')
+
+    def __init__(self):
+        self.results: Dict[int, List[int]] = {}  # chat_id -> [delivered, failed]
+        self.errors: Dict[int, str] = {}
+        self.outstanding = 0
+        self.closed = False
+
+
+class FanOut:
+    """Follows scheduled sends from the instant they were due to delivery.
+
+    A scheduler pass first runs every due user's rules (compute phase:
+    routine changes, messages queued, nothing awaited), then the queued
+    sends go out concurrently through the outbound queue (send phase).
+    `track()` registers each scheduled send and `fail()` a user whose
+    rules raised. After `end_pass()` the batch settles as its sends
+    resolve, without the scheduler waiting, and failures are reported per
+    user. Delivery delays (acked minus due) over the last `window` sends
+    give p50/p99. Sends queued more than `late_after` seconds past their
+    due instant (catch-up after a restart, rules whose condition only held
+    later) are counted apart, so they don't skew the percentiles.
+    """
+
+    def __init__(self, window: int = 10000, late_after: float = 60.0):
+        self.late_after = late_after
+        self.batch = _Batch()
+        self.open_batches = 0
+        self.settled = asyncio.Event()
+        self.settled.set()
+        self.delays = deque(maxlen=window)
+        # Metrics
+        self.passes = 0
+        self.delivered = 0
+        self.failed = 0
+        self.failed_users = 0
+        self.late = 0
+        self.late_max = 0.0
+
+    def track(self, chat_id: int, due: float, future: asyncio.Future) -> None:
+        batch = self.batch
+        batch.outstanding += 1
+        batch.results.setdefault(chat_id, [0, 0])
+        late = clock.time() - due > self.late_after
+        future.add_done_callback(functools.partial(self._resolved, batch, chat_id, due, late))
+
+    def fail(self, chat_id: int, error: str) -> None:
+        self.batch.errors[chat_id] = error
+
+    def _resolved(self, batch: _Batch, chat_id: int, due: float, late: bool, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.result() is not None:
+            batch.results[chat_id][0] += 1
+            delay = max(0.0, clock.time() - due)
+            if late:
+                self.late += 1
+                self.late_max = max(self.late_max, delay)
+            else:
+                self.delays.append(delay)
+        else:
+            batch.results[chat_id][1] += 1
+        batch.outstanding -= 1
+        if batch.closed and not batch.outstanding:
+            self._settle(batch)
+
+    def end_pass(self) -> None:
+        """Close the current pass's batch; it settles once all of its sends resolved"""
+        batch = self.batch
+        if not batch.results and not batch.errors:
+            return
+        self.batch = _Batch()
+        batch.closed = True
+        self.passes += 1
+        self.open_batches += 1
+        self.settled.clear()
+        if not batch.outstanding:
+            self._settle(batch)
+
+    def _settle(self, batch: _Batch) -> None:
+        failed = {c: batch.errors.get(c) for c, (_, f) in batch.results.items() if f}
+        failed.update(batch.errors)
+        self.delivered += sum(d for d, _ in batch.results.values())
+        self.failed += sum(f for _, f in batch.results.values())
+        self.failed_users += len(failed)
+        if failed:
+            shown = ", ".join(f"{c}" + (f" ({e})" if e else "") for c, e in list(failed.items())[:5])
+            users = len(batch.results.keys() | batch.errors.keys())
+            print(f"[FAN-OUT] {len(failed)}/{users} users had failures: {shown}")
+        self.open_batches -= 1
+        if not self.open_batches:
+            self.settled.set()
+
+    async def join(self) -> None:
+        """Wait until every closed batch has settled"""
+        await self.settled.wait()
+
+    def stats(self) -> dict:
+        delays = sorted(self.delays)
+
+        def percentile(p: float) -> float:
+            return delays[min(len(delays) - 1, int(p * len(delays)))] if delays else 0.0
+
+        return {
+            'passes': self.passes,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'failed_users': self.failed_users,
+            'p50_s': percentile(0.50),
+            'p99_s': percentile(0.99),
+            'max_s': delays[-1] if delays else 0.0,
+            'late': self.late,
+            'late_max_s': self.late_max
+        }
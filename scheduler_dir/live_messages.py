@@ -0,0 +1,81 @@
+from typing import Dict, Hashable, List, Optional
+
+
+class LiveMessages:
+    """One task message per running routine, edited in place for each new task.
+
+    Telegram can't change a reply keyboard with an edit, so the live message
+    is only reused while it is still the last message the bot sent to the
+    chat (its keyboard is still the one on screen) and the keyboard it was
+    sent with is unchanged. Otherwise the next task goes out as a new
+    message and becomes the live one. Counts are kept per routine run.
+    """
+
+    def __init__(self):
+        self.last_sent: Dict[int, int] = {}  # chat_id -> message_id of the bot's latest message
+        self.live: Dict[int, tuple] = {}  # chat_id -> (message_id, keyboard key)
+        self.runs: Dict[int, List] = {}  # chat_id -> [run key, new messages, edits]
+        # Metrics
+        self.routines = 0
+        self.messages = 0
+        self.edits = 0
+        self.fallbacks = 0
+
+    def sent(self, chat_id: int, message_id: int) -> None:
+        """The bot sent chat_id a new message (any message, not only tasks)"""
+        self.last_sent[chat_id] = message_id
+
+    def editable(self, chat_id: int, keyboard: Hashable) -> Optional[int]:
+        """message_id to edit for the next task, or None if it must be a new message"""
+        live = self.live.get(chat_id)
+        if live is None or live[1] != keyboard or self.last_sent.get(chat_id) != live[0]:
+            return None
+        return live[0]
+
+    def adopt(self, chat_id: int, message_id: Optional[int], keyboard: Hashable) -> None:
+        """A new task message was sent: it is the one to edit next (None: id unknown, don't edit)"""
+        if message_id is None:
+            self.live.pop(chat_id, None)
+        else:
+            self.live[chat_id] = (message_id, keyboard)
+
+    def failed(self, chat_id: int) -> None:
+        """An edit was refused (message gone, too old, ...): it doesn't count, the task is sent anew"""
+        self.live.pop(chat_id, None)
+        self.fallbacks += 1
+        self.edits -= 1
+        current = self.runs.get(chat_id)
+        if current is not None:
+            current[2] -= 1
+
+    def count(self, chat_id: int, run: Hashable, edited: bool) -> None:
+        """One task shown for routine run `run` (e.g. its start time)"""
+        current = self.runs.get(chat_id)
+        if current is None or current[0] != run:
+            if current is not None:
+                self.finish(chat_id)
+            current = self.runs[chat_id] = [run, 0, 0]
+        current[2 if edited else 1] += 1
+        if edited:
+            self.edits += 1
+        else:
+            self.messages += 1
+
+    def finish(self, chat_id: int) -> Optional[tuple]:
+        """The routine ended: (new messages, edits) for its run; edits are messages saved"""
+        self.live.pop(chat_id, None)
+        current = self.runs.pop(chat_id, None)
+        if current is None:
+            return None
+        self.routines += 1
+        return current[1], current[2]
+
+    def stats(self) -> dict:
+        shown = self.messages + self.edits
+        return {
+            'routines': self.routines,
+            'messages': self.messages,
+            'edits': self.edits,
+            'fallbacks': self.fallbacks,
+            'saved_share': self.edits / shown if shown else 0.0
+        }
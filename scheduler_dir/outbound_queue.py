@@ -0,0 +1,300 @@
+import asyncio
+import heapq
+import itertools
+import random
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+# Lower sends first
+PRIORITY_INTERACTIVE = 0  # Task messages and replies to the user
+PRIORITY_ALERT = 1  # Window warnings, closed window, missed routine
+PRIORITY_DIGEST = 2  # Evening summary, follow-up reminder, weekly report
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_ALERT: 'alert', PRIORITY_DIGEST: 'digest'}
+
+# Transient failures (network, Telegram 5xx) are retried this many times in all
+MAX_ATTEMPTS = 5
+RETRY_BASE = 1.0  # Seconds before the first retry, doubling each time
+RETRY_CAP = 60.0
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError)
+
+
+def backoff(attempt: int) -> float:
+    """Delay before retry number `attempt` (0-based): exponential, half of it jittered"""
+    delay = min(RETRY_CAP, RETRY_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` saved up; rate 0 = unlimited"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate:
+            self._refill(now)
+            self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        return not self.rate or self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class OutboundQueue:
+    """Every outgoing Bot call, rate limited and sent by priority.
+
+    Callers `put()` a call and move on; the returned future resolves to
+    the API result (None if it failed). `transmit(chat_id, method, kwargs,
+    priority)` makes the call. Each chat has its own lane,
+    ordered by (priority, arrival): within a chat an interactive message
+    overtakes a queued digest, and only one call per chat is in flight, so
+    same-priority messages keep their order. Across chats the highest
+    priority head goes first. A global token bucket caps total sends per
+    second, a per-chat bucket caps each chat, and at most `concurrency`
+    calls are in flight.
+
+    Failures are handled by type. Flood control (RetryAfter) pauses only
+    that chat's lane for `retry_after` and keeps the message at its head.
+    Network and server errors are retried the same way after an
+    exponential backoff, up to MAX_ATTEMPTS. Forbidden (the user blocked
+    the bot) drops the chat's lane and reports it to `on_blocked`.
+    """
+
+    def __init__(self, transmit: Callable[[int, str, dict, int], Awaitable], rate: float = 25.0, burst: float = 25.0,
+                 chat_rate: float = 1.0, chat_burst: float = 3.0, concurrency: int = 8,
+                 on_blocked: Optional[Callable[[int], None]] = None):
+        self.transmit = transmit
+        self.on_blocked = on_blocked
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        # chat_id -> heap of (priority, seq, queued_at, method, kwargs, future, attempts)
+        self.lanes: Dict[int, List[tuple]] = {}
+        self.ready: List[tuple] = []  # (priority, seq, chat_id) of sendable lane heads, stale entries skipped
+        self.offered: Dict[int, tuple] = {}  # chat_id -> its live entry in ready
+        self.cooling: List[tuple] = []  # (ready_at, chat_id): lanes waiting on their chat's bucket
+        self.cooling_until: Dict[int, float] = {}
+        self.busy: set = set()  # Chats with a call in flight
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.bucket: Optional[TokenBucket] = None
+        self.seq = itertools.count()
+        self.pending = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.wakeup = asyncio.Event()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.running: set = set()
+        self._task: Optional[asyncio.Task] = None
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self.retries = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.sent_by_priority: Dict[int, int] = {}
+
+    def start(self) -> None:
+        if self._task is None:
+            loop = asyncio.get_running_loop()
+            self.bucket = TokenBucket(self.rate, self.burst, loop.time())
+            self._task = loop.create_task(self._run())
+
+    def put(self, chat_id: int, method: str = 'send_message', priority: int = PRIORITY_INTERACTIVE,
+            **kwargs) -> asyncio.Future:
+        """Queue a Bot call for chat_id; returns a future of its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        item = (priority, next(self.seq), loop.time(), method, kwargs, future, 0)
+        heapq.heappush(self.lanes.setdefault(chat_id, []), item)
+        self.pending += 1
+        self.max_depth = max(self.max_depth, self.pending)
+        self.idle.clear()
+        if chat_id not in self.busy and chat_id not in self.cooling_until:
+            self._offer(chat_id)
+        return future
+
+    def _offer(self, chat_id: int) -> None:
+        """Make chat_id's lane head eligible (again)"""
+        lane = self.lanes.get(chat_id)
+        if not lane:
+            return
+        key = (lane[0][0], lane[0][1], chat_id)
+        if self.offered.get(chat_id) != key:
+            self.offered[chat_id] = key
+            heapq.heappush(self.ready, key)
+            self.wakeup.set()
+
+    def _next_ready(self) -> Optional[int]:
+        while self.ready:
+            chat_id = self.ready[0][2]
+            if self.offered.get(chat_id) == self.ready[0]:
+                return chat_id
+            heapq.heappop(self.ready)
+        return None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self.cooling and self.cooling[0][0] <= now:
+                _, chat_id = heapq.heappop(self.cooling)
+                del self.cooling_until[chat_id]
+                self._offer(chat_id)
+            chat_id = self._next_ready()
+            if chat_id is None:
+                self._prune(now)
+                self.wakeup.clear()
+                timeout = self.cooling[0][0] - now if self.cooling else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            delay = self.bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue  # Something more urgent may have arrived meanwhile
+            await self.slots.acquire()
+            chat_id = self._next_ready()  # May have changed while waiting for a slot
+            if chat_id is None:
+                self.slots.release()
+                continue
+            now = loop.time()
+            heapq.heappop(self.ready)
+            del self.offered[chat_id]
+            item = heapq.heappop(self.lanes[chat_id])
+            self.bucket.take(now)
+            chat_bucket = self.chat_buckets.get(chat_id)
+            if chat_bucket is None:
+                chat_bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            chat_bucket.take(now)
+            self.busy.add(chat_id)
+            if not item[6]:  # Retries don't count as queueing time again
+                wait = now - item[2]
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            task = loop.create_task(self._send(chat_id, item))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _send(self, chat_id: int, item: tuple) -> None:
+        priority, _, _, method, kwargs, future, attempts = item
+        result = None
+        retry_in = None
+        try:
+            result = await self.transmit(chat_id, method, kwargs, priority)
+            self.sent += 1
+            self.sent_by_priority[priority] = self.sent_by_priority.get(priority, 0) + 1
+        except TelegramRetryAfter as e:
+            self.throttled += 1
+            retry_in = e.retry_after
+            print(f"[OUTBOUND] Flood control for {chat_id}: lane paused {e.retry_after}s")
+        except TelegramForbiddenError as e:
+            self.blocked += 1
+            print(f"[OUTBOUND] {chat_id} blocked the bot: {e.message}")
+            self._discard_lane(chat_id)
+            if self.on_blocked is not None:
+                self.on_blocked(chat_id)
+        except TRANSIENT_ERRORS as e:
+            if attempts + 1 < MAX_ATTEMPTS:
+                self.retries += 1
+                retry_in = backoff(attempts)
+                item = item[:6] + (attempts + 1,)
+                print(f"[OUTBOUND] {method} to {chat_id} failed ({type(e).__name__}), retry {attempts + 1} in {retry_in:.1f}s")
+            else:
+                self.failed += 1
+                print(f"[OUTBOUND] {method} to {chat_id} failed after {MAX_ATTEMPTS} attempts: {e}")
+        except Exception as e:
+            self.failed += 1
+            print(f"[OUTBOUND] {method} to {chat_id} failed: {e}")
+        finally:
+            self.slots.release()
+            self.busy.discard(chat_id)
+            if retry_in is not None:
+                # Back at the head of its lane: later messages to this chat wait behind it
+                heapq.heappush(self.lanes.setdefault(chat_id, []), item)
+            else:
+                self.pending -= 1
+                if not future.done():
+                    future.set_result(result)
+            self._release(chat_id, asyncio.get_running_loop().time(), retry_in or 0.0)
+
+    def _discard_lane(self, chat_id: int) -> None:
+        """Drop everything still queued for chat_id (its futures resolve to None)"""
+        for item in self.lanes.pop(chat_id, []):
+            self.pending -= 1
+            if not item[5].done():
+                item[5].set_result(None)
+        self.offered.pop(chat_id, None)
+
+    def _release(self, chat_id: int, now: float, hold: float = 0.0) -> None:
+        """chat_id's call finished: queue its next one (after `hold`), or forget the chat"""
+        chat_bucket = self.chat_buckets[chat_id]
+        if self.lanes.get(chat_id):
+            delay = max(hold, chat_bucket.delay(now))
+            if delay > 0:
+                self.cooling_until[chat_id] = now + delay
+                heapq.heappush(self.cooling, (now + delay, chat_id))
+                self.wakeup.set()
+            else:
+                self._offer(chat_id)
+            return
+        self.lanes.pop(chat_id, None)
+        if not self.pending:
+            self.idle.set()
+
+    def _prune(self, now: float) -> None:
+        """Forget the buckets of quiet chats that have refilled"""
+        for chat_id in [c for c, b in self.chat_buckets.items()
+                        if b.full(now) and c not in self.lanes and c not in self.busy]:
+            del self.chat_buckets[chat_id]
+
+    async def join(self) -> None:
+        """Wait until everything queued so far has been sent"""
+        await self.idle.wait()
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Send what is queued (up to timeout), then stop dispatching"""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.pending - len(self.busy),
+            'in_flight': len(self.busy),
+            'sent': self.sent,
+            'failed': self.failed,
+            'throttled': self.throttled,
+            'retries': self.retries,
+            'blocked': self.blocked,
+            'max_depth': self.max_depth,
+            'avg_wait_ms': self.total_wait / self.sent * 1000 if self.sent else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+            'by_priority': {PRIORITY_NAMES.get(p, p): n for p, n in sorted(self.sent_by_priority.items())}
+        }
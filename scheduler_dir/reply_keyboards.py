@@ -0,0 +1,81 @@
+from typing import Dict, Optional, Sequence
+
+from aiogram.types import InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+KEEP = ()  # Fingerprint of markup that leaves the reply keyboard as it is (inline buttons)
+
+
+def fingerprint(markup) -> Optional[tuple]:
+    """What a markup leaves on the client's keyboard; None when it can't be relied on afterwards"""
+    if isinstance(markup, ReplyKeyboardMarkup):
+        if markup.one_time_keyboard:
+            return None  # Hidden after one tap
+        rows = tuple(tuple(button.text for button in row) for row in markup.keyboard)
+        return rows, markup.resize_keyboard, markup.is_persistent, markup.input_field_placeholder, markup.selective
+    if isinstance(markup, InlineKeyboardMarkup):
+        return KEEP
+    return None  # Keyboard removed or replaced by a forced reply
+
+
+class ReplyKeyboards:
+    """Shared task keyboards, and the reply keyboard each chat has on screen.
+
+    A reply keyboard stays on the client until a later message replaces
+    it, so a send whose keyboard matches the chat's current one goes out
+    without `reply_markup`. `strip()` runs right before the Bot call and
+    `shown()` after it succeeded, in the chat's send order. Task keyboards
+    are built once per distinct reply tuple and shared by every user, with
+    their fingerprint computed once.
+    """
+
+    def __init__(self):
+        self.interned: Dict[tuple, ReplyKeyboardMarkup] = {}  # replies -> markup
+        self.fingerprints: Dict[int, tuple] = {}  # id(interned markup) -> fingerprint
+        self.on_screen: Dict[int, tuple] = {}  # chat_id -> fingerprint of its keyboard
+        # Metrics
+        self.sent = 0
+        self.skipped = 0
+
+    def task_keyboard(self, replies: Sequence[str]) -> ReplyKeyboardMarkup:
+        """One button per quick reply, then Menu"""
+        replies = tuple(replies)
+        markup = self.interned.get(replies)
+        if markup is None:
+            buttons = [[KeyboardButton(text=reply)] for reply in replies]
+            buttons.append([KeyboardButton(text="Menu")])
+            markup = self.interned[replies] = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=buttons)
+            self.fingerprints[id(markup)] = fingerprint(markup)
+        return markup
+
+    def strip(self, chat_id: int, kwargs: dict) -> tuple:
+        """(kwargs to send, fingerprint): reply_markup dropped if chat_id already shows it"""
+        markup = kwargs['reply_markup']
+        key = self.fingerprints.get(id(markup)) or fingerprint(markup)
+        if not key:
+            return kwargs, key
+        if self.on_screen.get(chat_id) == key:
+            self.skipped += 1
+            return {k: v for k, v in kwargs.items() if k != 'reply_markup'}, key
+        self.sent += 1
+        return kwargs, key
+
+    def shown(self, chat_id: int, key: Optional[tuple]) -> None:
+        """A send with markup fingerprint `key` went through"""
+        if key is None:
+            self.on_screen.pop(chat_id, None)
+        elif key is not KEEP:
+            self.on_screen[chat_id] = key
+
+    def forget(self, chat_id: int) -> None:
+        """Keyboard on screen unknown: the next one is sent in full"""
+        self.on_screen.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        total = self.sent + self.skipped
+        return {
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'skipped_share': self.skipped / total if total else 0.0,
+            'interned': len(self.interned),
+            'chats': len(self.on_screen)
+        }
@@ -0,0 +1,229 @@
+import datetime
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import pytz
+
+from classes_dir.window_bounds import local_instant
+
+# How long an "at HH:MM" rule stays deliverable after its minute (covers a slow fan-out)
+AT_TIME_GRACE = 300
+
+
+class RuleContext:
+    """What a rule action gets: the user, their routine, the bucket's local time and when the rule was due"""
+
+    __slots__ = ('chat_id', 'routine', 'day', 'now', 'local_now', 'due')
+
+    def __init__(self, chat_id: int, routine, day: str, now: float, local_now: datetime.datetime, due: float):
+        self.chat_id = chat_id
+        self.routine = routine
+        self.day = day
+        self.now = now
+        self.local_now = local_now
+        self.due = due
+
+
+# ── triggers: (bucket, local day) -> (due, until) in UTC epoch seconds, or None ──
+
+def _valid_until(bucket, day: datetime.date, due: float, valid: str) -> float:
+    tz = pytz.timezone(bucket.timezone)
+    if valid == 'window':
+        return local_instant(tz, day, bucket.window_end * 60 + bucket.window_end_minute)
+    if valid == 'day':
+        until = local_instant(tz, day + datetime.timedelta(days=1), 0)
+        if until > due:
+            return until
+        # Past midnight (window end + offset): open into the next day until its window
+        # starts, after which that day's own entries take over
+        next_start = local_instant(tz, day + datetime.timedelta(days=1), bucket.window_start * 60 + bucket.window_start_minute)
+        return max(next_start, due + AT_TIME_GRACE)
+    return due + AT_TIME_GRACE
+
+
+def at_window_start(valid: str = 'window'):
+    def trigger(bucket, day):
+        due = local_instant(pytz.timezone(bucket.timezone), day, bucket.window_start * 60 + bucket.window_start_minute)
+        return due, _valid_until(bucket, day, due, valid)
+    return trigger
+
+
+def at_window_end(offset_minutes: int = 0, valid: str = 'minute'):
+    def trigger(bucket, day):
+        end_minutes = bucket.window_end * 60 + bucket.window_end_minute
+        if end_minutes + offset_minutes <= 0:
+            return None
+        due = local_instant(pytz.timezone(bucket.timezone), day, end_minutes + offset_minutes)
+        return due, _valid_until(bucket, day, due, valid)
+    return trigger
+
+
+def at_local_time(hour: int, minute: int = 0, weekday: Optional[int] = None, valid: str = 'minute'):
+    def trigger(bucket, day):
+        if weekday is not None and day.weekday() != weekday:
+            return None
+        due = local_instant(pytz.timezone(bucket.timezone), day, hour * 60 + minute)
+        return due, _valid_until(bucket, day, due, valid)
+    return trigger
+
+
+def at_followup(valid: str = 'minute'):
+    def trigger(bucket, day):
+        if not bucket.followup_enabled:
+            return None
+        due = local_instant(pytz.timezone(bucket.timezone), day, bucket.followup_hour * 60 + bucket.followup_minute)
+        return due, _valid_until(bucket, day, due, valid)
+    return trigger
+
+
+def at_midnight(valid: str = 'minute'):
+    def trigger(bucket, day):
+        due = local_instant(pytz.timezone(bucket.timezone), day, 0)
+        return due, _valid_until(bucket, day, due, valid)
+    return trigger
+
+
+class Rule:
+    """A declared notification rule.
+
+    `trigger` gives its due time for a bucket and local day, `applies`
+    filters members by their RoutineHeader flags (no hydration), and
+    `action` runs for each due member, at most once per local day, and
+    returns whether it did anything (sent or changed the routine).
+    `stale_margin` closes the rule that many seconds before its trigger's
+    end, so a late event (e.g. after downtime) is dropped, not sent.
+    Only rules with `dormant=True` run for users in the cold tier.
+    """
+
+    def __init__(self, name: str, trigger, action: Callable[[RuleContext], Awaitable[bool]],
+                 applies: Optional[Callable[[object, str], bool]] = None, stale_margin: int = 0,
+                 dormant: bool = False):
+        self.name = name
+        self.trigger = trigger
+        self.action = action
+        self.applies = applies or (lambda header, day: True)
+        self.stale_margin = stale_margin
+        self.dormant = dormant
+        # Metrics
+        self.checks = 0
+        self.fired = 0
+        self.seconds = 0.0
+
+
+class RuleEngine:
+    """Indexes declared rules by due time per bucket and dispatches only the due ones.
+
+    A bucket's rule times for a local day are computed once and cached, so
+    a member's next fire time is the first (due, until, rule) entry that is
+    still open, not in the header's NotifiedMarks and applies to its header.
+    Entries of a day can fall after its midnight (e.g. window end + 30
+    minutes), so yesterday's list is checked along with today's.
+    """
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        self.order = {rule.name: i for i, rule in enumerate(rules)}
+
+    def rule_times(self, bucket, day: str) -> List[tuple]:
+        cache = bucket.rule_times
+        times = cache.get(day)
+        if times is None:
+            date = datetime.date.fromisoformat(day)
+            times = []
+            for rule in self.rules:
+                window = rule.trigger(bucket, date)
+                if window is None:
+                    continue
+                due, until = window[0], window[1] - rule.stale_margin
+                if until > due:
+                    times.append((due, until, self.order[rule.name], rule))
+            times.sort(key=lambda t: (t[0], t[2]))
+            # Only today and tomorrow are ever asked for
+            for stale in [d for d in cache if d < day][:-1]:
+                del cache[stale]
+            cache[day] = times
+        return times
+
+    def next_due(self, bucket, header, now: float, dormant: bool = False) -> Optional[tuple]:
+        """(due, until, rule) of the earliest rule that could still fire for this member"""
+        if not header.is_setup_complete:
+            return None
+        today = datetime.date.fromisoformat(bucket.local_day(now))
+        for day in [(today + datetime.timedelta(days=offset)).isoformat() for offset in (-1, 0, 1)]:
+            for due, until, _, rule in self.rule_times(bucket, day):
+                if until <= now or (dormant and not rule.dormant) or header.notified.sent(rule.name, day):
+                    continue
+                if rule.applies(header, day):
+                    return due, until, rule
+        return None
+
+    def next_fire_time(self, bucket, header, now: float, dormant: bool = False) -> Optional[float]:
+        """Earliest time a rule could fire for this member (passed times come back as now)"""
+        if not header.is_setup_complete:
+            return None
+        entry = self.next_due(bucket, header, now, dormant)
+        if entry is None:
+            # Nothing in the next two days (typically a dormant user): look again after that
+            day = datetime.date.fromisoformat(bucket.local_day(now)) + datetime.timedelta(days=2)
+            return local_instant(pytz.timezone(bucket.timezone), day, 0)
+        return max(entry[0], now)
+
+    async def dispatch(self, chat_id: int, bucket, now: float, local_now: datetime.datetime,
+                       header_of: Callable[[int], object], load_routine: Callable[[int], object],
+                       save: Callable[[int], None], dormant: bool = False,
+                       on_error: Optional[Callable[[int, str], None]] = None) -> int:
+        """Run every rule due for chat_id right now. Returns how many fired.
+
+        A rule is marked on the routine once its action has run and saved
+        with it, so a restart does not run it again that day; only actions
+        that did something count as fired. A rule that raises is reported
+        to on_error and left unmarked, so the next pass retries it while it
+        is still open.
+        """
+        today = local_now.date()
+        days = [(today - datetime.timedelta(days=1)).isoformat(), today.isoformat()]
+        entries = [(entry, day) for day in days for entry in self.rule_times(bucket, day)]
+        fired = 0
+        for (due, until, _, rule), day in sorted(entries, key=lambda item: (item[0][0], item[0][2])):
+            if due > now:
+                break
+            if now >= until or (dormant and not rule.dormant):
+                continue
+            started = time.perf_counter()
+            try:
+                rule.checks += 1
+                # Re-read each time: an earlier rule may just have changed the routine
+                header = header_of(chat_id)
+                if header is None or not header.is_setup_complete:
+                    return fired
+                if header.notified.sent(rule.name, day) or not rule.applies(header, day):
+                    continue
+                routine = load_routine(chat_id)
+                if routine is None:
+                    return fired
+                try:
+                    acted = await rule.action(RuleContext(chat_id, routine, day, now, local_now, due))
+                    routine.notified.mark(rule.name, day)
+                finally:
+                    save(chat_id)
+                if acted:
+                    rule.fired += 1
+                    fired += 1
+            except Exception as e:
+                print(f"    ✗ RULE {rule.name} failed for {chat_id}: {e}")
+                if on_error is not None:
+                    on_error(chat_id, f"{rule.name}: {e}")
+            finally:
+                rule.seconds += time.perf_counter() - started
+        return fired
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            rule.name: {
+                'checks': rule.checks,
+                'fired': rule.fired,
+                'total_ms': rule.seconds * 1000,
+                'avg_ms': rule.seconds * 1000 / rule.checks if rule.checks else 0.0
+            }
+            for rule in self.rules
+        }
@@ -0,0 +1,328 @@
+import asyncio
+import datetime
+import multiprocessing
+import queue
+import time
+import zlib
+from collections import deque
+from typing import Dict, List, Optional
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import Chat, Message, TelegramObject
+
+from scheduler_dir.outbound_queue import MAX_ATTEMPTS, TRANSIENT_ERRORS, backoff
+
+HEARTBEAT_INTERVAL = 1.0
+WORKER_CONCURRENCY = 8  # Sends in flight per worker, across its chats
+
+
+class SendFailed(Exception):
+    """A worker gave up on a job (after its own retries), or no worker is left to send it"""
+
+
+def partition_of(chat_id: int, partitions: int) -> int:
+    """Stable hash partition of a chat_id (same in every process)"""
+    return zlib.crc32(str(chat_id).encode()) % partitions
+
+
+def _encode(result):
+    """API result -> picklable form; the bot-bound model itself can't cross processes"""
+    if isinstance(result, TelegramObject):
+        return type(result), result.model_dump(exclude_none=True)
+    return result
+
+
+def _decode(result):
+    if isinstance(result, tuple):
+        model, data = result
+        return model.model_validate(data)
+    return result
+
+
+class _LatencyBot:
+    """Stand-in for Bot in benchmarks: every call just takes `latency` seconds"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.message_id = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.message_id += 1
+        return Message(message_id=self.message_id, date=datetime.datetime.now(datetime.timezone.utc),
+                       chat=Chat(id=chat_id, type='private'), text=text)
+
+
+async def _heartbeat(worker_id: int, results) -> None:
+    """Beat from a task of its own: a slow send doesn't make the worker look dead, a stuck loop does"""
+    while True:
+        results.put(('heartbeat', worker_id, None, None))
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def _send_job(bot, worker_id: int, job: tuple, slots: asyncio.Semaphore, results) -> None:
+    job_id, chat_id, method, kwargs = job
+    attempt = 0
+    while True:
+        try:
+            async with slots:
+                sent = await getattr(bot, method)(chat_id=chat_id, **kwargs)
+            results.put(('ok', worker_id, job_id, _encode(sent)))
+        except TelegramRetryAfter as e:
+            # Flood control: this chat waits, the job is not dropped
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramForbiddenError as e:
+            results.put(('blocked', worker_id, job_id, e.message))
+        except TRANSIENT_ERRORS as e:
+            attempt += 1
+            if attempt < MAX_ATTEMPTS:
+                await asyncio.sleep(backoff(attempt - 1))
+                continue
+            results.put(('error', worker_id, job_id, f"{type(e).__name__}: {e}"))
+        except Exception as e:
+            results.put(('error', worker_id, job_id, f"{type(e).__name__}: {e}"))
+        return
+
+
+async def _run_chat(bot, worker_id: int, chat_id: int, lanes: Dict[int, deque], slots: asyncio.Semaphore,
+                    results) -> None:
+    """Send one chat's jobs in arrival order; other chats' lanes run alongside"""
+    lane = lanes[chat_id]
+    while lane:
+        await _send_job(bot, worker_id, lane[0], slots, results)
+        lane.popleft()
+    del lanes[chat_id]
+
+
+async def _worker_loop(worker_id: int, token: str, parse_mode: Optional[str], inbox, results,
+                       fake_latency: Optional[float], concurrency: int) -> None:
+    if fake_latency is not None:
+        bot = _LatencyBot(fake_latency)
+    else:
+        from aiogram import Bot
+        from aiogram.client.default import DefaultBotProperties
+        bot = Bot(token=token, default=DefaultBotProperties(parse_mode=parse_mode))
+    loop = asyncio.get_running_loop()
+    heartbeat = loop.create_task(_heartbeat(worker_id, results))  # Up: liveness checks start now
+    lanes: Dict[int, deque] = {}  # chat_id -> its jobs not yet acknowledged, head in flight
+    running: set = set()
+    slots = asyncio.Semaphore(concurrency)
+    try:
+        while True:
+            try:
+                job = await loop.run_in_executor(None, inbox.get, True, HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                continue
+            if job is None:
+                if running:
+                    await asyncio.wait(running)
+                return
+            chat_id = job[1]
+            if chat_id in lanes:
+                lanes[chat_id].append(job)
+                continue
+            lanes[chat_id] = deque([job])
+            task = loop.create_task(_run_chat(bot, worker_id, chat_id, lanes, slots, results))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        heartbeat.cancel()
+        session = getattr(bot, 'session', None)
+        if session is not None:
+            await session.close()
+
+
+def run_worker(worker_id: int, token: str, parse_mode: Optional[str], inbox, results,
+               fake_latency: Optional[float] = None, concurrency: int = WORKER_CONCURRENCY) -> None:
+    """Process entry point: send jobs from inbox until a None arrives"""
+    try:
+        asyncio.run(_worker_loop(worker_id, token, parse_mode, inbox, results, fake_latency, concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+class SendWorkers:
+    """Delivery worker processes, each owning a hash partition of chat_ids.
+
+    The bot process keeps all routine state and runs the scheduler; a send
+    is handed to the worker that owns the chat's partition, and the future
+    `submit()` returns resolves to the API result once the worker acks
+    it. Queues are the broker. A worker that exits or stops heartbeating for `dead_after`
+    seconds is dropped: its partitions move to the survivors and its
+    unacknowledged jobs are re-sent there in order (at-least-once).
+    Inside a worker, up to `concurrency` sends are in flight across its
+    chats, one at a time per chat so each chat keeps its order. Heartbeats
+    come from their own task, so a slow send does not look like a dead
+    worker. Workers wait out flood control (that chat only) and retry
+    transient errors themselves. A chat that blocked the bot fails its
+    future with TelegramForbiddenError, any other failure with SendFailed.
+    """
+
+    def __init__(self, workers: int, token: str, parse_mode: Optional[str] = None,
+                 partitions: int = 64, dead_after: float = 10.0, fake_latency: Optional[float] = None,
+                 concurrency: int = WORKER_CONCURRENCY):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.token = token
+        self.parse_mode = parse_mode
+        self.partitions = partitions
+        self.dead_after = dead_after
+        self.fake_latency = fake_latency
+        self.ctx = multiprocessing.get_context('spawn')
+        self.results = self.ctx.Queue()
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.inboxes: Dict[int, multiprocessing.Queue] = {}
+        self.last_beat: Dict[int, Optional[float]] = {}  # None until the worker is up
+        self.owner: List[int] = []  # partition -> worker_id
+        self.pending: Dict[int, tuple] = {}  # job_id -> (worker_id, job, future), until acknowledged
+        self.next_job = 0
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self._task: Optional[asyncio.Task] = None
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.rebalances = 0
+        self.sent_by: Dict[int, int] = {}
+
+    def start(self) -> None:
+        for worker_id in range(self.workers):
+            inbox = self.ctx.Queue()
+            process = self.ctx.Process(
+                target=run_worker,
+                args=(worker_id, self.token, self.parse_mode, inbox, self.results, self.fake_latency,
+                      self.concurrency),
+                name=f"send-worker-{worker_id}",
+                daemon=True
+            )
+            process.start()
+            self.processes[worker_id] = process
+            self.inboxes[worker_id] = inbox
+            self.last_beat[worker_id] = None
+            self.sent_by[worker_id] = 0
+        self.owner = [p % self.workers for p in range(self.partitions)]
+        self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    def live_workers(self) -> List[int]:
+        return sorted(self.processes)
+
+    def owner_of(self, chat_id: int) -> int:
+        return self.owner[partition_of(chat_id, self.partitions)]
+
+    def submit(self, chat_id: int, method: str = 'send_message', **kwargs) -> asyncio.Future:
+        """Queue a Bot call for chat_id on its owner; returns a future of its result"""
+        if not self.processes:
+            raise SendFailed("No send workers alive")
+        job_id = self.next_job
+        self.next_job += 1
+        job = (job_id, chat_id, method, kwargs)
+        worker_id = self.owner_of(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[job_id] = (worker_id, job, future)
+        self.drained.clear()
+        self.inboxes[worker_id].put(job)
+        return future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                kind, worker_id, job_id, detail = await loop.run_in_executor(
+                    None, self.results.get, True, HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                kind = None
+            except (EOFError, OSError):
+                return
+            now = time.time()
+            if kind is not None and worker_id in self.last_beat:
+                self.last_beat[worker_id] = now
+            entry = self.pending.pop(job_id, None) if kind in ('ok', 'error', 'blocked') else None
+            if entry is not None:
+                future = entry[2]
+                if kind == 'ok':
+                    self.sent += 1
+                    self.sent_by[worker_id] = self.sent_by.get(worker_id, 0) + 1
+                    self._settle(future, result=_decode(detail))
+                elif kind == 'blocked':
+                    self.blocked += 1
+                    self._settle(future, error=TelegramForbiddenError(method=None, message=detail))
+                else:
+                    self.failed += 1
+                    print(f"[SEND WORKER {worker_id}] job {job_id} failed: {detail}")
+                    self._settle(future, error=SendFailed(detail))
+                if not self.pending:
+                    self.drained.set()
+            self._check_workers(now)
+
+    @staticmethod
+    def _settle(future: asyncio.Future, result=None, error: Optional[Exception] = None) -> None:
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fail_pending(self, reason: str) -> None:
+        for _, _, future in self.pending.values():
+            self._settle(future, error=SendFailed(reason))
+        self.pending.clear()
+        self.drained.set()
+
+    def _check_workers(self, now: float) -> None:
+        dead = [w for w, process in self.processes.items()
+                if not process.is_alive() or
+                (self.last_beat[w] is not None and now - self.last_beat[w] > self.dead_after)]
+        for worker_id in dead:
+            self._drop(worker_id)
+
+    def _drop(self, worker_id: int) -> None:
+        """Hand a dead worker's partitions and unacknowledged jobs to the survivors"""
+        process = self.processes.pop(worker_id)
+        self.inboxes.pop(worker_id)
+        self.last_beat.pop(worker_id, None)
+        if process.is_alive():
+            process.terminate()
+        self.rebalances += 1
+        survivors = self.live_workers()
+        print(f"[SEND WORKERS] Worker {worker_id} died, {len(survivors)} left")
+        if not survivors:
+            self._fail_pending("No send workers left")
+            return
+        moved = [p for p, owner in enumerate(self.owner) if owner == worker_id]
+        for i, partition in enumerate(moved):
+            self.owner[partition] = survivors[i % len(survivors)]
+        for job_id in sorted(j for j, (owner, _, _) in self.pending.items() if owner == worker_id):
+            _, job, future = self.pending[job_id]
+            new_owner = self.owner_of(job[1])
+            self.pending[job_id] = (new_owner, job, future)
+            self.inboxes[new_owner].put(job)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Let queued jobs finish (up to timeout), then shut the workers down"""
+        try:
+            await asyncio.wait_for(self.drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self._task is not None:
+            self._task.cancel()  # Exiting workers must not be "rebalanced"
+        self._fail_pending("Send workers stopped")
+        for inbox in self.inboxes.values():
+            inbox.put(None)
+        for process in list(self.processes.values()):
+            await asyncio.get_running_loop().run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def stats(self) -> dict:
+        return {
+            'workers': len(self.processes),
+            'sent': self.sent,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'in_flight': len(self.pending),
+            'rebalances': self.rebalances,
+            'sent_by': dict(self.sent_by)
+        }
@@ -0,0 +1,105 @@
+import asyncio
+import heapq
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from classes_dir import clock
+
+
+class TaskTimers:
+    """One `loop.call_at` handle per running routine, due at its current task's deadline.
+
+    `set()` is idempotent for an unchanged deadline and replaces the handle
+    otherwise, so callers simply re-set after every change (tap, pause,
+    resume, restart); None cancels. Deadlines set before the loop runs are
+    armed by `start()`. Without `start()` nothing is armed and a simulation
+    drives the timers itself with `next_deadline()` / `run_due()`.
+    """
+
+    def __init__(self, on_due: Callable[[int], Awaitable[None]]):
+        self.on_due = on_due
+        self.deadlines: Dict[int, float] = {}  # chat_id -> epoch seconds
+        self.handles: Dict[int, asyncio.TimerHandle] = {}
+        self.queue: List[tuple] = []  # (deadline, chat_id), stale entries skipped lazily
+        self.running: set = set()  # Keeps fired callbacks referenced until done
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # Metrics
+        self.fired = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        for chat_id, deadline in list(self.deadlines.items()):
+            self._arm(chat_id, deadline)
+
+    def set(self, chat_id: int, deadline: Optional[float]) -> None:
+        if deadline is not None and self.deadlines.get(chat_id) == deadline:
+            return
+        self.cancel(chat_id)
+        if deadline is None:
+            return
+        self.deadlines[chat_id] = deadline
+        if self.loop is not None:
+            self._arm(chat_id, deadline)
+        else:
+            heapq.heappush(self.queue, (deadline, chat_id))
+            if len(self.queue) > 2 * len(self.deadlines) + 1000:
+                self.queue = [(d, c) for c, d in self.deadlines.items()]
+                heapq.heapify(self.queue)
+
+    def cancel(self, chat_id: int) -> None:
+        self.deadlines.pop(chat_id, None)
+        handle = self.handles.pop(chat_id, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _arm(self, chat_id: int, deadline: float) -> None:
+        delay = max(0.0, deadline - clock.time())
+        self.handles[chat_id] = self.loop.call_at(self.loop.time() + delay, self._fire, chat_id, deadline)
+
+    def _fire(self, chat_id: int, deadline: float) -> None:
+        self.handles.pop(chat_id, None)
+        self.deadlines.pop(chat_id, None)
+        lateness = max(0.0, clock.time() - deadline)
+        self.fired += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        task = self.loop.create_task(self.on_due(chat_id))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    def next_deadline(self) -> Optional[float]:
+        """Earliest unarmed deadline (simulation)"""
+        while self.queue:
+            deadline, chat_id = self.queue[0]
+            if self.deadlines.get(chat_id) == deadline:
+                return deadline
+            heapq.heappop(self.queue)
+        return None
+
+    async def run_due(self, now: float) -> int:
+        """Fire every unarmed deadline at or before `now` inline (simulation)"""
+        fired = 0
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return fired
+            _, chat_id = heapq.heappop(self.queue)
+            del self.deadlines[chat_id]
+            self.fired += 1
+            fired += 1
+            lateness = max(0.0, now - deadline)
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            await self.on_due(chat_id)
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def stats(self) -> dict:
+        return {
+            'armed': len(self.deadlines),
+            'fired': self.fired,
+            'avg_lateness_ms': self.total_lateness / self.fired * 1000 if self.fired else 0.0,
+            'max_lateness_ms': self.max_lateness * 1000
+        }
@@ -0,0 +1,80 @@
+import datetime
+from typing import Dict, Optional
+
+import pytz
+
+from classes_dir.window_bounds import WindowMixin
+
+
+class ZoneBucket(WindowMixin):
+    """Users sharing timezone, window and follow-up time: one set of instants for all of them"""
+
+    def __init__(self, key: tuple):
+        (self.timezone, self.window_start, self.window_start_minute, self.window_end,
+         self.window_end_minute, self.followup_enabled, self.followup_hour, self.followup_minute) = key
+        self.key = key
+        self.members: set = set()
+        self.rule_times: Dict[str, list] = {}  # local day -> RuleEngine's sorted (due, until, order, rule)
+
+    def local_day(self, now: float) -> str:
+        return self.local_today(now)
+
+    def local_now(self, now: float) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(now, pytz.timezone(self.timezone))
+
+
+class ZoneBuckets:
+    """chat_id -> ZoneBucket index, so time work scales with distinct settings, not users"""
+
+    def __init__(self):
+        self.buckets: Dict[tuple, ZoneBucket] = {}
+        self.bucket_of: Dict[int, tuple] = {}
+        # Metrics: bucket evaluations vs member evaluations they served
+        self.ticks = 0
+        self.fanout = 0
+
+    @staticmethod
+    def key_for(header) -> tuple:
+        followup = ((True, header.followup_hour, header.followup_minute)
+                    if header.followup_enabled else (False, 0, 0))
+        return (header.timezone, header.window_start, header.window_start_minute,
+                header.window_end, header.window_end_minute) + followup
+
+    def assign(self, chat_id: int, header) -> ZoneBucket:
+        key = self.key_for(header)
+        old_key = self.bucket_of.get(chat_id)
+        if old_key != key:
+            if old_key is not None:
+                self.remove(chat_id)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = ZoneBucket(key)
+            bucket.members.add(chat_id)
+            self.bucket_of[chat_id] = key
+        return self.buckets[key]
+
+    def remove(self, chat_id: int) -> None:
+        key = self.bucket_of.pop(chat_id, None)
+        if key is None:
+            return
+        bucket = self.buckets[key]
+        bucket.members.discard(chat_id)
+        if not bucket.members:
+            del self.buckets[key]
+
+    def get(self, chat_id: int) -> Optional[ZoneBucket]:
+        key = self.bucket_of.get(chat_id)
+        return self.buckets.get(key) if key is not None else None
+
+    def stats(self) -> dict:
+        sizes = sorted((len(b.members) for b in self.buckets.values()), reverse=True)
+        users = sum(sizes)
+        return {
+            'buckets': len(sizes),
+            'users': users,
+            'largest': sizes[0] if sizes else 0,
+            'avg_members': users / len(sizes) if sizes else 0.0,
+            'top5_share': sum(sizes[:5]) / users if users else 0.0,
+            'ticks': self.ticks,
+            'fanout': self.fanout
+        }
@@ -0,0 +1,19 @@
+from storage_dir.base_storage import BaseStorage
+from storage_dir.event_journal import EventJournalStorage
+from storage_dir.json_file_storage import JsonFileStorage
+from storage_dir.sharded_store import ShardedStore
+from storage_dir.sqlite_storage import SqliteStorage
+
+BACKENDS = {
+    'sharded': ShardedStore,
+    'json': JsonFileStorage,
+    'sqlite': SqliteStorage,
+    'journal': EventJournalStorage,
+}
+
+
+def create_storage(backend: str, path: str, **options) -> BaseStorage:
+    """Instantiate a backend by name ('sharded', 'json', 'sqlite', 'journal')"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}', choose from {', '.join(BACKENDS)}")
+    return BACKENDS[backend](path, **options)
@@ -0,0 +1,46 @@
+from typing import Dict, Optional
+
+
+class BaseStorage:
+    """Interface every persistence backend implements.
+
+    A record is the per-user dict built by main.build_record:
+    {'routine': MorningRoutine.to_dict(), 'user_replies': [...],
+     'fsm': {'state': ..., 'data': {...}} or None}.
+    """
+
+    def __init__(self):
+        self.dirty: set[int] = set()
+
+    def mark_dirty(self, chat_id: int) -> None:
+        self.dirty.add(chat_id)
+
+    def pop_dirty(self) -> set[int]:
+        """Take the current dirty set, leaving an empty one behind"""
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def is_empty(self) -> bool:
+        raise NotImplementedError
+
+    def write(self, records: Dict[int, Optional[dict]]) -> None:
+        """Persist each record; None deletes that user"""
+        raise NotImplementedError
+
+    def load_all(self) -> Dict[int, dict]:
+        raise NotImplementedError
+
+    def load_headers(self) -> Dict[int, dict]:
+        """Compact RoutineHeader dicts for every user, without full records"""
+        raise NotImplementedError
+
+    def load_record(self, chat_id: int) -> Optional[dict]:
+        """One user's full record, or None if unknown"""
+        raise NotImplementedError
+
+    def forget(self, chat_id: int) -> None:
+        """chat_id's routine left memory: drop any per-user write state kept for it"""
+        pass
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,303 @@
+import copy
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from classes_dir.morning_routine_class import RoutineHeader
+from classes_dir.routine_history import HISTORY_FORMAT, normalize_history
+from storage_dir.base_storage import BaseStorage
+
+# Frame: 4-byte payload length + 4-byte CRC32, big endian, then the JSON payload
+FRAME_HEADER = struct.Struct('>II')
+
+
+def diff_record(old: dict, new: dict) -> Optional[dict]:
+    """Minimal delta turning `old` into `new`, or None if nothing changed"""
+    delta = {}
+    old_routine, new_routine = old['routine'], new['routine']
+
+    fields = {k: v for k, v in new_routine.items()
+              if k not in ('tasks', 'history') and old_routine.get(k) != v}
+    if fields:
+        delta['fields'] = fields
+
+    old_tasks, new_tasks = old_routine.get('tasks', []), new_routine.get('tasks', [])
+    changed_tasks = {i: task for i, task in enumerate(new_tasks)
+                     if i >= len(old_tasks) or old_tasks[i] != task}
+    if changed_tasks or len(old_tasks) != len(new_tasks):
+        delta['tasks'] = {'len': len(new_tasks), 'set': changed_tasks}
+
+    old_history = old_routine.get('history') or {}
+    new_history = normalize_history(new_routine.get('history'))
+    if old_history.get('format') != HISTORY_FORMAT:
+        # Legacy history in the journal state: replace it once with the compact form
+        delta['history'] = {'replace': new_history}
+    else:
+        # Encoded days are tiny dicts, and definition versions are append-only
+        old_days, new_days = old_history.get('days', {}), new_history.get('days', {})
+        old_defs, new_defs = old_history.get('defs', []), new_history.get('defs', [])
+        changed_days = {day: entry for day, entry in new_days.items() if old_days.get(day) != entry}
+        removed_days = [day for day in old_days if day not in new_days]
+        if changed_days or removed_days or len(new_defs) != len(old_defs):
+            delta['history'] = {
+                'set': changed_days,
+                'del': removed_days,
+                'defs_from': len(old_defs),
+                'defs': new_defs[len(old_defs):]
+            }
+
+    if old.get('user_replies') != new.get('user_replies'):
+        delta['user_replies'] = new.get('user_replies')
+
+    if old.get('fsm') != new.get('fsm'):
+        delta['fsm'] = new.get('fsm')
+
+    return delta or None
+
+
+def classify_delta(old: dict, delta: dict) -> str:
+    """Name the domain event a delta represents"""
+    fields = delta.get('fields', {})
+    history = delta.get('history', {})
+    if 'replace' in history:
+        return 'history_migrated'
+    old_days = (old['routine'].get('history') or {}).get('days', {})
+    new_days = [e for d, e in history.get('set', {}).items() if d not in old_days]
+
+    if any(e.get('missed') for e in new_days):
+        return 'routine_missed'
+    if new_days and fields.get('routine_started') is False:
+        return 'routine_finished'
+    if fields.get('routine_started') is True:
+        return 'routine_started'
+    if history.get('del'):
+        return 'day_reset'
+    if history.get('set'):
+        return 'day_updated'
+    if 'tasks' in delta:
+        old_tasks = old['routine'].get('tasks', [])
+        definitions_same = delta['tasks']['len'] == len(old_tasks) and all(
+            (t['name'], t['duration'], t.get('optional'), t.get('notes')) ==
+            (old_tasks[i]['name'], old_tasks[i]['duration'], old_tasks[i].get('optional'), old_tasks[i].get('notes'))
+            for i, t in delta['tasks']['set'].items()
+        )
+        return 'task_completed' if definitions_same else 'tasks_edited'
+    if 'user_replies' in delta:
+        return 'replies_changed'
+    if 'fsm' in delta and not fields:
+        return 'state_changed'
+    if set(fields) == {'notified'}:
+        return 'notification_sent'
+    if set(fields) == {'blocked'}:
+        return 'user_blocked'
+    if set(fields) <= {'last_seen', 'blocked'}:
+        return 'user_seen'
+    if set(fields) <= {'current_task_sent_at', 'in_buffer', 'notified'}:
+        return 'task_sent'
+    return 'settings_changed'
+
+
+def apply_event(state: Dict[int, dict], event: dict) -> None:
+    """Replay one journal event onto the in-memory records"""
+    chat_id = event['c']
+    kind = event['e']
+    data = event['d']
+
+    if kind == 'user_deleted':
+        state.pop(chat_id, None)
+        return
+    if kind == 'user_created':
+        state[chat_id] = data
+        return
+
+    record = state.get(chat_id)
+    if record is None:
+        return
+    routine = record['routine']
+    routine.update(data.get('fields', {}))
+    if 'tasks' in data:
+        tasks = routine.setdefault('tasks', [])
+        del tasks[data['tasks']['len']:]
+        for index, task in data['tasks']['set'].items():
+            index = int(index)  # JSON object keys come back as strings
+            if index < len(tasks):
+                tasks[index] = task
+            else:
+                tasks.append(task)
+    if 'history' in data:
+        change = data['history']
+        if 'replace' in change:
+            routine['history'] = change['replace']
+        else:
+            history = routine['history']
+            del history['defs'][change['defs_from']:]
+            history['defs'].extend(change['defs'])
+            history['days'].update(change['set'])
+            for day in change['del']:
+                history['days'].pop(day, None)
+    if 'user_replies' in data:
+        record['user_replies'] = data['user_replies']
+    if 'fsm' in data:
+        record['fsm'] = data['fsm']
+
+
+class EventJournalStorage(BaseStorage):
+    """Append-only journal of per-user domain events plus periodic snapshots.
+
+    A flush appends one small framed event per changed user and fsyncs once
+    for the whole batch. After `compact_events` events or `compact_seconds`
+    seconds the full state is written to snapshot.json and the journal is
+    truncated. Loading reads the snapshot and replays the journal tail.
+    """
+
+    def __init__(self, directory: str, compact_events: int = 1000, compact_seconds: float = 600):
+        super().__init__()
+        self.directory = directory
+        self.compact_events = compact_events
+        self.compact_seconds = compact_seconds
+        os.makedirs(self.directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, 'snapshot.json')
+        self.journal_path = os.path.join(directory, 'journal.log')
+        # Last persisted record per user, used for diffing and snapshots
+        self.state: Dict[int, dict] = {}
+        self.events_since_snapshot = 0
+        self.last_snapshot_at = time.monotonic()
+        self.journal = None
+        # Handlers hydrate users while the index loads in a worker thread: restore once
+        self.restore_lock = threading.Lock()
+        self.restored = False
+
+    def is_empty(self) -> bool:
+        has_journal = os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0
+        return not os.path.exists(self.snapshot_path) and not has_journal
+
+    def _open_journal(self):
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'ab')
+        return self.journal
+
+    def write(self, records: Dict[int, Optional[dict]]) -> None:
+        self._ensure_restored()
+        events: List[dict] = []
+        for chat_id, record in records.items():
+            old = self.state.get(chat_id)
+            if record is None:
+                if old is not None:
+                    events.append({'e': 'user_deleted', 'c': chat_id, 'd': None})
+            elif old is None:
+                routine = dict(record['routine'], history=normalize_history(record['routine'].get('history')))
+                events.append({'e': 'user_created', 'c': chat_id, 'd': dict(record, routine=routine)})
+            else:
+                delta = diff_record(old, record)
+                if delta is not None:
+                    events.append({'e': classify_delta(old, delta), 'c': chat_id, 'd': delta})
+
+        payloads = [json.dumps(event, separators=(',', ':')).encode() for event in events]
+        if payloads:
+            journal = self._open_journal()
+            for payload in payloads:
+                journal.write(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            # One fsync for the whole batch
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        # Apply the decoded payloads, exactly as a replay would (and without
+        # aliasing the caller's dicts)
+        for payload in payloads:
+            apply_event(self.state, json.loads(payload))
+        self.events_since_snapshot += len(payloads)
+
+        if (self.events_since_snapshot >= self.compact_events or
+                (self.events_since_snapshot and time.monotonic() - self.last_snapshot_at >= self.compact_seconds)):
+            self.compact()
+
+    def compact(self) -> None:
+        """Write the full state as a snapshot and start an empty journal"""
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({str(chat_id): record for chat_id, record in self.state.items()}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        open(self.journal_path, 'wb').close()
+        self.events_since_snapshot = 0
+        self.last_snapshot_at = time.monotonic()
+        print(f"[JOURNAL] Compacted {len(self.state)} users into snapshot")
+
+    def read_journal(self) -> List[dict]:
+        """Decode journal frames, truncating a torn or corrupt tail"""
+        events = []
+        if not os.path.exists(self.journal_path):
+            return events
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+
+        offset = 0
+        while offset + FRAME_HEADER.size <= len(data):
+            length, crc = FRAME_HEADER.unpack_from(data, offset)
+            start = offset + FRAME_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            events.append(json.loads(payload))
+            offset = start + length
+
+        if offset != len(data):
+            print(f"[JOURNAL] Dropping {len(data) - offset} bytes of torn journal tail")
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(offset)
+        return events
+
+    def _restore_state(self) -> None:
+        """Load the latest snapshot and replay the journal tail into self.state.
+
+        Callers hold restore_lock; `restored` is only set once replay is done.
+        """
+        state = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                state = {int(chat_id): record for chat_id, record in json.load(f).items()}
+
+        events = self.read_journal()
+        for event in events:
+            apply_event(state, event)
+        self.state = state
+        self.events_since_snapshot = len(events)
+        self.restored = True
+        print(f"[JOURNAL] Snapshot {len(self.state)} users, replayed {len(events)} events")
+
+    def _ensure_restored(self) -> None:
+        if not self.restored:
+            with self.restore_lock:
+                if not self.restored:
+                    self._restore_state()
+
+    def load_all(self) -> Dict[int, dict]:
+        with self.restore_lock:
+            self._restore_state()
+        # Hand out copies: self.state must only change through write()
+        return copy.deepcopy(self.state)
+
+    def load_headers(self) -> Dict[int, dict]:
+        # Replay needs the snapshot in memory anyway; hydrate from it
+        self._ensure_restored()
+        return {chat_id: RoutineHeader.from_routine_dict(record['routine']).to_dict()
+                for chat_id, record in self.state.items()}
+
+    def load_record(self, chat_id: int) -> Optional[dict]:
+        self._ensure_restored()
+        record = self.state.get(chat_id)
+        return copy.deepcopy(record) if record is not None else None
+
+    def close(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
@@ -0,0 +1,74 @@
+"""Check (and optionally repair) a routines_data.json file, one user at a time.
+
+Every routine must load with MorningRoutine.from_dict, round-trip
+through to_dict and name a known timezone; replies must be a list of
+strings. With --repair the file is rewritten with only the good users
+(and their replies), after the original is copied to <file>.bak.
+
+Usage:
+    python storage_dir/fsck.py routines_data.json
+    python storage_dir/fsck.py routines_data.json --repair
+"""
+import os
+import shutil
+import sys
+import pytz
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from classes_dir.morning_routine_class import MorningRoutine
+from storage_dir.json_file_storage import JsonFileStorage
+from storage_dir.json_stream import iter_legacy_records
+
+
+def check_record(chat_id: int, record: dict) -> Optional[str]:
+    """Problem with one user's record, or None if it loads cleanly"""
+    try:
+        routine = MorningRoutine.from_dict(record['routine'])
+        MorningRoutine.from_dict(routine.to_dict())
+        pytz.timezone(routine.timezone)
+    except Exception as e:
+        return f"routine {chat_id}: {type(e).__name__}: {e}"
+    if routine.chat_id != chat_id:
+        return f"routine {chat_id}: stored under the wrong chat id ({routine.chat_id})"
+    replies = record.get('user_replies')
+    if replies is not None and (not isinstance(replies, list) or not all(isinstance(r, str) for r in replies)):
+        return f"user_replies {chat_id}: expected a list of strings"
+    return None
+
+
+def fsck(file_name: str, repair: bool = False) -> int:
+    """Report problems and return how many were found"""
+    errors: List[str] = []
+    good: Dict[int, dict] = {}
+    checked = 0
+    for chat_id, record in iter_legacy_records(file_name, errors):
+        checked += 1
+        problem = check_record(chat_id, record)
+        if problem:
+            errors.append(problem)
+        elif repair:
+            good[chat_id] = record
+
+    for error in errors:
+        print(f"  ✗ {error}")
+    print(f"{file_name}: {checked} users read, {len(errors)} problems")
+
+    if repair and errors:
+        backup = file_name + '.bak'
+        shutil.copy2(file_name, backup)
+        storage = JsonFileStorage(file_name)
+        storage.loaded = True  # Start from the good users only
+        storage.write(good)
+        print(f"Repaired: kept {len(good)} users, original saved to {backup}")
+    return len(errors)
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != '--repair']
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(1)
+    problems = fsck(args[0], repair='--repair' in sys.argv)
+    sys.exit(1 if problems else 0)
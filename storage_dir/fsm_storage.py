@@ -0,0 +1,105 @@
+from typing import Any, Callable, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DEFAULT_DESTINY, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+class RecordFSMStorage(BaseStorage):
+    """aiogram FSM storage persisted inside each user's record.
+
+    States live in memory; a transition only marks the user dirty, so it is
+    written by the write-behind queue together with the routine (record key
+    'fsm': {'state': ..., 'data': {...}}). A user's saved state is restored
+    when their record is hydrated, which `load_user` triggers on first use.
+    Keys other than the plain per-chat one (threads, business connections,
+    other destinies) are kept in memory only.
+    """
+
+    def __init__(self, load_user: Callable[[int], Any], mark_dirty: Callable[[int], None]):
+        self.load_user = load_user
+        self.mark_dirty = mark_dirty
+        self.states: Dict[int, str] = {}
+        self.data: Dict[int, dict] = {}
+        self.loaded: set[int] = set()
+        self.other = MemoryStorage()
+
+    @staticmethod
+    def _chat_id(key: StorageKey) -> Optional[int]:
+        if key.thread_id is None and key.business_connection_id is None and key.destiny == DEFAULT_DESTINY:
+            return key.chat_id
+        return None
+
+    def _ensure_loaded(self, chat_id: int) -> None:
+        if chat_id not in self.loaded:
+            self.load_user(chat_id)  # Hydration calls restore() with the saved state
+            self.loaded.add(chat_id)
+
+    def restore(self, chat_id: int, saved: Optional[dict]) -> None:
+        """Adopt state from a hydrated record, unless newer state is already in memory"""
+        if chat_id in self.loaded:
+            return
+        self.loaded.add(chat_id)
+        if saved:
+            if saved.get('state'):
+                self.states[chat_id] = saved['state']
+            if saved.get('data'):
+                self.data[chat_id] = saved['data']
+
+    def forget(self, chat_id: int) -> None:
+        """Drop chat_id's state from memory (user evicted or deleted); it is restored on next use"""
+        self.states.pop(chat_id, None)
+        self.data.pop(chat_id, None)
+        self.loaded.discard(chat_id)
+
+    def snapshot(self, chat_id: int) -> Optional[dict]:
+        """The 'fsm' part of chat_id's record (None if there is nothing to keep)"""
+        state, data = self.states.get(chat_id), self.data.get(chat_id)
+        if state is None and not data:
+            return None
+        return {'state': state, 'data': dict(data) if data else {}}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        chat_id = self._chat_id(key)
+        if chat_id is None:
+            return await self.other.set_state(key, state)
+        self._ensure_loaded(chat_id)
+        state = state.state if isinstance(state, State) else state
+        if self.states.get(chat_id) == state:
+            return
+        if state is None:
+            del self.states[chat_id]
+        else:
+            self.states[chat_id] = state
+        self.mark_dirty(chat_id)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        chat_id = self._chat_id(key)
+        if chat_id is None:
+            return await self.other.get_state(key)
+        self._ensure_loaded(chat_id)
+        return self.states.get(chat_id)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        chat_id = self._chat_id(key)
+        if chat_id is None:
+            return await self.other.set_data(key, data)
+        self._ensure_loaded(chat_id)
+        if self.data.get(chat_id, {}) == data:
+            return
+        if data:
+            self.data[chat_id] = data.copy()
+        else:
+            self.data.pop(chat_id, None)
+        self.mark_dirty(chat_id)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        chat_id = self._chat_id(key)
+        if chat_id is None:
+            return await self.other.get_data(key)
+        self._ensure_loaded(chat_id)
+        return self.data.get(chat_id, {}).copy()
+
+    async def close(self) -> None:
+        # Pending states are flushed with the records on shutdown
+        await self.other.close()
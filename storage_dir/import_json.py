@@ -0,0 +1,29 @@
+"""One-shot import of a legacy routines_data.json into another backend.
+
+Usage:
+    python storage_dir/import_json.py routines_data.json sqlite routines_data.db
+    python storage_dir/import_json.py routines_data.json sharded routines_data
+"""
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage_dir.backends import create_storage
+from storage_dir.json_file_storage import import_legacy_file
+
+
+def import_json(source_file: str, backend: str, target_path: str) -> int:
+    storage = create_storage(backend, target_path)
+    try:
+        return import_legacy_file(source_file, storage)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print(__doc__)
+        sys.exit(1)
+    count = import_json(sys.argv[1], sys.argv[2], sys.argv[3])
+    print(f"Imported {count} users into {sys.argv[2]} storage at {sys.argv[3]}")
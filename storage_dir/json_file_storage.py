@@ -0,0 +1,127 @@
+import copy
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+from classes_dir.morning_routine_class import RoutineHeader
+from storage_dir.base_storage import BaseStorage
+from storage_dir.json_stream import iter_legacy_records
+
+
+def read_legacy_file(file_name: str, errors: Optional[List[str]] = None) -> Dict[int, dict]:
+    """Read the single-file routines_data.json layout into per-user records.
+
+    Parsed user by user, so a damaged record only loses that user; problems
+    are printed and appended to `errors`.
+    """
+    errors = errors if errors is not None else []
+    records = dict(iter_legacy_records(file_name, errors))
+    for error in errors:
+        print(f"[LOAD] {file_name}: {error}")
+    return records
+
+
+def import_legacy_file(file_name: str, store: BaseStorage, batch_size: int = 500) -> int:
+    """Stream routines_data.json into `store`, `batch_size` users per write.
+
+    Only one batch is held in memory; returns the number of users imported.
+    """
+    errors: List[str] = []
+    batch: Dict[int, dict] = {}
+    imported = 0
+    for chat_id, record in iter_legacy_records(file_name, errors):
+        batch[chat_id] = record
+        if len(batch) >= batch_size:
+            store.write(batch)
+            imported += len(batch)
+            batch = {}
+    if batch:
+        store.write(batch)
+        imported += len(batch)
+    for error in errors:
+        print(f"[LOAD] {file_name}: {error}")
+    return imported
+
+
+class JsonFileStorage(BaseStorage):
+    """Original backend: every write rewrites the whole routines_data.json"""
+
+    def __init__(self, file_name: str):
+        super().__init__()
+        self.file_name = file_name
+        self.records: Dict[int, dict] = {}
+        # Handlers hydrate users while the index loads in a worker thread: parse once
+        self.load_lock = threading.Lock()
+        self.loaded = False
+
+    def is_empty(self) -> bool:
+        return not os.path.exists(self.file_name)
+
+    def write(self, records: Dict[int, Optional[dict]]) -> None:
+        # Never rewrite the file before the users already in it are known
+        self._ensure_loaded()
+        for chat_id, record in records.items():
+            if record is None:
+                self.records.pop(chat_id, None)
+            else:
+                self.records[chat_id] = record
+
+        data = {
+            'routines': {
+                str(chat_id): record['routine']
+                for chat_id, record in self.records.items()
+            },
+            'user_replies': {
+                str(chat_id): record['user_replies']
+                for chat_id, record in self.records.items()
+                if record.get('user_replies')
+            },
+            'fsm': {
+                str(chat_id): record['fsm']
+                for chat_id, record in self.records.items()
+                if record.get('fsm')
+            }
+        }
+        tmp_path = self.file_name + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.file_name)
+
+    def _read(self) -> None:
+        """Parse the file into self.records; callers hold load_lock"""
+        errors: List[str] = []
+        self.records = read_legacy_file(self.file_name, errors)
+        self.loaded = True
+        if errors:
+            # The next write drops what couldn't be read: keep the original around
+            backup = f"{self.file_name}.corrupt-{int(time.time())}"
+            shutil.copy2(self.file_name, backup)
+            print(f"[LOAD] {len(errors)} damaged entries, kept {len(self.records)} users; original saved to {backup}")
+
+    def load_all(self) -> Dict[int, dict]:
+        with self.load_lock:
+            self._read()
+        # Copies: the whole file is encoded from self.records in a worker thread
+        return copy.deepcopy(self.records)
+
+    def _ensure_loaded(self) -> None:
+        # A single JSON document can't be read partially: parse it once, hydrate from memory
+        if self.loaded:
+            return
+        with self.load_lock:
+            if not self.loaded and os.path.exists(self.file_name):
+                self._read()
+            self.loaded = True
+
+    def load_headers(self) -> Dict[int, dict]:
+        self._ensure_loaded()
+        return {chat_id: RoutineHeader.from_routine_dict(record['routine']).to_dict()
+                for chat_id, record in self.records.items()}
+
+    def load_record(self, chat_id: int) -> Optional[dict]:
+        self._ensure_loaded()
+        record = self.records.get(chat_id)
+        return copy.deepcopy(record) if record is not None else None
@@ -0,0 +1,230 @@
+import json
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+STRING_BODY = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+STRUCTURAL = re.compile(r'[{}\[\]"]')
+SECTIONS = ('routines', 'user_replies', 'fsm')
+
+
+class TruncatedError(ValueError):
+    pass
+
+
+class _Reader:
+    """Chunked cursor over a JSON file; only the unconsumed tail is buffered"""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.consumed = 0  # Characters dropped from the front of buf
+
+    @property
+    def offset(self) -> int:
+        return self.consumed + self.pos
+
+    def fill(self) -> bool:
+        """Read another chunk. False at end of file"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def release(self) -> None:
+        """Drop everything before pos (call only between values)"""
+        self.consumed += self.pos
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Next non-whitespace character, '' at end of file"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self.release()
+            if not self.fill():
+                return ''
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"expected {chars!r} at offset {self.offset}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def read_string(self) -> str:
+        self.expect('"')
+        while True:
+            match = STRING_BODY.match(self.buf, self.pos)
+            if match:
+                raw = self.buf[self.pos - 1:match.end()]
+                self.pos = match.end()
+                return json.loads(raw)
+            if not self.fill():
+                raise TruncatedError(f"unterminated string at offset {self.offset}")
+
+    def value_text(self) -> str:
+        """Raw text of the next value, found by bracket matching without parsing it"""
+        self.peek()
+        start = self.pos
+        depth = 0
+        i = start
+        while True:
+            if depth == 0 and i > start:
+                break
+            char = self.buf[i] if i < len(self.buf) else ''
+            if not char:
+                if not self.fill():
+                    raise TruncatedError(f"value starting at offset {self.consumed + start} is truncated")
+                continue
+            if char in '{[':
+                depth += 1
+                i += 1
+            elif char == '"' and depth == 0:
+                match = STRING_BODY.match(self.buf, i + 1)
+                if not match:
+                    if not self.fill():
+                        raise TruncatedError(f"unterminated string at offset {self.consumed + i}")
+                    continue
+                i = match.end()
+                break
+            elif depth == 0:
+                # Scalar: runs until the next delimiter
+                end = i
+                while end < len(self.buf) and self.buf[end] not in ',}]' + WHITESPACE:
+                    end += 1
+                if end == len(self.buf) and self.fill():
+                    continue
+                i = end
+                break
+            else:
+                match = STRUCTURAL.search(self.buf, i)
+                if not match:
+                    i = len(self.buf)
+                    continue
+                i = match.start()
+                char = self.buf[i]
+                if char == '"':
+                    body = STRING_BODY.match(self.buf, i + 1)
+                    if not body:
+                        if not self.fill():
+                            raise TruncatedError(f"unterminated string at offset {self.consumed + i}")
+                        continue
+                    i = body.end()
+                elif char in '{[':
+                    depth += 1
+                    i += 1
+                else:
+                    depth -= 1
+                    i += 1
+        self.pos = i
+        return self.buf[start:i]
+
+
+def iter_members(file_name: str, chunk_size: int = CHUNK_SIZE,
+                 sections: Tuple[str, ...] = SECTIONS) -> Iterator[tuple]:
+    """Stream (section, key, value, error) for each member of the wanted sections.
+
+    Accepts the usual {"routines": {...}, "user_replies": {...}} layout and
+    the oldest one where chat ids are top-level keys (section 'routines').
+    Only one member is held in memory at a time. A member that fails to
+    parse is reported with value None and the error text, and streaming
+    carries on with the next one; a truncated file ends the stream after
+    reporting where it stopped.
+    """
+    with open(file_name, 'r') as f:
+        reader = _Reader(f, chunk_size)
+        try:
+            reader.expect('{')
+            if reader.peek() == '}':
+                return
+            while True:
+                top_key = reader.read_string()
+                reader.expect(':')
+                if top_key in SECTIONS and reader.peek() == '{':
+                    if top_key in sections:
+                        yield from _iter_section(reader, top_key)
+                    else:
+                        # Skip member by member so an unwanted section is never buffered whole
+                        for _ in _iter_section(reader, top_key, parse=False):
+                            pass
+                elif top_key.lstrip('-').isdigit():
+                    if 'routines' in sections:
+                        yield _parse_member(reader, 'routines', top_key)
+                    else:
+                        reader.value_text()
+                else:
+                    reader.value_text()
+                reader.release()
+                if reader.expect(',}') == '}':
+                    return
+        except ValueError as e:
+            yield (None, None, None, f"stopped at offset {reader.offset}: {e}")
+
+
+def _iter_section(reader: _Reader, section: str, parse: bool = True) -> Iterator[tuple]:
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+        return
+    while True:
+        key = reader.read_string()
+        reader.expect(':')
+        if parse:
+            yield _parse_member(reader, section, key)
+        else:
+            reader.value_text()
+        reader.release()
+        if reader.expect(',}') == '}':
+            return
+
+
+def _parse_member(reader: _Reader, section: str, key: str) -> tuple:
+    offset = reader.offset
+    text = reader.value_text()
+    try:
+        return section, key, json.loads(text), None
+    except ValueError as e:
+        return section, key, None, f"offset {offset}: {e}"
+
+
+def iter_legacy_records(file_name: str, errors: Optional[List[str]] = None,
+                        chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, dict]]:
+    """Stream (chat_id, record) pairs from routines_data.json with bounded memory.
+
+    Replies and FSM states are small and come after the routines, so a
+    first pass collects only them; the second pass yields one routine
+    record at a time. Bad members are appended to `errors` and skipped.
+    """
+    errors = errors if errors is not None else []
+    extras: Dict[str, Dict[str, object]] = {'user_replies': {}, 'fsm': {}}
+    for section, key, value, error in iter_members(file_name, chunk_size, sections=('user_replies', 'fsm')):
+        if error:
+            errors.append(f"{section}[{key}]: {error}" if key else f"side sections: {error}")
+        else:
+            extras[section][key] = value
+
+    for _, key, value, error in iter_members(file_name, chunk_size, sections=('routines',)):
+        if error:
+            errors.append(f"routines[{key}]: {error}" if key else f"routines: {error}")
+            continue
+        try:
+            chat_id = int(key)
+        except ValueError:
+            errors.append(f"routines[{key}]: chat id is not a number")
+            continue
+        if not isinstance(value, dict):
+            errors.append(f"routines[{key}]: expected an object, got {type(value).__name__}")
+            continue
+        yield chat_id, {'routine': value, 'user_replies': extras['user_replies'].get(key), 'fsm': extras['fsm'].get(key)}
@@ -0,0 +1,45 @@
+"""Rewrite every user's history in the deduplicated format (idempotent).
+
+Routines are migrated lazily when they are next saved; this converts all
+of them at once and reports the serialized size before and after.
+
+Usage:
+    python storage_dir/migrate_history.py sharded routines_data
+    python storage_dir/migrate_history.py sqlite routines_data.db
+"""
+import json
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from classes_dir.morning_routine_class import MorningRoutine
+from storage_dir.backends import create_storage
+
+
+def _size(record: dict) -> int:
+    return len(json.dumps(record, separators=(',', ':')))
+
+
+def migrate_history(backend: str, path: str) -> tuple:
+    storage = create_storage(backend, path)
+    try:
+        records = storage.load_all()
+        before = after = 0
+        for record in records.values():
+            before += _size(record)
+            record['routine'] = MorningRoutine.from_dict(record['routine']).to_dict()
+            after += _size(record)
+        storage.write(records)
+    finally:
+        storage.close()
+    return len(records), before, after
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    count, before, after = migrate_history(sys.argv[1], sys.argv[2])
+    saved = 100 - after * 100 // before if before else 0
+    print(f"Migrated {count} users: {before // 1024} KB -> {after // 1024} KB ({saved}% smaller)")
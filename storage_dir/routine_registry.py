@@ -0,0 +1,193 @@
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Optional
+
+from classes_dir.morning_routine_class import MorningRoutine, RoutineHeader
+
+# Rough in-memory cost of a hydrated routine (CPython objects, not JSON bytes)
+ROUTINE_BASE_BYTES = 2500
+TASK_BYTES = 900  # Live task or interned task definition
+HISTORY_DAY_BYTES = 450  # Encoded day entry
+OFFSET_BYTES = 36  # One completion offset in a day's list
+COLUMN_DAY_BYTES = 17  # Completion, duration and flags slots per day of span
+
+
+def estimate_routine_bytes(routine: MorningRoutine) -> int:
+    history = routine.history
+    definition_tasks = sum(len(definition) for definition in history.defs)
+    return (ROUTINE_BASE_BYTES + TASK_BYTES * (len(routine.tasks) + definition_tasks) +
+            HISTORY_DAY_BYTES * len(history) + OFFSET_BYTES * history.estimated_tasks() +
+            COLUMN_DAY_BYTES * len(history.flags))
+
+
+class RoutineRegistry(MutableMapping):
+    """Drop-in for the routines dict that hydrates users lazily.
+
+    Startup only needs the compact headers (timezone, window, flags) for
+    every user. A full MorningRoutine is loaded from the store the first
+    time a handler or the scheduler indexes it, and kept in an LRU bounded
+    by `memory_budget` bytes. Headers are never evicted, and neither are
+    routines with unflushed changes (`is_pinned`) or never saved at all.
+    Backends that hold every record themselves (json, journal) gain
+    nothing from the budget beyond the routine objects.
+    """
+
+    def __init__(self, store, on_hydrate: Optional[Callable[[int, dict], None]] = None,
+                 memory_budget: int = 64 * 1024 * 1024, is_pinned: Optional[Callable[[int], bool]] = None,
+                 on_evict: Optional[Callable[[int], None]] = None):
+        self.store = store
+        self.on_hydrate = on_hydrate
+        self.on_evict = on_evict  # Called once an evicted routine is gone, not while a coroutine still holds it
+        self.memory_budget = memory_budget
+        self.is_pinned = is_pinned or (lambda chat_id: False)
+        self.headers: Dict[int, RoutineHeader] = {}
+        self.routines: OrderedDict[int, MorningRoutine] = OrderedDict()  # LRU order, oldest first
+        self.sizes: Dict[int, int] = {}
+        self.resident_bytes = 0
+        # Evicted objects a coroutine may still hold; reused instead of re-reading the store
+        self.evicted: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self.deleted: set[int] = set()  # Tombstones until the store forgets them
+        self.unsaved: set[int] = set()  # Created here, never saved: nothing to re-hydrate from
+        self.headers_loaded = False
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hydrations = 0
+
+    def install_headers(self, headers: Dict[int, dict]) -> None:
+        """Adopt headers from store.load_headers(); live routines win over stored ones"""
+        loaded = {chat_id: RoutineHeader.from_dict(header)
+                  for chat_id, header in headers.items() if chat_id not in self.deleted}
+        for chat_id, routine in self.routines.items():
+            loaded[chat_id] = RoutineHeader.from_routine(routine)
+        self.headers = loaded
+        self.headers_loaded = True
+
+    def _admit(self, chat_id: int, routine: MorningRoutine) -> None:
+        """Make routine resident (most recently used) and account for its size"""
+        self.routines[chat_id] = routine
+        self.routines.move_to_end(chat_id)
+        size = estimate_routine_bytes(routine)
+        self.resident_bytes += size - self.sizes.get(chat_id, 0)
+        self.sizes[chat_id] = size
+        self._evict()
+
+    def _forget(self, chat_id: int) -> Optional[MorningRoutine]:
+        routine = self.routines.pop(chat_id, None)
+        self.resident_bytes -= self.sizes.pop(chat_id, 0)
+        return routine
+
+    def _evict(self) -> None:
+        """Drop least recently used routines until under the memory budget"""
+        if self.resident_bytes <= self.memory_budget:
+            return
+        # Never the most recently used one: that's the routine being accessed right now
+        for chat_id in list(self.routines)[:-1]:
+            if self.resident_bytes <= self.memory_budget:
+                break
+            if chat_id in self.unsaved or self.is_pinned(chat_id):
+                continue
+            routine = self._forget(chat_id)
+            if self.on_evict is not None:
+                finalizer = weakref.finalize(routine, self.on_evict, chat_id)
+                finalizer.atexit = False
+            self.evicted[chat_id] = routine
+            self.store.forget(chat_id)
+            self.evictions += 1
+
+    def _hydrate(self, chat_id: int) -> Optional[MorningRoutine]:
+        if chat_id in self.deleted:
+            return None
+        if self.headers_loaded and chat_id not in self.headers:
+            return None
+        routine = self.evicted.pop(chat_id, None)
+        if routine is not None:
+            # Still referenced somewhere: reuse it so no change is lost
+            self._admit(chat_id, routine)
+            return routine
+        record = self.store.load_record(chat_id)
+        if record is None:
+            return None
+        routine = MorningRoutine.from_dict(record['routine'])
+        self._admit(chat_id, routine)
+        if chat_id not in self.headers:
+            self.headers[chat_id] = RoutineHeader.from_routine(routine)
+        if self.on_hydrate is not None:
+            self.on_hydrate(chat_id, record)
+        self.hydrations += 1
+        return routine
+
+    def hydrate(self, chat_id: int) -> Optional[MorningRoutine]:
+        """Make chat_id's routine resident (most recently used); None if there is none"""
+        try:
+            return self[chat_id]
+        except KeyError:
+            return None
+
+    def refresh_header(self, chat_id: int) -> None:
+        """Re-derive header and size estimate after its routine changed"""
+        routine = self.routines.get(chat_id)
+        if routine is None:
+            routine = self.evicted.get(chat_id)
+            if routine is None:
+                return
+        self.unsaved.discard(chat_id)
+        self.headers[chat_id] = RoutineHeader.from_routine(routine)
+        self._admit(chat_id, routine)
+
+    def __getitem__(self, chat_id: int) -> MorningRoutine:
+        routine = self.routines.get(chat_id)
+        if routine is not None:
+            self.hits += 1
+            self.routines.move_to_end(chat_id)
+            return routine
+        self.misses += 1
+        routine = self._hydrate(chat_id)
+        if routine is None:
+            raise KeyError(chat_id)
+        return routine
+
+    def __contains__(self, chat_id) -> bool:
+        if chat_id in self.routines:
+            return True
+        if chat_id in self.deleted:
+            return False
+        if self.headers_loaded:
+            return chat_id in self.headers
+        return self._hydrate(chat_id) is not None
+
+    def __setitem__(self, chat_id: int, routine: MorningRoutine) -> None:
+        self.deleted.discard(chat_id)
+        self.unsaved.add(chat_id)
+        self.headers[chat_id] = RoutineHeader.from_routine(routine)
+        self._admit(chat_id, routine)
+
+    def __delitem__(self, chat_id: int) -> None:
+        if chat_id not in self:
+            raise KeyError(chat_id)
+        self._forget(chat_id)
+        self.unsaved.discard(chat_id)
+        self.evicted.pop(chat_id, None)
+        self.headers.pop(chat_id, None)
+        self.deleted.add(chat_id)
+
+    def __iter__(self):
+        return iter(list(self.headers if self.headers_loaded else self.routines))
+
+    def __len__(self) -> int:
+        return len(self.headers if self.headers_loaded else self.routines)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'users': len(self.headers),
+            'resident': len(self.routines),
+            'resident_kb': self.resident_bytes // 1024,
+            'budget_kb': self.memory_budget // 1024,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,124 @@
+import json
+import os
+from typing import Dict, Optional
+
+from classes_dir.morning_routine_class import RoutineHeader
+from storage_dir.base_storage import BaseStorage
+
+
+class ShardedStore(BaseStorage):
+    """Per-user JSON shards: only users marked dirty get rewritten.
+
+    Next to the shards lives an append-only header index (one JSON line per
+    header change) so startup can list users without opening every shard.
+    """
+
+    SHARD_SUFFIX = '.json'
+    INDEX_NAME = '_headers.jsonl'
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_path = os.path.join(self.directory, self.INDEX_NAME)
+        self.headers: Dict[int, dict] = {}
+        self.index_lines = 0
+
+    def shard_path(self, chat_id: int) -> str:
+        return os.path.join(self.directory, f"{chat_id}{self.SHARD_SUFFIX}")
+
+    def is_empty(self) -> bool:
+        return not any(name.endswith(self.SHARD_SUFFIX) for name in os.listdir(self.directory))
+
+    def write(self, records: Dict[int, Optional[dict]]) -> None:
+        """Write each record to its own shard; None removes the shard.
+
+        The header index is appended and fsynced before any shard changes,
+        so a crash never leaves a shard the index doesn't list; a listed
+        user without a shard loads as missing.
+        """
+        index_updates = []
+        shards = []
+        for chat_id, record in records.items():
+            if record is None:
+                if self.headers.pop(chat_id, None) is not None:
+                    index_updates.append({'c': chat_id, 'h': None})
+                shards.append((chat_id, None))
+                continue
+            shards.append((chat_id, json.dumps(record, separators=(',', ':'))))
+            header = RoutineHeader.from_routine_dict(record['routine']).to_dict()
+            if self.headers.get(chat_id) != header:
+                self.headers[chat_id] = header
+                index_updates.append({'c': chat_id, 'h': header})
+
+        if index_updates:
+            with open(self.index_path, 'a') as f:
+                f.write(''.join(json.dumps(u, separators=(',', ':')) + '\n' for u in index_updates))
+                f.flush()
+                os.fsync(f.fileno())
+            self.index_lines += len(index_updates)
+
+        for chat_id, data in shards:
+            path = self.shard_path(chat_id)
+            if data is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            # Atomic swap so a crash never leaves a half-written shard
+            os.replace(tmp_path, path)
+
+        if self.index_lines > 4 * len(self.headers) + 1000:
+            self.compact_index()
+
+    def compact_index(self) -> None:
+        """Rewrite the header index with one line per user"""
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for chat_id, header in self.headers.items():
+                f.write(json.dumps({'c': chat_id, 'h': header}, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self.index_path)
+        self.index_lines = len(self.headers)
+
+    def load_headers(self) -> Dict[int, dict]:
+        self.headers = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                for line in f:
+                    try:
+                        update = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line after a crash
+                    if update['h'] is None:
+                        self.headers.pop(update['c'], None)
+                    else:
+                        self.headers[update['c']] = update['h']
+        else:
+            # No index yet (upgrade from plain shards): build it once
+            for chat_id, record in self.load_all().items():
+                self.headers[chat_id] = RoutineHeader.from_routine_dict(record['routine']).to_dict()
+        self.compact_index()
+        return dict(self.headers)
+
+    def load_record(self, chat_id: int) -> Optional[dict]:
+        try:
+            with open(self.shard_path(chat_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load_all(self) -> Dict[int, dict]:
+        """Read every shard back; unreadable shards are reported and skipped"""
+        records = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SHARD_SUFFIX) or name == self.INDEX_NAME:
+                continue
+            try:
+                chat_id = int(name[:-len(self.SHARD_SUFFIX)])
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    records[chat_id] = json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"ERROR: Skipping shard {name}: {e}")
+        return records
@@ -0,0 +1,353 @@
+import datetime
+import json
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+from classes_dir import clock
+from classes_dir.morning_routine_class import RoutineHeader
+from classes_dir.routine_history import HISTORY_FORMAT, normalize_history
+from storage_dir.base_storage import BaseStorage
+
+# Scalar MorningRoutine.to_dict() fields stored as routines columns.
+# Anything else a newer to_dict() emits lands in the `extra` JSON column.
+ROUTINE_COLUMNS = [
+    'current_streak', 'best_streak', 'total_completions',
+    'routine_started', 'start_time', 'is_setup_complete',
+    'paused', 'pause_time', 'total_pause_duration',
+    'window_start', 'window_start_minute', 'window_end', 'window_end_minute',
+    'timezone', 'buffer_minutes', 'current_task_sent_at', 'in_buffer',
+    'awaiting_honesty_check', 'followup_enabled', 'followup_hour',
+    'followup_minute', 'followup_message', 'last_seen', 'blocked'
+]
+TASK_COLUMNS = ['name', 'duration', 'optional', 'notes', 'completed', 'completed_at', 'skipped']
+HISTORY_COLUMNS = ['completion', 'duration', 'missed', 'honest_fail']
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS routines (
+    chat_id INTEGER PRIMARY KEY,
+    {', '.join(ROUTINE_COLUMNS)},
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    chat_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    {', '.join(TASK_COLUMNS)},
+    PRIMARY KEY (chat_id, position)
+);
+CREATE TABLE IF NOT EXISTS history (
+    chat_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    {', '.join(HISTORY_COLUMNS)},
+    detail TEXT,
+    PRIMARY KEY (chat_id, day)
+);
+CREATE INDEX IF NOT EXISTS history_day ON history (day);
+CREATE TABLE IF NOT EXISTS task_defs (
+    chat_id INTEGER NOT NULL,
+    def_id INTEGER NOT NULL,
+    tasks TEXT NOT NULL,
+    PRIMARY KEY (chat_id, def_id)
+);
+CREATE TABLE IF NOT EXISTS user_replies (
+    chat_id INTEGER PRIMARY KEY,
+    replies TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fsm_states (
+    chat_id INTEGER PRIMARY KEY,
+    state TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS notified (
+    chat_id INTEGER PRIMARY KEY,
+    day TEXT NOT NULL,
+    rules TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notified_day ON notified (day);
+"""
+
+
+def _upsert_sql(table: str, key_columns: list, columns: list) -> str:
+    all_columns = key_columns + columns
+    updates = ', '.join(f"{c} = excluded.{c}" for c in columns)
+    return (
+        f"INSERT INTO {table} ({', '.join(all_columns)}) "
+        f"VALUES ({', '.join('?' for _ in all_columns)}) "
+        f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+    )
+
+
+def _entry_hash(entry: dict) -> int:
+    """Stand-in for a history day already written: compared, never stored in the database"""
+    return hash(json.dumps(entry, sort_keys=True))
+
+
+UPSERT_ROUTINE = _upsert_sql('routines', ['chat_id'], ROUTINE_COLUMNS + ['extra'])
+UPSERT_TASK = _upsert_sql('tasks', ['chat_id', 'position'], TASK_COLUMNS)
+UPSERT_HISTORY = _upsert_sql('history', ['chat_id', 'day'], HISTORY_COLUMNS + ['detail'])
+UPSERT_DEF = _upsert_sql('task_defs', ['chat_id', 'def_id'], ['tasks'])
+UPSERT_REPLIES = _upsert_sql('user_replies', ['chat_id'], ['replies'])
+UPSERT_FSM = _upsert_sql('fsm_states', ['chat_id'], ['state', 'data'])
+UPSERT_NOTIFIED = _upsert_sql('notified', ['chat_id'], ['day', 'rules'])
+
+
+class SqliteStorage(BaseStorage):
+    """SQLite backend in WAL mode: a flush is a handful of row UPSERTs per changed user"""
+
+    def __init__(self, db_file: str):
+        super().__init__()
+        self.db_file = db_file
+        # Flushes run in a worker thread; the lock serialises access
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Databases created before a column was added get it appended
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(routines)")}
+        for column in ROUTINE_COLUMNS:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE routines ADD COLUMN {column}")
+        # Hydration reads on its own connection (WAL lets it run beside a flush), so a
+        # handler on the event loop never waits for the write lock
+        self.reader = sqlite3.connect(db_file, check_same_thread=False)
+        self.read_lock = threading.Lock()
+        self.generation = 0  # Bumped by every write: tells a load whether its snapshot is still current
+        # Per resident user: task count, definition count and a hash of each history day on disk
+        self._task_counts: Dict[int, int] = {}
+        self._def_counts: Dict[int, int] = {}
+        self._history_state: Dict[int, Dict[str, int]] = {}
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM routines LIMIT 1").fetchone() is None
+
+    def write(self, records: Dict[int, Optional[dict]]) -> None:
+        with self.lock:
+            try:
+                with self.conn:
+                    for chat_id, record in records.items():
+                        if record is None:
+                            self._delete_user(chat_id)
+                        else:
+                            self._write_user(chat_id, record)
+            except BaseException:
+                # Rolled back, but the caches already count these rows as written:
+                # drop them so the retried flush rewrites the users in full
+                for chat_id in records:
+                    self.forget(chat_id)
+                raise
+            finally:
+                self.generation += 1
+
+    def _delete_user(self, chat_id: int) -> None:
+        for table in ('routines', 'tasks', 'history', 'task_defs', 'user_replies', 'fsm_states', 'notified'):
+            self.conn.execute(f"DELETE FROM {table} WHERE chat_id = ?", (chat_id,))
+        self._task_counts.pop(chat_id, None)
+        self._def_counts.pop(chat_id, None)
+        self._history_state.pop(chat_id, None)
+
+    def forget(self, chat_id: int) -> None:
+        # No lock: called from the event loop, and a flush in progress only keeps a valid state
+        self._task_counts.pop(chat_id, None)
+        self._def_counts.pop(chat_id, None)
+        self._history_state.pop(chat_id, None)
+
+    def _write_user(self, chat_id: int, record: dict) -> None:
+        routine = record['routine']
+
+        extra = {k: v for k, v in routine.items()
+                 if k not in ROUTINE_COLUMNS and k not in ('chat_id', 'tasks', 'history', 'notified')}
+        self.conn.execute(
+            UPSERT_ROUTINE,
+            [chat_id] + [routine.get(c) for c in ROUTINE_COLUMNS] + [json.dumps(extra) if extra else None]
+        )
+
+        # Tasks: at most 15 rows, upsert all and trim any leftover tail
+        tasks = routine.get('tasks', [])
+        self.conn.executemany(
+            UPSERT_TASK,
+            [[chat_id, position] + [task.get(c) for c in TASK_COLUMNS] for position, task in enumerate(tasks)]
+        )
+        if self._task_counts.get(chat_id, -1) != len(tasks):
+            self.conn.execute("DELETE FROM tasks WHERE chat_id = ? AND position >= ?", (chat_id, len(tasks)))
+            self._task_counts[chat_id] = len(tasks)
+
+        # Task definitions are append-only; only new versions are inserted
+        history = normalize_history(routine.get('history'))
+        defs = history['defs']
+        stored_defs = self._def_counts.get(chat_id, 0)
+        if stored_defs != len(defs):
+            self.conn.executemany(
+                UPSERT_DEF,
+                [(chat_id, def_id, json.dumps(defs[def_id])) for def_id in range(min(stored_defs, len(defs)), len(defs))]
+            )
+            self.conn.execute("DELETE FROM task_defs WHERE chat_id = ? AND def_id >= ?", (chat_id, len(defs)))
+            self._def_counts[chat_id] = len(defs)
+
+        # History: only days that are new or changed since the last write. Without
+        # state (user evicted since), rows are rewritten from scratch
+        known = self._history_state.get(chat_id)
+        if known is None:
+            self.conn.execute("DELETE FROM history WHERE chat_id = ?", (chat_id,))
+            known = self._history_state[chat_id] = {}
+        days = history['days']
+        for day, entry in days.items():
+            digest = _entry_hash(entry)
+            if known.get(day) == digest:
+                continue
+            detail = {k: v for k, v in entry.items() if k not in HISTORY_COLUMNS}
+            self.conn.execute(
+                UPSERT_HISTORY,
+                [chat_id, day] + [entry.get(c) for c in HISTORY_COLUMNS] + [json.dumps(detail)]
+            )
+            known[day] = digest
+        for day in [d for d in known if d not in days]:
+            self.conn.execute("DELETE FROM history WHERE chat_id = ? AND day = ?", (chat_id, day))
+            del known[day]
+
+        if record.get('user_replies'):
+            self.conn.execute(UPSERT_REPLIES, (chat_id, json.dumps(record['user_replies'])))
+        else:
+            self.conn.execute("DELETE FROM user_replies WHERE chat_id = ?", (chat_id,))
+
+        notified = routine.get('notified')
+        if notified:
+            self.conn.execute(UPSERT_NOTIFIED, (chat_id, notified['day'], json.dumps(notified['rules'])))
+        else:
+            self.conn.execute("DELETE FROM notified WHERE chat_id = ?", (chat_id,))
+
+        fsm = record.get('fsm')
+        if fsm:
+            self.conn.execute(UPSERT_FSM, (chat_id, fsm.get('state'), json.dumps(fsm.get('data') or {})))
+        else:
+            self.conn.execute("DELETE FROM fsm_states WHERE chat_id = ?", (chat_id,))
+
+    def _load(self, where: str = "", params: tuple = ()) -> Dict[int, dict]:
+        """Build full records for every user matching `where` (a chat_id filter)"""
+        records: Dict[int, dict] = {}
+        history_state: Dict[int, Dict[str, int]] = {}
+        with self.read_lock:
+            generation = self.generation
+            self.reader.execute("BEGIN")  # One snapshot across all tables
+            try:
+                self._read_rows(records, history_state, where, params)
+            finally:
+                self.reader.rollback()
+
+        for chat_id, record in records.items():
+            # SQLite hands booleans back as 0/1
+            routine = record['routine']
+            for flag in ('routine_started', 'is_setup_complete', 'paused', 'in_buffer',
+                         'awaiting_honesty_check', 'followup_enabled', 'blocked'):
+                routine[flag] = bool(routine.get(flag))
+            for task in routine['tasks']:
+                for flag in ('optional', 'completed', 'skipped'):
+                    task[flag] = bool(task.get(flag))
+
+        # The write caches describe what is on disk: only adopt them if no flush ran
+        # or is running since the snapshot; otherwise the next write rewrites in full
+        if self.lock.acquire(blocking=False):
+            try:
+                if self.generation == generation:
+                    for chat_id, record in records.items():
+                        self._task_counts[chat_id] = len(record['routine']['tasks'])
+                        self._def_counts[chat_id] = len(record['routine']['history']['defs'])
+                        self._history_state[chat_id] = history_state.get(chat_id, {})
+            finally:
+                self.lock.release()
+        return records
+
+    def _read_rows(self, records: Dict[int, dict], history_state: Dict[int, Dict[str, int]],
+                   where: str, params: tuple) -> None:
+        """Fill `records` and the history day hashes from the read connection"""
+        for row in self.reader.execute(
+                f"SELECT chat_id, {', '.join(ROUTINE_COLUMNS)}, extra FROM routines{where}", params):
+            chat_id = row[0]
+            routine = dict(zip(ROUTINE_COLUMNS, row[1:-1]))
+            if row[-1]:
+                routine.update(json.loads(row[-1]))
+            routine['chat_id'] = chat_id
+            routine['tasks'] = []
+            routine['history'] = {'format': HISTORY_FORMAT, 'defs': [], 'days': {}}
+            routine['notified'] = None
+            records[chat_id] = {'routine': routine, 'user_replies': None, 'fsm': None}
+
+        for row in self.reader.execute(
+                f"SELECT chat_id, {', '.join(TASK_COLUMNS)} FROM tasks{where} ORDER BY chat_id, position", params):
+            if row[0] in records:
+                records[row[0]]['routine']['tasks'].append(dict(zip(TASK_COLUMNS, row[1:])))
+
+        for row in self.reader.execute(
+                f"SELECT chat_id, day, {', '.join(HISTORY_COLUMNS)}, detail FROM history{where} ORDER BY chat_id, day",
+                params):
+            if row[0] not in records:
+                continue
+            entry = {c: v for c, v in zip(HISTORY_COLUMNS, row[2:-1]) if v is not None}
+            for flag in ('missed', 'honest_fail'):
+                if flag in entry:
+                    entry[flag] = bool(entry[flag])
+            entry.update(json.loads(row[-1]) if row[-1] else {})
+            records[row[0]]['routine']['history']['days'][row[1]] = entry
+            history_state.setdefault(row[0], {})[row[1]] = _entry_hash(entry)
+
+        for chat_id, tasks in self.reader.execute(
+                f"SELECT chat_id, tasks FROM task_defs{where} ORDER BY chat_id, def_id", params):
+            if chat_id in records:
+                records[chat_id]['routine']['history']['defs'].append(json.loads(tasks))
+
+        for chat_id, replies in self.reader.execute(f"SELECT chat_id, replies FROM user_replies{where}", params):
+            if chat_id in records:
+                records[chat_id]['user_replies'] = json.loads(replies)
+
+        for chat_id, day, rules in self.reader.execute(f"SELECT chat_id, day, rules FROM notified{where}", params):
+            if chat_id in records:
+                records[chat_id]['routine']['notified'] = {'day': day, 'rules': json.loads(rules)}
+
+        for chat_id, state, data in self.reader.execute(f"SELECT chat_id, state, data FROM fsm_states{where}", params):
+            if chat_id in records:
+                records[chat_id]['fsm'] = {'state': state, 'data': json.loads(data) if data else {}}
+
+    def load_all(self) -> Dict[int, dict]:
+        return self._load()
+
+    def load_record(self, chat_id: int) -> Optional[dict]:
+        return self._load(" WHERE chat_id = ?", (chat_id,)).get(chat_id)
+
+    def load_headers(self) -> Dict[int, dict]:
+        columns = [f for f in RoutineHeader.FIELDS if f not in ('last_day', 'notified')]
+        headers = {}
+        with self.lock:
+            for row in self.conn.execute(f"SELECT {', '.join(columns)} FROM routines"):
+                header = dict(zip(columns, row))
+                for flag in ('is_setup_complete', 'routine_started', 'awaiting_honesty_check', 'followup_enabled',
+                             'blocked'):
+                    header[flag] = bool(header[flag])
+                header['last_day'] = None
+                header['notified'] = None
+                headers[header['chat_id']] = header
+            # Served from the (chat_id, day) primary key index
+            for chat_id, last_day in self.conn.execute("SELECT chat_id, MAX(day) FROM history GROUP BY chat_id"):
+                if chat_id in headers:
+                    headers[chat_id]['last_day'] = last_day
+            # Same fallback as RoutineHeader.from_routine_dict for rows saved without last_seen
+            if any(header['last_seen'] is None for header in headers.values()):
+                for chat_id, day in self.conn.execute(
+                        "SELECT chat_id, MAX(day) FROM history WHERE completion > 0 GROUP BY chat_id"):
+                    if chat_id in headers and headers[chat_id]['last_seen'] is None:
+                        headers[chat_id]['last_seen'] = day
+            # Marks only count on the user's current local day, which is never before
+            # yesterday in UTC: older rows are expired, so only active users are read
+            cutoff = (clock.now(datetime.timezone.utc).date() - datetime.timedelta(days=1)).isoformat()
+            with self.conn:
+                self.conn.execute("DELETE FROM notified WHERE day < ?", (cutoff,))
+            for chat_id, day, rules in self.conn.execute("SELECT chat_id, day, rules FROM notified WHERE day >= ?", (cutoff,)):
+                if chat_id in headers:
+                    headers[chat_id]['notified'] = {'day': day, 'rules': json.loads(rules)}
+        return headers
+
+    def close(self) -> None:
+        with self.read_lock:
+            self.reader.close()
+        with self.lock:
+            self.conn.close()
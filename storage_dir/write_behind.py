@@ -0,0 +1,101 @@
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class WriteBehindQueue:
+    """Coalesces dirty marks and flushes them to the store off the event loop.
+
+    Callers only mark a chat_id dirty. Every `flush_interval` seconds the
+    dirty set is snapshotted on the loop (cheap `to_dict`) and encoded and
+    written in a worker thread, so handlers never wait on disk I/O.
+    """
+
+    def __init__(self, store, build_record: Callable[[int], Optional[dict]], flush_interval: float = 2.0):
+        self.store = store
+        self.build_record = build_record
+        self.flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.in_flight: set[int] = set()  # Being written by the worker thread right now
+        # Metrics
+        self.flush_count = 0
+        self.records_written = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Users changed since the last flush"""
+        return len(self.store.dirty)
+
+    def mark_dirty(self, chat_id: int) -> None:
+        self.store.mark_dirty(chat_id)
+
+    def is_pending(self, chat_id: int) -> bool:
+        """True until chat_id's latest changes are on disk"""
+        return chat_id in self.store.dirty or chat_id in self.in_flight
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[WRITE-BEHIND] Flush failed: {e}")
+
+    async def flush(self) -> int:
+        """Write every dirty user now. Returns number of records written"""
+        async with self._flush_lock:
+            dirty = self.store.pop_dirty()
+            if not dirty:
+                return 0
+
+            # Snapshot on the loop so the thread never sees a half-mutated routine
+            records = {chat_id: self.build_record(chat_id) for chat_id in dirty}
+
+            started = time.perf_counter()
+            self.in_flight = dirty
+            try:
+                await asyncio.to_thread(self.store.write, records)
+            except Exception:
+                # Keep them queued for the next attempt
+                self.store.dirty.update(dirty)
+                raise
+            finally:
+                self.in_flight = set()
+            latency = time.perf_counter() - started
+
+            self.flush_count += 1
+            self.records_written += len(records)
+            self.last_flush_latency = latency
+            self.total_flush_latency += latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            return len(records)
+
+    async def stop(self) -> None:
+        """Cancel the background flusher and write anything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        avg = self.total_flush_latency / self.flush_count if self.flush_count else 0.0
+        return {
+            'queue_depth': self.queue_depth,
+            'flush_count': self.flush_count,
+            'records_written': self.records_written,
+            'last_flush_ms': self.last_flush_latency * 1000,
+            'avg_flush_ms': avg * 1000,
+            'max_flush_ms': self.max_flush_latency * 1000
+        }